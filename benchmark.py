@@ -0,0 +1,448 @@
+"""
+Benchmarks for the server's hot paths, run in-process against a synthetic project.
+
+    python benchmark.py --size small                  # 1k files, checked against the baseline
+    python benchmark.py --size large --keep           # 100k files, keep the generated project
+    python benchmark.py --size small --update-baseline
+
+Each benchmark reports latency percentiles and the peak Python heap of one
+extra traced run. Results are written to JSON and compared with
+benchmark_baseline.json; the exit status is 1 when something regressed.
+
+A baseline is only meaningful on the machine that recorded it (it notes
+which one). Elsewhere, record a local one with --update-baseline first or
+raise --tolerance.
+"""
+from typing import Callable, Dict, List, Optional
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+SIZES = {"small": 1_000, "medium": 10_000, "large": 100_000}
+
+# -> Shape of the synthetic project, on top of the file count of the size
+DEEP_TREE_DEPTH = 64
+BIG_FILE_LINES = 50_000
+BLOB_SIZE = 1024 * 1024
+BLOBS_PER_1K_FILES = 2
+MARKER = "BENCH_MARKER"
+
+# -> Differences below this many ms or KB are noise, whatever the ratio
+LATENCY_SLACK_MS = 5.0
+MEMORY_SLACK_KB = 256
+
+# -> `import main` must stay under this, baseline or not, to keep --reload restarts quick
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", 1000))
+
+IMPORT_PROBE = """
+import resource, time
+started = time.perf_counter()
+import main
+print(time.perf_counter() - started, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+# ===========================================
+# Synthetic projects
+# ===========================================
+
+def python_source(rng: random.Random, functions: int) -> str:
+    lines = ["import os", "import sys", "from typing import Dict, List", ""]
+    for i in range(functions):
+        if i % 10 == 0:
+            lines += ["", f"class Widget{i}:", f'    """Widget number {i}."""', ""]
+            indent = "    "
+        lines += [
+            f"{indent}def handle_{i}(self, value: int = {rng.randint(0, 999)}) -> int:",
+            f"{indent}    total = value * {rng.randint(2, 9)}",
+            f"{indent}    for item in range({rng.randint(1, 50)}):",
+            f"{indent}        total += item % {rng.randint(2, 7)}",
+            f"{indent}    return total",
+            "",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def big_python_source(rng: random.Random) -> str:
+    # Roughly BIG_FILE_LINES lines, with the marker the update benchmarks edit near the end
+    source = python_source(rng, BIG_FILE_LINES // 6 - 2)
+    return source + f"\n{MARKER} = 0\n"
+
+
+def generate_project(root: str, files: int, seed: int = 0) -> Dict[str, str]:
+    """
+    Write a synthetic project: `files` small Python/text files spread over
+    nested packages, one DEEP_TREE_DEPTH-level chain of directories, one
+    BIG_FILE_LINES-line Python file and some binary blobs, committed to git.
+    Returns the paths the benchmarks work on.
+    """
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    per_dir = 50
+    for i in range(files):
+        package = os.path.join(root, f"pkg{i // (per_dir * per_dir)}", f"mod{i // per_dir % per_dir}")
+        os.makedirs(package, exist_ok=True)
+        if i % 5 == 4:
+            with open(os.path.join(package, f"notes{i}.md"), "w") as file:
+                file.write(f"# Notes {i}\n\n" + "Lorem ipsum dolor sit amet.\n" * rng.randint(5, 40))
+        else:
+            with open(os.path.join(package, f"file{i}.py"), "w") as file:
+                file.write(python_source(rng, rng.randint(2, 12)))
+
+    deep = root
+    for level in range(DEEP_TREE_DEPTH):
+        deep = os.path.join(deep, f"level{level}")
+        os.makedirs(deep, exist_ok=True)
+        with open(os.path.join(deep, "node.py"), "w") as file:
+            file.write(python_source(rng, 2))
+
+    blobs = os.path.join(root, "assets")
+    os.makedirs(blobs, exist_ok=True)
+    for i in range(max(1, files // 1000 * BLOBS_PER_1K_FILES)):
+        with open(os.path.join(blobs, f"blob{i}.bin"), "wb") as file:
+            file.write(rng.randbytes(BLOB_SIZE))
+
+    big_file = os.path.join(root, "big_module.py")
+    with open(big_file, "w") as file:
+        file.write(big_python_source(rng))
+    small_file = os.path.join(root, "small_module.py")
+    with open(small_file, "w") as file:
+        file.write(python_source(rng, 20) + f"\n{MARKER} = 0\n")
+
+    subprocess.run(["git", "init", "-q", "-b", "main", root], check=True)
+    # -> The server commits too, so the identity has to live in the repo config
+    subprocess.run(["git", "config", "user.name", "bench"], cwd=root, check=True)
+    subprocess.run(["git", "config", "user.email", "bench@example.com"], cwd=root, check=True)
+    subprocess.run(["git", "add", "-A"], cwd=root, check=True)
+    subprocess.run(["git", "commit", "-q", "-m", "Synthetic project"], cwd=root, check=True)
+    return {"root": root, "big_file": big_file, "small_file": small_file}
+
+
+def marker_line(path: str) -> int:
+    with open(path, "r") as file:
+        for i, line in enumerate(file):
+            if line.startswith(MARKER):
+                return i
+    raise ValueError(f"No {MARKER} in {path}")
+
+
+# ===========================================
+# Running
+# ===========================================
+
+def offline_llm(system_instruction: str, user_input: str) -> str:
+    return "Benchmark snapshot"
+
+
+class Runner:
+    def __init__(self, client, repeat: int):
+        self.client = client
+        self.repeat = repeat
+        self.results: Dict[str, Dict] = {}
+
+    def call(self, method: str, url: str, **kwargs):
+        response = self.client.request(method, url, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url} -> {response.status_code}: {response.text[:200]}")
+        return response
+
+    def measure(
+        self,
+        name: str,
+        method: str,
+        url: str,
+        setup: Optional[Callable[[int], dict]] = None,
+        repeat: Optional[int] = None,
+        warmup: bool = True,
+        **kwargs,
+    ) -> None:
+        """
+        Time `repeat` requests (after one warmup unless `warmup=False`, e.g.
+        for cold caches), then run one more under tracemalloc for the peak
+        heap. `setup(i)` runs untimed before each request and may return
+        extra request kwargs.
+        """
+        repeat = repeat or self.repeat
+
+        def request(i: int) -> float:
+            extra = setup(i) if setup else {}
+            started = time.perf_counter()
+            self.call(method, url, **{**kwargs, **extra})
+            return (time.perf_counter() - started) * 1000
+
+        iteration = 0
+        if warmup:
+            request(iteration)
+            iteration += 1
+        timings = []
+        for _ in range(repeat):
+            timings.append(request(iteration))
+            iteration += 1
+
+        tracemalloc.start()
+        try:
+            request(iteration)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        timings.sort()
+        self.results[name] = {
+            "runs": len(timings),
+            "min_ms": round(timings[0], 3),
+            "p50_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            "max_ms": round(timings[-1], 3),
+            "peak_kb": round(peak / 1024, 1),
+        }
+        print(f"  {name:<32} p50 {self.results[name]['p50_ms']:>10.2f} ms   peak {self.results[name]['peak_kb']:>10.1f} KB")
+
+
+def measure_import(repeat: int) -> Dict:
+    """
+    Time `import main` in fresh interpreters, the cost paid on every start
+    and --reload. Peak memory is the interpreter's max RSS (tracemalloc
+    would multiply the import time).
+    """
+    env = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))}
+    timings, peaks = [], []
+    for _ in range(repeat + 1):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE], env=env, check=True, capture_output=True, text=True
+        ).stdout.split()
+        timings.append(float(output[-2]) * 1000)
+        peaks.append(int(output[-1]))
+    # The first run pays for cold .pyc files and disk caches
+    timings, peak_kb = sorted(timings[1:]), max(peaks[1:])
+    result = {
+        "runs": len(timings),
+        "min_ms": round(timings[0], 3),
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "max_ms": round(timings[-1], 3),
+        "peak_kb": float(peak_kb),
+    }
+    print(f"  {'import_main':<32} p50 {result['p50_ms']:>10.2f} ms   peak {result['peak_kb']:>10.1f} KB")
+    return result
+
+
+def run_benchmarks(project: Dict[str, str], repeat: int) -> Dict[str, Dict]:
+    # The app reads its cache and store locations at import time
+    import commit_message
+    import main
+    from fastapi.testclient import TestClient
+
+    commit_message.llm_backend = offline_llm
+    client = TestClient(main.app)
+    runner = Runner(client, repeat)
+    root, big_file, small_file = project["root"], project["big_file"], project["small_file"]
+
+    runner.call("POST", "/add-project/bench")
+    runner.call("POST", "/set-project-root/bench", params={"filepath": root})
+    runner.call("POST", "/select-project/bench")
+
+    # Outline, the cold call waiting on the warm-up that selecting the project started
+    runner.measure("project_outline_cold", "GET", "/project-outline", repeat=1, warmup=False)
+    runner.call("GET", "/project-status", params={"wait": 600})
+    runner.measure("project_status", "GET", "/project-status")
+    runner.measure("project_outline_warm", "GET", "/project-outline")
+    runner.measure("project_outline_budget", "GET", "/project-outline", params={"max_tokens": 4000})
+    runner.measure("project_outline_stream", "GET", "/project-outline", params={"stream": True})
+
+    # Reads
+    runner.measure("file_small", "GET", "/file", params={"filepath": small_file})
+    runner.measure("file_big_streamed", "GET", "/file", params={"filepath": big_file})
+    runner.measure("file_big_text", "GET", "/file", params={"filepath": big_file, "stream": True})
+    runner.measure(
+        "file_big_lines", "GET", "/file",
+        params={"filepath": big_file, "start_line": BIG_FILE_LINES // 2, "end_line": BIG_FILE_LINES // 2 + 100},
+    )
+    runner.measure("files_batch", "POST", "/files", json={"files": [os.path.join(root, "pkg0", "mod0", "*")]})
+    runner.measure("context", "GET", "/context", params={"query": "widget handle total value", "max_tokens": 4000})
+
+    # Updates, each one toggling the marker line so the file keeps its shape
+    for label, path in (("small", small_file), ("big", big_file)):
+        runner.measure(
+            f"update_file_exact_{label}", "POST", "/update-file",
+            setup=lambda i, path=path: {"json": {
+                "filepath": path, "use_fuzzy_match": False,
+                "updates": [{"content_to_match": f"{MARKER} =", "new_content": f"{MARKER} = {i}", "action": "modify"}],
+            }},
+        )
+        runner.measure(
+            f"update_file_fuzzy_{label}", "POST", "/update-file",
+            setup=lambda i, path=path: {"json": {
+                "filepath": path, "use_fuzzy_match": True,
+                "updates": [{"content_to_match": "BENCH_MARKR = 1", "new_content": f"{MARKER} = {i}", "action": "modify"}],
+            }},
+        )
+        line = marker_line(path)
+        runner.measure(
+            f"update_file_at_lines_{label}", "POST", "/update-file-at-lines",
+            setup=lambda i, path=path, line=line: {"json": {
+                "filepath": path,
+                "updates": [{"line_number": line, "new_content": f"{MARKER} = {i}", "action": "modify"}],
+            }},
+        )
+        # The last function plus the marker, matched as one block around the stale marker value
+        with open(path, "r") as file:
+            block = "".join(file.readlines()[line - 7:line]).lstrip("\n")
+        runner.measure(
+            f"update_file_block_{label}", "POST", "/update-file",
+            setup=lambda i, path=path, block=block: {"json": {
+                "filepath": path, "use_fuzzy_match": True,
+                "updates": [{
+                    "content_to_match": f"{block}{MARKER} = -1", "new_content": f"{block}{MARKER} = {i}",
+                    "action": "modify",
+                }],
+            }},
+        )
+
+    # Git
+    runner.measure("git_current_branch", "GET", "/current-git-branch")
+    runner.measure("git_list_branches", "GET", "/list-git-branches")
+    runner.measure("git_uncommitted_changes", "GET", "/uncommitted-git-changes")
+
+    def touch(i: int) -> dict:
+        runner.call("POST", "/update-file-at-lines", json={
+            "filepath": small_file,
+            "updates": [{"line_number": marker_line(small_file), "new_content": f"{MARKER} = -{i}", "action": "modify"}],
+        })
+        return {}
+
+    runner.measure("git_commit", "POST", "/create-git-commit", setup=touch, json={"commit_message": "Benchmark commit"})
+
+    runner.measure("rollback_update", "POST", "/rollback-update", setup=touch)
+
+    def touch_then_rollback(i: int) -> dict:
+        touch(i)
+        runner.call("POST", "/rollback-update")
+        return {}
+
+    runner.measure("redo_update", "POST", "/redo-update", setup=touch_then_rollback)
+    runner.measure("edit_history", "GET", "/edit-history")
+    runner.measure(
+        "git_create_branch", "POST", "/create-git-branch",
+        setup=lambda i: {"json": {"branch_name": f"bench-{i}"}},
+    )
+    runner.measure("git_switch_branch", "POST", "/switch-git-branch", json={"branch_name": "main"})
+    runner.measure(
+        "git_delete_branch", "DELETE", "/delete-git-branch",
+        setup=lambda i: {"json": {"branch_name": f"bench-{i}"}},
+    )
+    return runner.results
+
+
+# ===========================================
+# Baselines
+# ===========================================
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """
+    Benchmarks whose median latency or peak heap grew more than `tolerance`
+    (a ratio) over the baseline, ignoring differences within the slack.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        for key, slack in (("p50_ms", LATENCY_SLACK_MS), ("peak_kb", MEMORY_SLACK_KB)):
+            limit = reference[key] * (1 + tolerance) + slack
+            if result[key] > limit:
+                regressions.append(f"{name}: {key} {result[key]} > {reference[key]} (limit {round(limit, 1)})")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    parser.add_argument("--repeat", type=int, default=5, help="timed requests per benchmark")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed growth over the baseline, as a ratio")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--workdir", help="where to generate the project (a temp dir by default)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated project and caches")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="code-assistant-bench-")
+    root = os.path.join(workdir, "project")
+    os.environ["CODE_ASSISTANT_CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ["CODE_ASSISTANT_PROJECTS_DB"] = os.path.join(workdir, "projects.db")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    try:
+        print(f"Generating {SIZES[args.size]} files in {root}")
+        started = time.perf_counter()
+        if os.path.exists(root):
+            shutil.rmtree(root)
+        project = generate_project(root, SIZES[args.size])
+        print(f"  generated in {time.perf_counter() - started:.1f} s")
+
+        print("Running benchmarks")
+        results = {"import_main": measure_import(args.repeat)}
+        results.update(run_benchmarks(project, args.repeat))
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    machine = {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+    report = {
+        "size": args.size,
+        "files": SIZES[args.size],
+        **machine,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "results": results,
+    }
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+
+    try:
+        with open(args.baseline, "r") as file:
+            baselines = json.load(file)
+    except (OSError, ValueError):
+        baselines = {}
+
+    if args.update_baseline:
+        baselines[args.size] = {"recorded_on": machine, "results": results}
+        with open(args.baseline, "w") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"Baseline for '{args.size}' updated in {args.baseline}")
+        return 0
+
+    regressions = []
+    if results["import_main"]["p50_ms"] > IMPORT_TIME_BUDGET_MS:
+        regressions.append(f"import_main: p50_ms {results['import_main']['p50_ms']} > budget {IMPORT_TIME_BUDGET_MS}")
+    if args.size in baselines:
+        baseline = baselines[args.size]
+        if baseline["recorded_on"] != machine:
+            print(f"Note: the '{args.size}' baseline was recorded on another machine ({baseline['recorded_on']})")
+        regressions += compare(results, baseline["results"], args.tolerance)
+    else:
+        print(f"No baseline for '{args.size}' yet, run with --update-baseline to record one")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions and args.size in baselines:
+        print(f"No regressions against the '{args.size}' baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+from typing import Callable, Dict, List, Optional
+from collections import OrderedDict
+import asyncio
+import importlib
+import os
+import time
+
+from metrics import record_cache, record_llm
+from response_shaping import CHARS_PER_TOKEN
+from storage import content_hash
+
+
+# -> Rough budget for the diff sent to the LLM, in tokens
+DIFF_TOKEN_BUDGET = int(os.getenv("COMMIT_MESSAGE_TOKEN_BUDGET", 3000))
+COMMIT_MESSAGE_TIMEOUT = float(os.getenv("COMMIT_MESSAGE_TIMEOUT", 10))
+CACHE_SIZE = 256
+
+# -> "module:function" of an llm(system_instruction=..., user_input=...) stand-in, e.g. for offline runs
+LLM_BACKEND = os.getenv("COMMIT_MESSAGE_LLM", "chat_completion_utils:llm")
+
+SYSTEM_INSTRUCTION = "Generate a brief Git commit message based on the following diff. Do not include introductory text or explain what you have done. Only output the commit message you generate."
+
+llm_backend: Optional[Callable[..., str]] = None
+_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+# ===========================================
+# Diff trimming
+# ===========================================
+
+def split_diff(diff: str) -> List[str]:
+    sections, current = [], []
+    for line in diff.splitlines(keepends=True):
+        if line.startswith("diff --git ") and current:
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+
+def budget_diff(diff: str, budget_tokens: int = DIFF_TOKEN_BUDGET) -> str:
+    """
+    Trim a diff to roughly `budget_tokens`, giving every file a fair share.
+    Files smaller than their share hand the remainder to the larger ones.
+    """
+    budget = budget_tokens * CHARS_PER_TOKEN
+    sections = split_diff(diff)
+    if sum(len(section) for section in sections) <= budget:
+        return diff
+
+    kept: Dict[int, str] = {}
+    remaining = sorted(range(len(sections)), key=lambda i: len(sections[i]))
+    while remaining:
+        share = budget // len(remaining)
+        i = remaining.pop(0)
+        section = sections[i]
+        if len(section) > share:
+            section = _trim_section(section, share)
+        kept[i] = section
+        budget -= len(section)
+    return "".join(kept[i] for i in range(len(sections)))
+
+
+def _trim_section(section: str, limit: int) -> str:
+    lines = section.splitlines(keepends=True)
+    kept, size = [], 0
+    # Always keep the first line so the file name survives even a tiny share
+    for line in lines:
+        if size + len(line) > limit and kept:
+            break
+        kept.append(line)
+        size += len(line)
+    trimmed = len(lines) - len(kept)
+    if trimmed:
+        kept.append(f"... [{trimmed} more lines trimmed]\n")
+    return "".join(kept)
+
+
+def diffstat_message(diff: str) -> str:
+    """
+    Deterministic message built from the diffstat, used when the LLM is
+    slow or unavailable.
+    """
+    files, added, removed = [], 0, 0
+    for section in split_diff(diff):
+        header = section.split("\n", 1)[0].split(" b/", 1)
+        if len(header) == 2:
+            files.append(header[1])
+        for line in section.splitlines():
+            if line.startswith("+") and not line.startswith("+++"):
+                added += 1
+            elif line.startswith("-") and not line.startswith("---"):
+                removed += 1
+    if not files:
+        return "Update files"
+    names = ", ".join(files) if len(files) <= 3 else f"{len(files)} files"
+    return f"Update {names} (+{added} -{removed})"
+
+
+# ===========================================
+# Generation
+# ===========================================
+
+def get_llm_backend() -> Callable[..., str]:
+    global llm_backend
+    if llm_backend is None:
+        module_name, attr = LLM_BACKEND.split(":")
+        # -> openai is slow to import; configure it only once an LLM is actually needed
+        try:
+            openai = importlib.import_module("openai")
+            openai.api_key = os.getenv("OPENAI_API_KEY")
+        except ImportError:
+            pass
+        llm_backend = getattr(importlib.import_module(module_name), attr)
+    return llm_backend
+
+
+def generate_commit_message(diff: str) -> str:
+    message = get_llm_backend()(system_instruction=SYSTEM_INSTRUCTION, user_input=budget_diff(diff))
+    return message.strip()
+
+
+def _remember(key: str, message: str) -> None:
+    _cache[key] = message
+    _cache.move_to_end(key)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+async def commit_message_for(diff: str, timeout: float = COMMIT_MESSAGE_TIMEOUT) -> str:
+    """
+    Commit message for a staged diff: cached by diff hash, generated in a
+    worker thread, and replaced by the diffstat message if the LLM fails or
+    takes longer than `timeout`. A late answer still lands in the cache.
+    """
+    key = content_hash(diff.encode("utf-8"))
+    if key in _cache:
+        _cache.move_to_end(key)
+        record_cache("commit_message", hit=True)
+        return _cache[key]
+    record_cache("commit_message", hit=False)
+
+    task = asyncio.ensure_future(asyncio.to_thread(generate_commit_message, diff))
+
+    def on_done(done: asyncio.Future) -> None:
+        if not done.cancelled() and done.exception() is None and done.result():
+            _remember(key, done.result())
+
+    task.add_done_callback(on_done)
+    started = time.perf_counter()
+    try:
+        message = await asyncio.wait_for(asyncio.shield(task), timeout)
+    except asyncio.TimeoutError:
+        record_llm("timeout", time.perf_counter() - started)
+        return diffstat_message(diff)
+    except Exception:
+        record_llm("error", time.perf_counter() - started)
+        return diffstat_message(diff)
+    record_llm("ok", time.perf_counter() - started)
+    return message or diffstat_message(diff)
@@ -0,0 +1,159 @@
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import math
+import os
+import time
+
+from metrics import coalesced_requests, rejected_requests
+
+
+class Overloaded(Exception):
+    """
+    A route already runs and queues as many calls as it may; try again in
+    `retry_after` seconds.
+    """
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Too many {name} requests at once, retry in {retry_after} s.")
+        self.name, self.retry_after = name, retry_after
+
+
+class SingleFlight:
+    """
+    Shares one computation between identical calls in flight at the same
+    time: the first call with a key runs it, the others await its result
+    (or exception). Nothing is kept once it's done.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _bind_loop(self) -> None:
+        # Futures belong to one event loop; start over if a new loop shows up
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self.inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, compute: Callable[[], Awaitable]):
+        self._bind_loop()
+        future = self.inflight.get(key)
+        if future is None:
+            future = self.inflight[key] = asyncio.ensure_future(compute())
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            coalesced_requests.inc(self.name)
+        # -> Shielded so one caller disconnecting doesn't cancel the others' result
+        return await asyncio.shield(future)
+
+
+class ConcurrencyLimit:
+    """
+    Lets at most `limit` calls run at once and `queue` more wait for their
+    turn; any call beyond that fails right away with `Overloaded`, with a
+    retry delay estimated from how long recent calls took.
+    """
+
+    def __init__(self, name: str, limit: int, queue: int):
+        self.name, self.limit, self.queue = name, limit, queue
+        self.average = 1.0  # seconds per call, moving average
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self.slots = asyncio.Semaphore(self.limit)
+            self.waiting = 0
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.average * (self.waiting + 1) / self.limit))
+
+    @asynccontextmanager
+    async def slot(self):
+        self._bind_loop()
+        if self.slots.locked() and self.waiting >= self.queue:
+            rejected_requests.inc(self.name)
+            raise Overloaded(self.name, self.retry_after())
+
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.average += (time.monotonic() - started - self.average) * 0.2
+            self.slots.release()
+
+    async def run(self, compute: Callable[[], Awaitable]):
+        async with self.slot():
+            return await compute()
+
+
+class FileLocks:
+    """
+    Serializes writers of the same file. `hold(paths)` locks a set of files
+    (in a fixed order, so batches can't deadlock); `hold_all()` waits for
+    every holder to finish and keeps new ones out, for changes whose files
+    aren't known up front.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self.locks: Dict[str, asyncio.Lock] = {}
+            self.users: Dict[str, int] = {}
+            self.holders = 0
+            self.exclusive = False
+            self.changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def hold(self, paths: Iterable[str]):
+        self._bind_loop()
+        paths = sorted({os.path.realpath(path) for path in paths})
+        async with self.changed:
+            await self.changed.wait_for(lambda: not self.exclusive)
+            self.holders += 1
+        registered, acquired = [], []
+        try:
+            for path in paths:
+                lock = self.locks.setdefault(path, asyncio.Lock())
+                self.users[path] = self.users.get(path, 0) + 1
+                registered.append(path)
+                await lock.acquire()
+                acquired.append(path)
+            yield
+        finally:
+            for path in reversed(acquired):
+                self.locks[path].release()
+            for path in registered:
+                self.users[path] -= 1
+                if not self.users[path]:
+                    # -> Only files someone holds or waits for keep a lock around
+                    del self.users[path], self.locks[path]
+            async with self.changed:
+                self.holders -= 1
+                self.changed.notify_all()
+
+    @asynccontextmanager
+    async def hold_all(self):
+        self._bind_loop()
+        async with self.changed:
+            await self.changed.wait_for(lambda: not self.exclusive)
+            self.exclusive = True
+            await self.changed.wait_for(lambda: self.holders == 0)
+        try:
+            yield
+        finally:
+            async with self.changed:
+                self.exclusive = False
+                self.changed.notify_all()
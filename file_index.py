@@ -0,0 +1,403 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import os
+import pickle
+import threading
+import time
+import uuid
+
+from metrics import span
+from project_files import walk_project
+from storage import project_cache_dir
+
+
+# -> Bigger files and binaries are left out of the text indexes
+MAX_INDEXED_FILE_SIZE = 1024 * 1024
+
+# -> Seconds from the end of one background stat walk to the start of the next
+REFRESH_INTERVAL = float(os.getenv("INDEX_REFRESH_INTERVAL", 2.0))
+# -> A project nobody queried for this long is no longer walked, until its next query
+IDLE_TIMEOUT = 600.0
+
+# -> Files indexed between two releases of an index's lock, so queries aren't held up by a big refresh
+UPDATE_BATCH = 256
+
+# -> An index log bigger than this share of its snapshot (and COMPACT_MIN_BYTES) is folded into a new snapshot
+COMPACT_RATIO = 0.5
+COMPACT_MIN_BYTES = 1024 * 1024
+
+Stat = Tuple[int, int]  # (mtime_ns, size)
+
+
+def read_text(file_path: str, size: int) -> Optional[str]:
+    """
+    Text of a file to index, or None when it's too big, binary or unreadable.
+    """
+    if size > MAX_INDEXED_FILE_SIZE:
+        return None
+    try:
+        with open(file_path, "rb") as file:
+            data = file.read()
+    except OSError:
+        return None
+    if b"\0" in data[:8192]:
+        return None
+    return data.decode("utf-8", "replace")
+
+
+# ===========================================
+# Project files
+# ===========================================
+
+class ProjectFiles:
+    """
+    (mtime, size) of every non-ignored file of a project, kept current by
+    one stat walk per refresh whose changes are queued on every index
+    subscribed to it, instead of each index walking the tree itself. While
+    the project is queried, refreshes run on a background thread every
+    REFRESH_INTERVAL seconds, so requests never wait on a walk once the
+    first one is done; files the server writes itself are queued right away.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = threading.Lock()
+        self.stats: Dict[str, Stat] = {}
+        self.indexes: List["FileIndex"] = []
+        self.synced: set = set()  # ids of the indexes that saw a whole walk
+        self.walked_at: Optional[float] = None
+        self.used_at = 0.0
+        self.error: Optional[str] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    def subscribe(self, index: "FileIndex") -> None:
+        # -> The index catches up at its first query, not here, so creating one stays cheap
+        with self.lock:
+            self.indexes.append(index)
+
+    def ensure_current(self, index: Optional["FileIndex"] = None) -> None:
+        """
+        Called before each query: walks right away only on first use (or
+        after IDLE_TIMEOUT), then leaves it to the background thread.
+        """
+        self.used_at = time.monotonic()
+        if self.thread is None or (index is not None and id(index) not in self.synced):
+            with self.lock:
+                if self.thread is None:
+                    if self.walked_at is None or time.monotonic() - self.walked_at > REFRESH_INTERVAL:
+                        self._refresh()
+                    if not self.stopped.is_set():
+                        self.thread = threading.Thread(target=self._run, name=f"index refresh {self.root}", daemon=True)
+                        self.thread.start()
+                self._sync_new()
+
+    def refresh(self) -> None:
+        with self.lock:
+            self._refresh()
+
+    def written(self, relpaths: Iterable[str]) -> None:
+        for relpath in relpaths:
+            # -> New files are left to the walk, which knows the ignore rules
+            if relpath not in self.stats:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.root, relpath))
+            except OSError:
+                changed, removed = {}, [relpath]
+            else:
+                changed, removed = {relpath: (stat.st_mtime_ns, stat.st_size)}, []
+                self.stats[relpath] = changed[relpath]
+            for index in self.indexes:
+                if id(index) in self.synced:
+                    index.apply(changed, removed)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def _run(self) -> None:
+        while not self.stopped.wait(REFRESH_INTERVAL):
+            with self.lock:
+                if time.monotonic() - self.used_at > IDLE_TIMEOUT:
+                    break
+                try:
+                    self._refresh()
+                except Exception as e:
+                    # -> Retried at the next interval; the indexes keep what they had
+                    self.error = f"{type(e).__name__}: {e}"
+        with self.lock:
+            self.thread = None
+
+    def _refresh(self) -> None:
+        with span("project_files_refresh"):
+            stats = {}
+            for parts, entry, is_dir in walk_project(self.root):
+                if is_dir:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                stats["/".join(parts)] = (stat.st_mtime_ns, stat.st_size)
+
+            changed = {relpath: stat for relpath, stat in stats.items() if self.stats.get(relpath) != stat}
+            removed = [relpath for relpath in self.stats if relpath not in stats]
+            self.stats, self.walked_at = stats, time.monotonic()
+            for index in self.indexes:
+                if id(index) in self.synced:
+                    index.apply(changed, removed)
+            self._sync_new()
+            self.error = None
+
+    def _sync_new(self) -> None:
+        if self.walked_at is None:
+            return
+        for index in self.indexes:
+            if id(index) not in self.synced:
+                index.sync(self.stats)
+                self.synced.add(id(index))
+
+
+_project_files: Dict[str, ProjectFiles] = {}
+_project_files_lock = threading.Lock()
+
+
+def get_project_files(root: str) -> ProjectFiles:
+    with _project_files_lock:
+        files = _project_files.get(root)
+        if files is None:
+            files = _project_files[root] = ProjectFiles(root)
+        return files
+
+
+def files_written(paths: Iterable[str]) -> None:
+    """
+    Queue files the server wrote on the indexes of their projects, so the
+    next query sees them without waiting for the next background walk.
+    """
+    for path in paths:
+        path = os.path.abspath(path)
+        for root, files in list(_project_files.items()):
+            prefix = os.path.abspath(root).rstrip(os.sep) + os.sep
+            if path.startswith(prefix):
+                files.written([path[len(prefix):].replace(os.sep, "/")])
+
+
+def stop_refreshing() -> None:
+    for files in list(_project_files.values()):
+        files.stop()
+
+
+def per_project(factory: Callable[[str], "FileIndex"]) -> Callable[[str], "FileIndex"]:
+    """
+    A `get_*_index(root)` returning one shared index per project root.
+    """
+    instances: Dict[str, "FileIndex"] = {}
+    lock = threading.Lock()
+
+    def get(root: str):
+        with lock:
+            index = instances.get(root)
+            if index is None:
+                index = instances[root] = factory(root)
+            return index
+
+    return get
+
+
+# ===========================================
+# Indexes
+# ===========================================
+
+class FileIndex:
+    """
+    Base of the per-project indexes fed by ProjectFiles. Changes found by
+    a walk are only queued; the next query (`current()`) hands the files
+    that actually changed since they were indexed to `update()`. So a walk
+    costs nothing but stat calls, and a file saved over and over isn't
+    indexed again until someone asks.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = threading.Lock()
+        self.stats: Dict[str, Stat] = {}  # -> Filled in by subclasses when loading
+        self.queued: Dict[str, Optional[Stat]] = {}  # relpath -> new (mtime, size), or None once removed
+        self.queue_lock = threading.Lock()
+        # -> One query applies the queue while the others wait for it
+        self.update_lock = threading.Lock()
+
+    def subscribe(self) -> None:
+        # -> Called by subclasses once loaded
+        get_project_files(self.root).subscribe(self)
+
+    def wants(self, relpath: str) -> bool:
+        return True
+
+    def current(self) -> None:
+        get_project_files(self.root).ensure_current(self)
+        with self.update_lock:
+            with self.queue_lock:
+                queued, self.queued = self.queued, {}
+            changed = {
+                relpath: stat for relpath, stat in queued.items()
+                if stat is not None and self.stats.get(relpath) != stat
+            }
+            removed = [relpath for relpath, stat in queued.items() if stat is None and relpath in self.stats]
+            if changed or removed:
+                self.update(changed, removed)
+
+    def sync(self, stats: Dict[str, Stat]) -> None:
+        """
+        Queue the difference with a whole walk, e.g. after loading from disk.
+        """
+        # -> Listed first: an index may also be fed from elsewhere, like the symbols of an outline parse
+        known = list(self.stats)
+        self.apply(
+            {relpath: stat for relpath, stat in stats.items() if self.stats.get(relpath) != stat},
+            [relpath for relpath in known if relpath not in stats],
+        )
+
+    def apply(self, changed: Dict[str, Stat], removed: Iterable[str]) -> None:
+        with self.queue_lock:
+            for relpath, stat in changed.items():
+                if self.wants(relpath):
+                    self.queued[relpath] = stat
+            for relpath in removed:
+                self.queued[relpath] = None
+
+    def update(self, changed: Dict[str, Stat], removed: List[str]) -> None:
+        raise NotImplementedError
+
+
+class LoggedFileIndex(FileIndex):
+    """
+    A FileIndex held in memory and persisted as a pickled snapshot plus an
+    append-only log of per-file records, so a changed file costs one
+    appended record rather than rewriting the whole index. The log is
+    folded into a new snapshot once it outgrows COMPACT_RATIO of it.
+    Subclasses turn a file into a picklable record (`read`), add or drop
+    records in memory (`_add`, `_drop`) and give their state to pickle
+    (`_state`, `_restore`).
+    """
+
+    INDEX_FILE = ""
+    INDEX_VERSION = 1
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.path = project_cache_dir(root) / self.INDEX_FILE
+        self.log_path = self.path.with_name(self.path.name + ".log")
+        self.generation = ""
+        self.snapshot_bytes = 0
+        self.log_bytes = 0
+        self._load()
+        self.subscribe()
+
+    # Hooks
+    # -------------------------------------------
+
+    def read(self, relpath: str, stat: Stat):
+        raise NotImplementedError
+
+    def _add(self, relpath: str, record) -> None:
+        raise NotImplementedError
+
+    def _drop(self, relpath: str) -> None:
+        raise NotImplementedError
+
+    def _state(self) -> Dict:
+        raise NotImplementedError
+
+    def _restore(self, state: Dict) -> None:
+        raise NotImplementedError
+
+    def _compact(self) -> None:
+        """
+        Tidy up in-memory leftovers of dropped records before a snapshot.
+        """
+
+    # Updates
+    # -------------------------------------------
+
+    def update(self, changed: Dict[str, Stat], removed: List[str]) -> None:
+        entries = [(relpath, None, None) for relpath in removed]
+        relpaths = list(changed)
+        for start in range(0, max(len(relpaths), 1), UPDATE_BATCH):
+            # -> Files are read outside the lock; only applying the records holds queries up
+            entries += [(relpath, changed[relpath], self.read(relpath, changed[relpath]))
+                        for relpath in relpaths[start:start + UPDATE_BATCH]]
+            with self.lock:
+                for relpath, stat, record in entries:
+                    self._replace(relpath, stat, record)
+                self._append(entries)
+            entries = []
+
+    def _replace(self, relpath: str, stat: Optional[Stat], record) -> None:
+        if relpath in self.stats:
+            self._drop(relpath)
+            del self.stats[relpath]
+        if stat is not None:
+            self._add(relpath, record)
+            self.stats[relpath] = stat
+
+    # Persistence
+    # -------------------------------------------
+
+    def _load(self) -> None:
+        try:
+            with self.path.open("rb") as file:
+                data = pickle.load(file)
+                self.snapshot_bytes = file.tell()
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return
+        if data.get("version") != self.INDEX_VERSION:
+            return
+        self.generation, self.stats = data["generation"], data["stats"]
+        self._restore(data["state"])
+
+        try:
+            with self.log_path.open("rb") as file:
+                if pickle.load(file) == (self.INDEX_VERSION, self.generation):
+                    while True:
+                        try:
+                            relpath, stat, record = pickle.load(file)
+                        except EOFError:
+                            return
+                        self._replace(relpath, stat, record)
+                        self.log_bytes = file.tell()
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            pass
+        # -> No usable log (or one cut short by a crash): the next update writes a new snapshot first
+        self.generation = ""
+
+    def _append(self, entries: List[Tuple]) -> None:
+        if not entries:
+            return
+        if not self.generation:
+            self._save()
+            return
+        data = b"".join(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL) for entry in entries)
+        with self.log_path.open("ab") as file:
+            file.write(data)
+        self.log_bytes += len(data)
+        if self.log_bytes > max(COMPACT_MIN_BYTES, COMPACT_RATIO * self.snapshot_bytes):
+            self._save()
+
+    def _save(self) -> None:
+        with span("index_snapshot"):
+            self._compact()
+            generation = uuid.uuid4().hex
+            tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            with tmp_path.open("wb") as file:
+                pickle.dump(
+                    {"version": self.INDEX_VERSION, "generation": generation, "stats": self.stats, "state": self._state()},
+                    file, protocol=pickle.HIGHEST_PROTOCOL,
+                )
+                snapshot_bytes = file.tell()
+            tmp_log = self.log_path.with_name(f"{self.log_path.name}.{os.getpid()}.tmp")
+            with tmp_log.open("wb") as file:
+                pickle.dump((self.INDEX_VERSION, generation), file, protocol=pickle.HIGHEST_PROTOCOL)
+            # -> Until the new log is in place the old one names the old generation, and is ignored
+            os.replace(tmp_path, self.path)
+            os.replace(tmp_log, self.log_path)
+            self.generation, self.snapshot_bytes, self.log_bytes = generation, snapshot_bytes, 0
@@ -0,0 +1,131 @@
+from typing import Iterator, List, Optional, Tuple
+import json
+import mmap
+import os
+import re
+
+
+# -> Files above this size are sent a chunk at a time instead of buffered into one JSON string
+STREAM_THRESHOLD = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def parse_byte_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=start-end` range into a half-open (start, stop)
+    pair. Returns None when the range can't be satisfied.
+    """
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header)
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        start, stop = max(0, size - int(last)), size
+    else:
+        start = int(first)
+        stop = size if last == "" else min(size, int(last) + 1)
+    if start >= size or start >= stop:
+        return None
+    return start, stop
+
+
+def iter_file_bytes(file_path: str, start: int = 0, stop: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Yield the bytes of a file between `start` and `stop` in chunks, backed
+    by mmap so nothing beyond one chunk is copied at a time.
+    """
+    with open(file_path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        stop = size if stop is None else min(stop, size)
+        if start >= stop:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset in range(start, stop, CHUNK_SIZE):
+                yield mm[offset:min(offset + CHUNK_SIZE, stop)]
+
+
+def iter_json_content(file_path: str) -> Iterator[str]:
+    """
+    The `{"content": ...}` JSON body of a whole file, produced a chunk at a
+    time so a large file is never held in memory as one string. The
+    content is the same as reading the file in text mode.
+    """
+    with open(file_path, "r") as file:
+        yield '{"content": "'
+        while True:
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield json.dumps(chunk, ensure_ascii=False)[1:-1]
+        yield '"}'
+
+
+def read_lines(file_path: str, start_line: int = 0, end_line: Optional[int] = None) -> str:
+    """
+    Return lines [start_line, end_line) of a file. Only the bytes up to
+    `end_line` are scanned, and only the requested ones are decoded.
+    """
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = _line_offset(mm, start_line, 0)
+            stop = len(mm) if end_line is None else _line_offset(mm, end_line - start_line, start)
+            return mm[start:stop].decode("utf-8")
+
+
+def read_lines_within(
+    file_path: str, start_line: int = 0, end_line: Optional[int] = None, max_chars: Optional[int] = None
+) -> Tuple[str, Optional[int]]:
+    """
+    Like read_lines, but stop before the line that would take the content past
+    `max_chars` bytes (at least one line is returned). Also returns the line
+    to continue from, or None when nothing requested was left out.
+    """
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return "", None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = _line_offset(mm, start_line, 0)
+            stop, line = start, start_line
+            while stop < len(mm) and (end_line is None or line < end_line):
+                newline = mm.find(b"\n", stop)
+                next_stop = len(mm) if newline == -1 else newline + 1
+                if max_chars is not None and line > start_line and next_stop - start > max_chars:
+                    break
+                stop, line = next_stop, line + 1
+            more = stop < len(mm) and (end_line is None or line < end_line)
+            return mm[start:stop].decode("utf-8"), line if more else None
+
+
+def split_lines(text: str) -> List[str]:
+    """
+    Lines of `text` with their line breaks, numbered the way read_lines and
+    read_lines_within count them: only "\n" ends a line, unlike str.splitlines.
+    """
+    lines = [line + "\n" for line in text.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def _line_offset(mm: mmap.mmap, count: int, offset: int) -> int:
+    for _ in range(max(0, count)):
+        newline = mm.find(b"\n", offset)
+        if newline == -1:
+            return len(mm)
+        offset = newline + 1
+    return offset
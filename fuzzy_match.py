@@ -0,0 +1,222 @@
+from typing import Dict, List, Optional, Tuple
+from collections import defaultdict
+import math
+
+
+# -> Slack for float rounding when a bound is compared with a rounded fuzz.ratio
+BOUND_EPSILON = 1e-7
+
+# Rabin-Karp over line hashes
+HASH_BASE = 1_000_003
+HASH_MOD = (1 << 61) - 1
+
+# -> Lines found more often than this ("else:", "return x") don't help locate a block
+MAX_ANCHOR_OCCURRENCES = 1024
+# -> Candidate regions of a block scored by the fuzzy fallback
+BLOCK_CANDIDATES = 8
+# -> Lines a candidate region's start and end may move by while it is scored
+MAX_BLOCK_SLACK = 3
+# -> Below this score the best region doesn't count as a match
+MIN_BLOCK_SCORE = 60
+# -> Share of a block's lines that need a close counterpart (rapidfuzz ratio >= MIN_SHARED_LINE_SCORE)
+# in a region for it to match at all, whichever fuzzywuzzy backend scores the region
+MIN_SHARED_LINES = 0.5
+MIN_SHARED_LINE_SCORE = 80
+
+
+def _ratio():
+    # fuzzywuzzy is only loaded once a fuzzy update actually happens
+    from fuzzywuzzy import fuzz
+    return fuzz.ratio
+
+
+def _bounds():
+    # rapidfuzz's ratio is 2 * LCS / total length. fuzz.ratio never exceeds it: python-Levenshtein
+    # computes the same value, and difflib's matching blocks form a common subsequence
+    from rapidfuzz import fuzz, process
+    return process, fuzz.ratio
+
+
+class FuzzyLineIndex:
+    """
+    Finds the line with the best `fuzz.ratio` against a query, without
+    scoring every line in Python. Built once per file and reused for every
+    update.
+
+    rapidfuzz scores every line in C with a ratio that is an upper bound
+    of `fuzz.ratio`. Only the lines whose bound can still beat the best
+    score so far are then scored for real, highest bound first. The result
+    is the same line a full scan would pick: the first one with the
+    highest score.
+    """
+
+    def __init__(self, lines: List[str]):
+        self.lines = lines
+
+    def best_match(self, query: str) -> Tuple[Optional[int], int]:
+        """
+        Return (line index, score) of the best match, or (None, 0) when no
+        line scores above zero.
+        """
+        if not query or not self.lines:
+            return None, 0
+        process, bound_ratio = _bounds()
+        ratio = _ratio()
+
+        # -> Any line that can round to at least 1 is a candidate
+        first = process.extractOne(query, self.lines, scorer=bound_ratio, score_cutoff=0.5 - BOUND_EPSILON)
+        if first is None:
+            return None, 0
+        best_index, best_score = first[2], ratio(query, self.lines[first[2]])
+        if best_score == 0:
+            best_index = None
+
+        cutoff = max(0.5, best_score - 0.5) - BOUND_EPSILON
+        candidates = process.extract(query, self.lines, scorer=bound_ratio, limit=None, score_cutoff=cutoff)
+        candidates.sort(key=lambda candidate: (-candidate[1], candidate[2]))
+        for _, bound, i in candidates:
+            # The highest fuzz.ratio this line could round to
+            ceiling = math.floor(bound + 0.5 + BOUND_EPSILON)
+            if ceiling < best_score:
+                break
+            if i == best_index or (ceiling == best_score and best_index is not None and i > best_index):
+                continue
+            score = ratio(query, self.lines[i])
+            if score > best_score or (score == best_score and score > 0 and i < best_index):
+                best_index, best_score = i, score
+
+        return best_index, best_score
+
+
+def normalize_line(line: str) -> str:
+    # Indentation and runs of whitespace don't matter when matching blocks
+    return " ".join(line.split())
+
+
+def block_lines(text: str) -> List[str]:
+    """
+    The normalized, non-blank lines of a block to match.
+    """
+    return [normalized for normalized in map(normalize_line, text.splitlines()) if normalized]
+
+
+class BlockIndex:
+    """
+    Finds multi-line blocks in a file, comparing normalized non-blank lines
+    so indentation, trailing spaces and blank lines don't matter. Built once
+    per file and reused for every update.
+
+    Exact occurrences are found with a Rabin-Karp rolling hash over per-line
+    hashes, in one linear pass. Otherwise `best_match` scores only a few
+    candidate regions: where lines of the block occur unchanged (each
+    voting for the start it implies), or else around the line closest to
+    the block's longest one. Spans are original line numbers, end-exclusive.
+    """
+
+    def __init__(self, lines: List[str]):
+        self.positions = [i for i, line in enumerate(lines) if line.strip()]
+        self.normalized = [normalize_line(lines[i]) for i in self.positions]
+        self.hashes = [hash(line) % HASH_MOD for line in self.normalized]
+        self._occurrences: Optional[Dict[str, List[int]]] = None
+        self._line_index: Optional[FuzzyLineIndex] = None
+
+    def _span(self, start: int, stop: int) -> Tuple[int, int]:
+        return self.positions[start], self.positions[stop - 1] + 1
+
+    def find_exact(self, block: List[str]) -> List[Tuple[int, int]]:
+        """
+        Spans of every non-overlapping exact occurrence of `block` (from
+        `block_lines`), first to last.
+        """
+        m, n = len(block), len(self.hashes)
+        if not m or m > n:
+            return []
+        target = window = 0
+        for i in range(m):
+            target = (target * HASH_BASE + hash(block[i]) % HASH_MOD) % HASH_MOD
+            window = (window * HASH_BASE + self.hashes[i]) % HASH_MOD
+        high = pow(HASH_BASE, m - 1, HASH_MOD)
+
+        spans, free_from = [], 0
+        for start in range(n - m + 1):
+            if start:
+                window = ((window - self.hashes[start - 1] * high) * HASH_BASE + self.hashes[start + m - 1]) % HASH_MOD
+            # -> Equal hashes are confirmed line by line, so collisions can't cause a false match
+            if window == target and start >= free_from and self.normalized[start:start + m] == block:
+                spans.append(self._span(start, start + m))
+                free_from = start + m
+        return spans
+
+    def best_match(
+        self, block: List[str], min_score: int = MIN_BLOCK_SCORE, min_shared: float = MIN_SHARED_LINES
+    ) -> Optional[Tuple[int, int, int]]:
+        """
+        (start, stop, score) of the region that best matches `block` by
+        `fuzz.ratio` over the joined normalized lines, or None when no
+        candidate reaches `min_score`. A region also needs to share at
+        least `min_shared` of the block's lines, give or take small edits,
+        so a long enough unrelated block can't get there on characters the
+        two happen to have in common.
+        """
+        m, n = len(block), len(self.normalized)
+        if not m or not n:
+            return None
+        ratio = _ratio()
+        process, line_ratio = _bounds()
+        query = "\n".join(block)
+        scores: Dict[Tuple[int, int], int] = {}
+
+        def score(start: int, stop: int) -> int:
+            if (start, stop) not in scores:
+                scores[start, stop] = ratio(query, "\n".join(self.normalized[start:stop])) if start < stop else 0
+            return scores[start, stop]
+
+        def shares_lines(start: int, stop: int) -> bool:
+            if not min_shared:
+                return True
+            region = self.normalized[start:stop]
+            shared = sum(
+                process.extractOne(line, region, scorer=line_ratio, score_cutoff=MIN_SHARED_LINE_SCORE) is not None
+                for line in block
+            )
+            return shared >= min_shared * m
+
+        slack = min(MAX_BLOCK_SLACK, max(1, m // 8))
+        best: Optional[Tuple[int, int, int]] = None
+        for anchor in self._candidates(block):
+            # Slide the window into place, then let its end grow or shrink
+            starts = range(max(0, anchor - slack), min(n - 1, anchor + slack) + 1)
+            start = max(starts, key=lambda s: score(s, min(n, s + m)))
+            stops = range(max(start + 1, start + m - slack), min(n, start + m + slack) + 1)
+            stop = max(stops, key=lambda e: score(start, e))
+            if (best is None or (score(start, stop), -start) > (best[2], -best[0])) and shares_lines(start, stop):
+                best = (start, stop, score(start, stop))
+
+        if best is None or best[2] < min_score:
+            return None
+        return (*self._span(best[0], best[1]), best[2])
+
+    def _candidates(self, block: List[str]) -> List[int]:
+        # Block starts implied by lines of the block found unchanged, most voted first
+        if self._occurrences is None:
+            self._occurrences = defaultdict(list)
+            for i, line in enumerate(self.normalized):
+                self._occurrences[line].append(i)
+        last = len(self.normalized) - 1
+        votes: Dict[int, float] = defaultdict(float)
+        for offset, line in enumerate(block):
+            found = self._occurrences.get(line, ())
+            if len(found) <= MAX_ANCHOR_OCCURRENCES:
+                # -> Rare lines count more, so a distinctive def line outweighs a few common ones.
+                # A late block line found near the top would imply a start before the file: clamp it
+                for i in found:
+                    votes[min(max(i - offset, 0), last)] += 1 / len(found)
+        if votes:
+            return sorted(votes, key=lambda start: (-votes[start], start))[:BLOCK_CANDIDATES]
+
+        # -> Every line changed: anchor on the closest match of the most distinctive one
+        if self._line_index is None:
+            self._line_index = FuzzyLineIndex(self.normalized)
+        offset = max(range(len(block)), key=lambda k: len(block[k]))
+        i, _ = self._line_index.best_match(block[offset])
+        return [] if i is None else [min(max(i - offset, 0), last)]
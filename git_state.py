@@ -0,0 +1,174 @@
+from typing import Dict, List, Optional, Tuple
+import ctypes
+import ctypes.util
+import os
+import struct
+
+
+# inotify(7) event bits
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+_libc = None
+
+
+def _inotify_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+class _Inotify:
+    """
+    Non-blocking inotify instance; `events()` drains what is pending
+    without waiting, so no thread is needed to follow it.
+    """
+
+    def __init__(self):
+        self.libc = _inotify_libc()
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths: Dict[int, str] = {}
+
+    def watch(self, path: str) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self.paths[wd] = path
+
+    def events(self) -> List[Tuple[Optional[str], int, str]]:
+        # -> (watched directory, mask, name); the directory is None on queue overflow
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "replace")
+                offset += length
+                events.append((self.paths.get(wd), mask, name))
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class GitStateWatcher:
+    """
+    Tells when a repository's HEAD, index or refs may have changed, as a
+    generation number that goes up with every change. Follows `HEAD`,
+    `index`, `packed-refs` and everything under `refs/` with inotify where
+    available, and otherwise compares their stat() results on every call.
+    """
+
+    def __init__(self, git_dir: str, common_dir: str):
+        self.git_dir = os.path.normpath(git_dir)
+        self.common_dir = os.path.normpath(common_dir)
+        self.refs_dir = os.path.join(self.common_dir, "refs")
+        # -> Directory -> names in it that matter (git replaces them by renaming a .lock file over them)
+        self.names: Dict[str, set] = {}
+        self.names.setdefault(self.git_dir, set()).update(("HEAD", "index"))
+        self.names.setdefault(self.common_dir, set()).add("packed-refs")
+        self.generation = 0
+        self.signature: Optional[Tuple] = None
+        self.inotify: Optional[_Inotify] = None
+        try:
+            self._start_inotify()
+        except (OSError, AttributeError):
+            # -> Not Linux or out of watches: poll instead
+            if self.inotify is not None:
+                self.inotify.close()
+            self.inotify = None
+            self.signature = self._signature()
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self.inotify is not None else "poll"
+
+    def current(self) -> int:
+        """
+        The generation, bumped first if anything changed since the last call.
+        """
+        if self.inotify is not None:
+            if self._changed_inotify():
+                self.generation += 1
+        else:
+            signature = self._signature()
+            if signature != self.signature:
+                self.signature = signature
+                self.generation += 1
+        return self.generation
+
+    # inotify
+    # -------------------------------------------
+
+    def _start_inotify(self) -> None:
+        self.inotify = _Inotify()
+        for directory in self.names:
+            self.inotify.watch(directory)
+        self._watch_tree(self.refs_dir)
+
+    def _watch_tree(self, top: str) -> None:
+        for dirpath, _, _ in os.walk(top):
+            self.inotify.watch(dirpath)
+
+    def _changed_inotify(self) -> bool:
+        changed = False
+        for directory, mask, name in self.inotify.events():
+            if directory is None or mask & IN_Q_OVERFLOW:
+                changed = True
+            elif directory in self.names:
+                changed = changed or name in self.names[directory]
+            elif not name.endswith(".lock"):
+                changed = True
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._watch_tree(os.path.join(directory, name))
+                    except OSError:
+                        pass
+        return changed
+
+    # Polling
+    # -------------------------------------------
+
+    def _signature(self) -> Tuple:
+        paths = [os.path.join(directory, name) for directory, names in self.names.items() for name in sorted(names)]
+        for dirpath, _, filenames in os.walk(self.refs_dir):
+            paths.append(dirpath)
+            paths.extend(os.path.join(dirpath, filename) for filename in filenames)
+
+        signature = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                signature.append((path, None))
+                continue
+            signature.append((path, stat.st_mtime_ns, stat.st_size, stat.st_ino))
+        return tuple(signature)
+
+    def close(self) -> None:
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
@@ -0,0 +1,314 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import os
+import time
+
+from commit_message import commit_message_for
+from git_state import GitStateWatcher
+from metrics import record_cache, record_subprocess
+
+
+# -> Seconds a cached `git status` is trusted for working tree changes made outside the server
+GIT_STATUS_TTL = float(os.getenv("GIT_STATUS_TTL", 2.0))
+
+
+# ===========================================
+# Repository
+# ===========================================
+
+# -> Global options whose value is the next argument, e.g. `git -c core.untrackedCache=true status`
+_OPTIONS_WITH_VALUE = {"-c", "-C", "--git-dir", "--work-tree", "--namespace"}
+
+
+def _subcommand(args) -> str:
+    # The metrics label of a git invocation: its first argument that isn't a global option or its value
+    args = iter(args)
+    for arg in args:
+        if arg in _OPTIONS_WITH_VALUE:
+            next(args, None)
+        elif not arg.startswith("-"):
+            return arg
+    return "git"
+
+
+class GitRepo:
+    """
+    Runs git for one repository without blocking the event loop.
+    Commands that write to the index or refs are serialized by a per-repo
+    lock. Branch and status queries are cached until HEAD, the index or
+    the refs change.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._git_dir: Optional[str] = None
+        self._common_dir: Optional[str] = None
+        self._watcher: Optional[GitStateWatcher] = None
+        self._cache: Dict[str, Tuple] = {}  # query -> (version, result, stored at)
+        self._status_options: Optional[List[str]] = None
+        self.worktree_version = 0
+
+    def _bind_loop(self) -> None:
+        # Locks belong to one event loop; start over if a new loop shows up
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        self._bind_loop()
+        return self._lock
+
+    async def run(self, *args: str, input: Optional[bytes] = None) -> Tuple[int, str, str]:
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            "git", *args,
+            cwd=self.root,
+            stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate(input)
+        record_subprocess(_subcommand(args), time.perf_counter() - started)
+        return process.returncode, stdout.decode("utf-8", "replace"), stderr.decode("utf-8", "replace")
+
+    async def run_locked(self, *args: str) -> Tuple[int, str, str]:
+        async with self.lock:
+            return await self.run(*args)
+
+    async def git_dirs(self) -> Tuple[str, str]:
+        if self._git_dir is None:
+            code, out, err = await self.run("rev-parse", "--git-dir", "--git-common-dir")
+            if code != 0:
+                raise RuntimeError(err.strip() or "Not a git repository.")
+            git_dir, common_dir = out.splitlines()
+            self._git_dir = os.path.join(self.root, git_dir)
+            self._common_dir = os.path.join(self.root, common_dir)
+        return self._git_dir, self._common_dir
+
+    # Cached state
+    # -------------------------------------------
+
+    async def generation(self) -> int:
+        """
+        A number that changes whenever HEAD, the index or any ref does.
+        """
+        if self._watcher is None:
+            self._watcher = GitStateWatcher(*await self.git_dirs())
+        return self._watcher.current()
+
+    async def _cached(self, query: str, compute):
+        generation = await self.generation()
+        hit = self._cache.get(query)
+        record_cache(f"git_{query}", hit is not None and hit[0] == generation)
+        if hit is not None and hit[0] == generation:
+            return hit[1]
+        result = await compute()
+        self._cache[query] = (generation, result, time.monotonic())
+        return result
+
+    async def status_options(self) -> List[str]:
+        """
+        `-c` options turning on the untracked cache and the builtin fsmonitor
+        where git supports them, unless the repository configures them itself.
+        """
+        if self._status_options is None:
+            _, out, _ = await self.run("config", "--get-regexp", r"^core\.(untrackedcache|fsmonitor)$")
+            configured = {line.split(" ", 1)[0].lower() for line in out.splitlines()}
+            options = []
+            if "core.untrackedcache" not in configured:
+                options += ["-c", "core.untrackedCache=true"]
+            if "core.fsmonitor" not in configured:
+                code, _, err = await self.run("fsmonitor--daemon", "status")
+                if "not supported" not in err and "not a git command" not in err:
+                    options += ["-c", "core.fsmonitor=true"]
+            self._status_options = options
+        return self._status_options
+
+    async def status(self) -> Tuple[int, str, str]:
+        """
+        `git status --porcelain`, reused while HEAD, the index and the refs
+        stay put, the server wrote no file and GIT_STATUS_TTL hasn't passed.
+        """
+        worktree_version = self.worktree_version
+        version = (await self.generation(), worktree_version)
+        hit = self._cache.get("status")
+        fresh = hit is not None and hit[0] == version and time.monotonic() - hit[2] < GIT_STATUS_TTL
+        record_cache("git_status", fresh)
+        if fresh:
+            return hit[1]
+
+        # -> Locked rather than --no-optional-locks, so status may save its index refresh and untracked cache
+        async with self.lock:
+            result = await self.run(*await self.status_options(), "status", "--porcelain")
+        if result[0] == 0:
+            # Taken after the run, since status rewriting the index is no reason to run it again
+            self._cache["status"] = ((await self.generation(), worktree_version), result, time.monotonic())
+        return result
+
+    # Refs
+    # -------------------------------------------
+
+    async def head(self) -> str:
+        """
+        Current branch name, or "HEAD" when detached (like `rev-parse --abbrev-ref HEAD`).
+        """
+        return await self._cached("head", self._read_head)
+
+    async def _read_head(self) -> str:
+        git_dir, _ = await self.git_dirs()
+        with open(os.path.join(git_dir, "HEAD"), "r") as file:
+            head = file.read().strip()
+        if head.startswith("ref: refs/heads/"):
+            return head[len("ref: refs/heads/"):]
+        return "HEAD"
+
+    async def branches(self) -> Optional[List[str]]:
+        """
+        Local branch names read from loose and packed refs, or None when the
+        ref storage can't be read directly.
+        """
+        return await self._cached("branches", self._read_branches)
+
+    async def _read_branches(self) -> Optional[List[str]]:
+        _, common_dir = await self.git_dirs()
+        if os.path.isdir(os.path.join(common_dir, "reftable")):
+            return None
+
+        names = set()
+        heads_dir = os.path.join(common_dir, "refs", "heads")
+        for dirpath, _, filenames in os.walk(heads_dir):
+            for filename in filenames:
+                names.add(os.path.relpath(os.path.join(dirpath, filename), heads_dir).replace(os.sep, "/"))
+        try:
+            with open(os.path.join(common_dir, "packed-refs"), "r") as file:
+                for line in file:
+                    parts = line.split()
+                    if len(parts) == 2 and parts[1].startswith("refs/heads/"):
+                        names.add(parts[1][len("refs/heads/"):])
+        except OSError:
+            pass
+        return sorted(names)
+
+
+_repos: Dict[str, GitRepo] = {}
+
+
+def get_repo(root: str) -> GitRepo:
+    root = os.path.abspath(root)
+    if root not in _repos:
+        _repos[root] = GitRepo(root)
+    return _repos[root]
+
+
+def worktree_changed(path: str) -> None:
+    """
+    Drop the cached status of every repository containing `path`, after the
+    server wrote to it.
+    """
+    path = os.path.abspath(path)
+    for root, repo in list(_repos.items()):
+        if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+            repo.worktree_version += 1
+
+
+# ===========================================
+# Commands
+# ===========================================
+
+def _failure(out: str, err: str) -> str:
+    output = err.strip() or out.strip()
+    return output.splitlines()[0] if output else "git exited with an error"
+
+
+async def git_commit(root: str, commit_message: Optional[str] = None) -> Dict[str, str]:
+    repo = get_repo(root)
+    try:
+        async with repo.lock:
+            code, out, err = await repo.run("add", "-A")
+            if code != 0:
+                return {"status": "error", "message": f"Error creating git commit: {_failure(out, err)}"}
+
+            code, _, _ = await repo.run("diff", "--staged", "--quiet")
+            if code == 0:
+                return {"status": "success", "message": "Nothing to commit."}
+
+            if not commit_message:
+                _, diff, _ = await repo.run("diff", "--staged")
+                commit_message = await commit_message_for(diff)
+
+            code, out, err = await repo.run("commit", "-m", commit_message)
+            if code != 0:
+                return {"status": "error", "message": f"Error creating git commit: {_failure(out, err)}"}
+        return {"status": "success", "message": "Git commit created successfully."}
+    except Exception as e:
+        return {"status": "error", "message": f"Error creating git commit: {e}"}
+
+
+async def git_list_branches(root: str) -> Dict[str, List[str]]:
+    repo = get_repo(root)
+    try:
+        names = await repo.branches()
+        if names is None:
+            code, out, err = await repo.run("branch")
+            if code != 0:
+                return {"status": "error", "message": f"Error getting the branch list: {_failure(out, err)}"}
+            branches = [b.strip() for b in out.strip().split("\n")]
+        else:
+            current = await repo.head()
+            branches = [f"* {name}" if name == current else name for name in names]
+        return {"status": "success", "branches": branches}
+    except Exception as e:
+        return {"status": "error", "message": f"Error getting the branch list: {e}"}
+
+
+async def git_create_branch(root: str, branch_name: str) -> Dict[str, str]:
+    try:
+        code, out, err = await get_repo(root).run_locked("checkout", "-b", branch_name)
+        if code != 0:
+            return {"status": "error", "message": f"Error creating branch '{branch_name}': {_failure(out, err)}"}
+        return {"status": "success", "message": f"Branch '{branch_name}' created and switched to."}
+    except Exception as e:
+        return {"status": "error", "message": f"Error creating branch '{branch_name}': {e}"}
+
+
+async def git_delete_branch(root: str, branch_name: str) -> Dict[str, str]:
+    try:
+        code, out, err = await get_repo(root).run_locked("branch", "-D", branch_name)
+        if code != 0:
+            return {"status": "error", "message": f"Error deleting branch '{branch_name}': {_failure(out, err)}"}
+        return {"status": "success", "message": f"Branch '{branch_name}' deleted."}
+    except Exception as e:
+        return {"status": "error", "message": f"Error deleting branch '{branch_name}': {e}"}
+
+
+async def git_switch_branch(root: str, branch_name: str) -> Dict[str, str]:
+    try:
+        code, out, err = await get_repo(root).run_locked("checkout", branch_name)
+        if code != 0:
+            return {"status": "error", "message": f"Error switching to branch '{branch_name}': {_failure(out, err)}"}
+        return {"status": "success", "message": f"Switched to branch '{branch_name}'."}
+    except Exception as e:
+        return {"status": "error", "message": f"Error switching to branch '{branch_name}': {e}"}
+
+
+async def git_current_branch(root: str) -> Dict[str, str]:
+    try:
+        branch = await get_repo(root).head()
+        return {"status": "success", "branch": branch}
+    except Exception as e:
+        return {"status": "error", "message": f"Error getting the current branch: {e}"}
+
+
+async def git_check_uncommitted_changes(root: str) -> Dict[str, str]:
+    try:
+        code, out, err = await get_repo(root).status()
+        if code != 0:
+            return {"status": "error", "message": f"Error checking for uncommitted changes: {_failure(out, err)}"}
+        output = out.strip()
+        changes = output.split('\n') if output else []
+        return {"status": "success", "changes": changes}
+    except Exception as e:
+        return {"status": "error", "message": f"Error checking for uncommitted changes: {e}"}
@@ -0,0 +1,69 @@
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+class PieceTable:
+    """
+    Line edits addressed by the line numbers of the original file, however
+    many there are and in whatever order they come. The original lines are
+    never changed; iterating yields the edited file as runs of untouched
+    lines and edited pieces, in one pass, ready for `writelines`.
+
+    Per original line: DELETE drops it (and wins over MODIFY), the last
+    MODIFY replaces it, and INSERTs add lines after it in the order given.
+    Line numbers outside the file are ignored.
+    """
+
+    def __init__(self, lines: Sequence[str]):
+        self.lines = lines
+        self.replaced: Dict[int, Optional[str]] = {}  # line -> new content, None once deleted
+        self.inserted: Dict[int, List[str]] = {}
+
+    def insert(self, line_number: int, content: str) -> None:
+        if 0 <= line_number < len(self.lines):
+            self.inserted.setdefault(line_number, []).extend(line + "\n" for line in content.splitlines())
+
+    def modify(self, line_number: int, content: str) -> None:
+        if 0 <= line_number < len(self.lines) and self.replaced.get(line_number, "") is not None:
+            self.replaced[line_number] = content + "\n"
+
+    def delete(self, line_number: int) -> None:
+        if 0 <= line_number < len(self.lines):
+            self.replaced[line_number] = None
+
+    def _piece(self, line_number: int) -> str:
+        # What original line `line_number` turns into, inserted lines included
+        line = self.replaced.get(line_number, self.lines[line_number])
+        inserted = self.inserted.get(line_number)
+        if not inserted:
+            return line or ""
+        if line is None:
+            return "".join(inserted)
+        # -> A last line without a newline must not swallow what gets inserted after it
+        return (line if line.endswith("\n") else line + "\n") + "".join(inserted)
+
+    def __iter__(self) -> Iterator[str]:
+        lines = self.lines
+        position = 0
+        for line_number in sorted(self.replaced.keys() | self.inserted.keys()):
+            if position < line_number:
+                yield "".join(lines[position:line_number])
+            yield self._piece(line_number)
+            position = line_number + 1
+
+        if position < len(lines):
+            yield "".join(lines[position:])
+
+    def hunks(self) -> List[Tuple[int, int, str]]:
+        """
+        The edits as (start, stop, new text) replacements of original lines
+        [start, stop), adjacent edited lines merged into one hunk.
+        """
+        hunks: List[Tuple[int, int, str]] = []
+        for line_number in sorted(self.replaced.keys() | self.inserted.keys()):
+            piece = self._piece(line_number)
+            if hunks and hunks[-1][1] == line_number:
+                start, _, text = hunks[-1]
+                hunks[-1] = (start, line_number + 1, text + piece)
+            else:
+                hunks.append((line_number, line_number + 1, piece))
+        return hunks
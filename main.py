@@ -1,35 +1,67 @@
-from typing import List, Dict, Tuple, Optional
+from typing import Awaitable, Callable, List, Dict, Hashable, Tuple, Optional, Union
+from contextlib import asynccontextmanager
+import asyncio
 import json
+import difflib
 from enum import Enum
-from fastapi import FastAPI, Request, HTTPException, Body
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Body, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
 from fastapi.middleware.cors import CORSMiddleware
-import trafilatura
 from pathlib import Path
-from requests_html import AsyncHTMLSession
 from pydantic import BaseModel, Field
-from fuzzywuzzy import fuzz
 from dotenv import load_dotenv
+from concurrency import ConcurrencyLimit, FileLocks, Overloaded, SingleFlight
 import os
-import subprocess
-import openai
-from chat_completion_utils import llm
-import ast
+import re
+import time
+from file_reads import (
+    STREAM_THRESHOLD, etag_matches, file_etag, iter_file_bytes, iter_json_content, parse_byte_range, read_lines,
+    read_lines_within,
+)
+from file_index import files_written, stop_refreshing
+from fuzzy_match import BlockIndex, FuzzyLineIndex, block_lines
+from line_edits import PieceTable
+from git_utils import (
+    git_check_uncommitted_changes, git_commit, git_create_branch, git_current_branch,
+    git_delete_branch, git_list_branches, git_switch_branch, worktree_changed,
+)
+from metrics import MetricsMiddleware, recent_traces, render_metrics, span
+from outline import get_outline_index, stream_outline, symbol_spans
+from prewarm import cancel_prewarm, get_prewarm, start_prewarm, wait_for_prewarm
+from project_files import get_file_structure as build_file_structure, glob_files, is_glob
+from project_store import DEFAULT_SESSION, ProjectStore
+from response_shaping import CHARS_PER_TOKEN, CompressionMiddleware, ndjson_chunks, prune_outline, truncate_text
+from relevance_index import get_relevance_index
+from search_index import get_search_index
+from symbol_index import get_symbol_index
+from storage import ContentHasher, atomic_write_lines, content_hash, write_target, write_temp_lines
+from undo_journal import FileEdit, JournalConflict, UndoJournal, get_undo_journal, text_edit
+from url_fetch import url_fetcher
 
 
 load_dotenv()
 
-# -> We'll use openai for generating git commit messages and such
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
 
 ################################################
 # CONFIG
 ################################################
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    cancel_prewarm() # Don't keep the server from exiting over a warm-up
+    stop_refreshing()
+    await url_fetcher.close() # Or Chromium outlives the server
+
+
+# -> /openapi.json is served per host below, so FastAPI's own route is turned off
+app = FastAPI(openapi_url=None, lifespan=lifespan)
 LOCALHOST_PORT = 8000
+MANIFEST_FILE = "ai-plugin.json"
+OPENAPI_FILE = "openapi.json"
 
 # Add CORS for openapi domains to enable localhost plugin serving
 origins = [
@@ -45,6 +77,30 @@ app.add_middleware(
         allow_methods=["*"],
         allow_headers=['*'],
 )
+# -> Outlines and file contents compress well, which matters through ngrok
+app.add_middleware(CompressionMiddleware)
+# -> Outermost, so latencies include compression
+app.add_middleware(MetricsMiddleware)
+
+# -> (running at once, waiting for a turn) per expensive route; anything beyond gets a 429
+ROUTE_LIMITS = {"project-outline": (2, 8), "url": (4, 16), "update": (4, 32), "files": (4, 16)}
+route_limits = {route: ConcurrencyLimit(route, *limits) for route, limits in ROUTE_LIMITS.items()}
+route_flights = {route: SingleFlight(route) for route in ROUTE_LIMITS}
+# -> Mutating routes hold the files they change, so concurrent edits of one file can't interleave
+file_locks = FileLocks()
+
+
+async def run_coalesced(route: str, key: Hashable, compute: Callable[[], Awaitable]):
+    """
+    Run `compute` within the route's concurrency limit, or share the result
+    of an identical request (same `key`) already in flight.
+    """
+    return await route_flights[route].do(key, lambda: route_limits[route].run(compute))
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
 
 ################################################
 # ROUTES
@@ -63,185 +119,580 @@ async def hello_world():
 
 PROJECTS_FILE = "projects.json"
 
-# -> Load saved project directory info
-if os.path.exists(PROJECTS_FILE):
-    with open(PROJECTS_FILE, "r") as file:
-        projects = json.load(file)
-else:
-    projects = {}
-    with open(PROJECTS_FILE, "w") as file:
-        json.dump(projects, file)
+# -> Projects and the per-session selection live in SQLite; projects.json is only imported once
+project_store = ProjectStore(legacy_file=PROJECTS_FILE)
+
 
-current_project = None
+def get_session_id(request: Request) -> str:
+    return (
+        request.headers.get("openai-conversation-id")
+        or request.headers.get("x-session-id")
+        or DEFAULT_SESSION
+    )
+
+
+def get_current_project_info(session_id: str) -> Optional[Dict]:
+    current = project_store.current(session_id)
+    return current[1] if current else None
+
+
+def get_project_root(session_id: str) -> str:
+    project = get_current_project_info(session_id)
+    if project and project["root"]:
+        return project["root"]
+    raise HTTPException(status_code=400, detail="No project selected or project root not set.")
+
+
+def get_edit_journal(session_id: str = Depends(get_session_id)) -> UndoJournal:
+    # -> Edits are journaled per project, falling back to the server's cwd like git does
+    project = get_current_project_info(session_id)
+    return get_undo_journal(project["root"] if project and project["root"] else os.getcwd())
 
-def save_projects():
-    with open(PROJECTS_FILE, "w") as file:
-        json.dump(projects, file)
+
+def note_edits(edits: List[Dict]) -> None:
+    # -> Cached git status and the indexes can't see the server's own writes, so tell them about them
+    for edit in edits:
+        for path in edit["files"]:
+            worktree_changed(path)
+        files_written(edit["files"])
 
 # Project Navigation
 # -------------------------------------------
 @app.post("/add-project/{project_name}")
 def add_project(project_name: str):
-    if project_name not in projects:
-        projects[project_name] = {"root": None, "cwd": None}
-        save_projects()
-    else:
+    if not project_store.add(project_name):
         raise HTTPException(status_code=400, detail="Project already exists.")
 
 @app.get("/list-projects")
 def list_projects():
-    return projects
+    return project_store.all()
 
 @app.delete("/remove-project/{project_name}")
 def remove_project(project_name: str):
-    if project_name in projects:
-        del projects[project_name]
-        save_projects()
-    else:
+    root = project_store.all().get(project_name, {}).get("root")
+    if not project_store.remove(project_name):
         raise HTTPException(status_code=404, detail="Project not found.")
+    if root:
+        cancel_prewarm(root)
 
 @app.post("/select-project/{project_name}")
-def select_project(project_name: str):
-    global current_project
-    if project_name in projects:
-        current_project = project_name
-        projects[current_project]["cwd"] = projects[current_project]["root"]
-        save_projects()
-    else:
+def select_project(project_name: str, session_id: str = Depends(get_session_id)):
+    """
+    Select a project for this session and start warming its caches up in
+    the background; `/project-status` reports the progress.
+    """
+    previous = get_current_project_info(session_id)
+    if not project_store.select(session_id, project_name):
         raise HTTPException(status_code=404, detail="Project not found.")
+    project = get_current_project_info(session_id)
+    if previous and previous["root"] and previous["root"] != project["root"]:
+        cancel_prewarm(previous["root"])
+    if project["root"]:
+        start_prewarm(project["root"])
+
+@app.get("/project-status")
+def get_project_status(wait: float = 0, session_id: str = Depends(get_session_id)):
+    """
+    Progress of the selected project's background warm-up: walking the
+    tree, outlining Python files, then the search, relevance and symbol
+    indexes. With `wait`, block up to that many seconds for it to finish.
+    """
+    project_root = get_project_root(session_id)
+    job = get_prewarm(project_root)
+    if job is None:
+        return {"root": project_root, "state": "idle"}
+    if wait > 0:
+        job.wait(timeout=wait)
+    return job.status()
+
+@app.post("/cancel-project-prewarm")
+def cancel_project_prewarm(session_id: str = Depends(get_session_id)):
+    cancel_prewarm(get_project_root(session_id))
 
 @app.get("/current-project")
-def get_current_project():
-    if current_project:
-        return {current_project: projects[current_project]}
+def get_current_project(session_id: str = Depends(get_session_id)):
+    current = project_store.current(session_id)
+    if current:
+        return {current[0]: current[1]}
     else:
         raise HTTPException(status_code=404, detail="No project selected.")
 
 @app.post("/set-project-root/{project_name}")
 def set_project_root(project_name: str, filepath: str):
-    if project_name in projects:
-        projects[project_name]["root"] = filepath
-        save_projects()
-    else:
+    if not project_store.set_root(project_name, filepath):
         raise HTTPException(status_code=404, detail="Project not found.")
 
 @app.post("/set-cwd/{project_name}")
-def set_cwd(project_name: str, filepath: str):
-    if project_name in projects:
-        projects[project_name]["cwd"] = filepath
-        save_projects()
-    else:
+def set_cwd(project_name: str, filepath: str, session_id: str = Depends(get_session_id)):
+    if not project_store.set_cwd(project_name, filepath, session_id):
         raise HTTPException(status_code=404, detail="Project not found.")
 
 
 # Content Outlines
 # -------------------------------------------
 
-def get_file_structure(filepath=None, root=None):
+def get_file_structure(filepath=None, max_depth=None, max_entries=None, cursor=None, session_id=DEFAULT_SESSION):
     if filepath is None:
-        if current_project and projects[current_project]["cwd"]:
-            filepath = projects[current_project]["cwd"]
+        project = get_current_project_info(session_id)
+        if project and project["cwd"]:
+            filepath = project["cwd"]
         else:
             raise HTTPException(status_code=400, detail="No project or path specified.")
-    if root is None:
-        root = filepath
-    if os.path.isdir(filepath):
-        subdirs = [get_file_structure(os.path.join(filepath, subdir), root) for subdir in os.listdir(filepath)]
-        return {"type": "dir", "name": os.path.relpath(filepath, root), "children": subdirs}
-    else:
-        return {"type": "file", "name": os.path.relpath(filepath, root)}
-
-
-def parse_source_code(file_path):
-    with open(file_path, "r") as file:
-        source_code = file.read()
-
-    tree = ast.parse(source_code)
-    imports, classes, functions = [], [], []
-
-    for node in tree.body:
-        if isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
-            imports.append(ast.dump(node).replace('\n', ''))
-        elif isinstance(node, ast.ClassDef):
-            classes.append(node.name)
-            methods = []
-            for item in node.body:
-                if isinstance(item, ast.FunctionDef):
-                    methods.append(item.name)
-            functions.append({"class": node.name, "methods": methods})
-        else:
-            if isinstance(node, ast.FunctionDef):
-                functions.append({"function": node.name})
+    with span("walk"):
+        return build_file_structure(filepath, max_depth=max_depth, max_entries=max_entries, cursor=cursor)
 
-    return {"imports": imports, "classes": classes, "functions": functions}
+
+@app.get("/file-structure")
+def list_file_structure(
+    filepath: Optional[str] = None,
+    max_depth: Optional[int] = None,
+    max_entries: Optional[int] = 1000,
+    cursor: Optional[str] = None,
+    session_id: str = Depends(get_session_id),
+):
+    """
+    List the files under a directory (the project's cwd by default), skipping
+    anything matched by ignore_config.json or the project's .gitignore files.
+    When the listing is cut short, pass `next_cursor` back as `cursor`.
+    """
+    return get_file_structure(filepath, max_depth=max_depth, max_entries=max_entries, cursor=cursor, session_id=session_id)
 
 
 @app.get("/project-outline")
-def get_project_outline():
-    if current_project and projects[current_project]["root"]:
-        project_root = projects[current_project]["root"]
-    else:
-        raise HTTPException(status_code=400, detail="No project selected or project root not set.")
+async def get_project_outline(
+    max_depth: Optional[int] = None,
+    max_entries: Optional[int] = None,
+    cursor: Optional[str] = None,
+    path: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    stream: bool = False,
+    session_id: str = Depends(get_session_id),
+):
+    """
+    Files of the selected project (or of `path` inside it) with the imports,
+    classes and functions of each Python file.
+    With `max_tokens` the deepest and least relevant parts are collapsed
+    first; pass the `name` of a node marked `truncated` or `omitted_imports`
+    back as `path` to get the rest.
+    With `stream=true` the outline is sent as NDJSON instead, one record per
+    directory and file as the walk finds them (`max_entries`, `cursor` and
+    `max_tokens` don't apply), files that fail to parse carrying an
+    `error`, and a last `end` record with the counts.
+    """
+    project_root = get_project_root(session_id)
+    if stream:
+        _, path = outline_base(project_root, path)
+        # -> Not coalesced: each client reads its own stream, and nothing is built up front
+        records = stream_outline(project_root, path, max_depth=max_depth)
+        return StreamingResponse(ndjson_chunks(records), media_type="application/x-ndjson")
+    return await run_coalesced(
+        "project-outline",
+        (project_root, max_depth, max_entries, cursor, path, max_tokens),
+        lambda: run_in_threadpool(build_project_outline, project_root, max_depth, max_entries, cursor, path, max_tokens),
+    )
+
 
-    file_structure = get_file_structure(project_root)
+def outline_base(project_root: str, path: Optional[str]) -> Tuple[str, Optional[str]]:
+    # The directory to outline, and `path` cleaned up (None for the whole project)
+    if not path or path.strip("/") in ("", "."):
+        return project_root, None
+    path = path.strip("/")
+    base = os.path.normpath(os.path.join(project_root, path))
+    if os.path.commonpath([base, os.path.abspath(project_root)]) != os.path.abspath(project_root):
+        raise HTTPException(status_code=400, detail="Path is outside the project.")
+    if not os.path.exists(base):
+        raise HTTPException(status_code=404, detail="Path not found.")
+    return base, path
+
+
+def build_project_outline(
+    project_root: str,
+    max_depth: Optional[int],
+    max_entries: Optional[int],
+    cursor: Optional[str],
+    path: Optional[str],
+    max_tokens: Optional[int],
+) -> Dict:
+    base, path = outline_base(project_root, path)
+    file_structure = get_file_structure(base, max_depth=max_depth, max_entries=max_entries, cursor=cursor)
     stack = [file_structure]
+    source_nodes = []
 
     while stack:
         node = stack.pop()
-        if node["type"] == "file" and node["name"].endswith(".py"):
-            file_path = os.path.join(project_root, node["name"])
-            node["outline"] = parse_source_code(file_path)
+        if path:
+            # -> Names stay relative to the project root, whatever the subtree asked for
+            node["name"] = path if node["name"] == "." else f"{path}/{node['name']}"
+        if node["type"] == "file":
+            if node["name"].endswith(".py"):
+                source_nodes.append(node)
         else:
             stack.extend(node["children"])
 
+    # -> Reuse a running warm-up's parsing instead of racing it; whatever it didn't get to is parsed here
+    wait_for_prewarm(project_root, "outline")
+
+    # -> Only files changed since the last call get parsed again
+    complete = max_depth is None and max_entries is None and cursor is None
+    outlines = get_outline_index(project_root).outlines((node["name"] for node in source_nodes), complete=complete)
+    for node in source_nodes:
+        node["outline"] = outlines.get(node["name"])
+
+    if max_tokens is not None:
+        prune_outline(file_structure, max_tokens)
     return file_structure
 
 
+@app.get("/symbol-definitions")
+def get_symbol_definitions(symbol: str, session_id: str = Depends(get_session_id)):
+    """
+    Find where a Python symbol is defined in the selected project.
+    `symbol` may be a bare name, a dotted qualname (`Class.method`) or include the module.
+    Line spans are 0-based and end-exclusive, ready for `/file` start_line/end_line.
+    Files that could not be parsed are listed under `unparsed`.
+    """
+    index = get_symbol_index(get_project_root(session_id))
+    return {"definitions": index.find_definitions(symbol), "unparsed": index.errors()}
+
+
+@app.get("/symbol-references")
+def get_symbol_references(symbol: str, session_id: str = Depends(get_session_id)):
+    """
+    Find where a Python symbol is used in the selected project: calls,
+    attribute accesses, decorator/base class uses and imports.
+    Files that could not be parsed are listed under `unparsed`.
+    """
+    index = get_symbol_index(get_project_root(session_id))
+    return {**index.find_references(symbol), "unparsed": index.errors()}
+
+
 # ===========================================
 # Retrieve
 # ===========================================
 
+# Utils
+# -------------------------------------------
+
+# -> Files one /files call returns at most, globs included
+MAX_BATCH_FILES = 200
+# -> Content one /files call returns at most; files past it are reported, not read
+MAX_BATCH_CHARS = 8 * 1024 * 1024
+BATCH_READ_CONCURRENCY = 8
+
+
+class FileRead(BaseModel):
+    path: str = Field(
+        ..., description="Absolute file path or glob (`**` spans directories); relative ones are in the selected project"
+    )
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+
+
+def expand_file_reads(reads: List[FileRead], project_root: Optional[str]) -> List[Dict]:
+    """
+    One target per file to read, in request order, globs expanded. Globs
+    that match nothing or too much get an error target of their own.
+    """
+    targets: List[Dict] = []
+    for read in reads:
+        path = read.path
+        if project_root and not os.path.isabs(os.path.expanduser(path)):
+            path = os.path.join(project_root, path)
+        line_range = {"start_line": read.start_line, "end_line": read.end_line}
+        if not is_glob(path):
+            targets.append({"filepath": path, **line_range})
+            continue
+        path = os.path.expanduser(path)
+        if not os.path.isabs(path):
+            targets.append({"filepath": path, "error": "Only absolute globs are allowed.", "status": 400})
+            continue
+
+        room = MAX_BATCH_FILES - sum("error" not in target for target in targets)
+        matches, more = glob_files(path, max(room, 0))
+        targets.extend({"filepath": match, **line_range} for match in matches)
+        if more:
+            targets.append({"filepath": path, "error": f"More than {MAX_BATCH_FILES} files in total.", "status": 413})
+        elif not matches:
+            targets.append({"filepath": path, "error": "No file matches.", "status": 404})
+    return targets
+
+
+def read_file_target(target: Dict) -> Dict:
+    # -> Errors are reported per file, so one bad path doesn't fail the batch
+    result = {key: value for key, value in target.items() if value is not None}
+    if "error" in result:
+        return result
+    start_line, end_line = target["start_line"], target["end_line"]
+    try:
+        file_path = validate_path(target["filepath"])
+        if start_line is None and end_line is None:
+            if file_path.stat().st_size > STREAM_THRESHOLD:
+                raise HTTPException(status_code=413, detail="File too large for a batch read, use /file.")
+            with file_path.open("r") as file:
+                result["content"] = file.read()
+        else:
+            result["content"] = read_lines(str(file_path), start_line or 0, end_line)
+    except HTTPException as e:
+        result.update(error=e.detail, status=e.status_code)
+    except (OSError, UnicodeDecodeError) as e:
+        result.update(error=f"Error reading file: {e}", status=500)
+    return result
+
+
+def dedupe_file_results(results: List[Dict]) -> List[Dict]:
+    """
+    Replace the content of every result identical to an earlier one by
+    `duplicate_of` (that result's index), and leave out content past
+    `MAX_BATCH_CHARS`.
+    """
+    first: Dict[str, int] = {}
+    total = 0
+    for i, result in enumerate(results):
+        if "content" not in result:
+            continue
+        digest = result["hash"] = content_hash(result["content"].encode("utf-8"))
+        if digest in first:
+            result["duplicate_of"] = first[digest]
+            del result["content"]
+        elif total + len(result["content"]) > MAX_BATCH_CHARS:
+            del result["content"]
+            result.update(error="Batch size limit reached, read this file separately.", status=413)
+        else:
+            first[digest] = i
+            total += len(result["content"])
+    return results
+
+
 # Routes
 # -------------------------------------------
 
 @app.get("/file")
-async def get_file_content(filepath: str):
+async def get_file_content(
+    request: Request,
+    filepath: str,
+    start_line: Optional[int] = None,
+    end_line: Optional[int] = None,
+    stream: bool = False,
+    max_tokens: Optional[int] = None,
+):
     """
     Retrieve the content of a specified file.
     The function takes the file path as input and returns the content of the file.
+    Optionally only lines [start_line, end_line) are returned (0-based).
+    With `max_tokens` the content stops at a line boundary within the budget;
+    `next_start_line` tells where to continue when it was truncated.
+    `stream=true` (or `Accept: text/plain`) and byte `Range` requests are
+    streamed as plain text; large files otherwise keep the JSON shape but are
+    sent a chunk at a time. Responses carry an ETag; a matching
+    If-None-Match returns 304.
     """
 
     try:
         file_path = validate_path(filepath)
+        stat = file_path.stat()
+        headers = {"ETag": file_etag(stat), "Accept-Ranges": "bytes"}
+
+        # -> Unchanged since the client's copy: skip reading the file entirely
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+        range_header = request.headers.get("range")
+        if range_header:
+            byte_range = parse_byte_range(range_header, stat.st_size)
+            if byte_range is None:
+                raise HTTPException(
+                    status_code=416, detail="Requested range not satisfiable.",
+                    headers={"Content-Range": f"bytes */{stat.st_size}"},
+                )
+            start, stop = byte_range
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{stat.st_size}"
+            headers["Content-Length"] = str(stop - start)
+            return StreamingResponse(
+                iter_file_bytes(str(file_path), start, stop), status_code=206,
+                media_type="text/plain; charset=utf-8", headers=headers,
+            )
+
+        if max_tokens is not None:
+            start_line = start_line or 0
+            content, next_start_line = read_lines_within(
+                str(file_path), start_line, end_line, max_chars=max_tokens * CHARS_PER_TOKEN
+            )
+            return JSONResponse(
+                content={
+                    "content": content, "start_line": start_line,
+                    "end_line": next_start_line if next_start_line is not None else end_line,
+                    "truncated": next_start_line is not None, "next_start_line": next_start_line,
+                },
+                headers=headers,
+            )
+
+        if start_line is not None or end_line is not None:
+            start_line = start_line or 0
+            content = read_lines(str(file_path), start_line, end_line)
+            return JSONResponse(
+                content={"content": content, "start_line": start_line, "end_line": end_line},
+                headers=headers,
+            )
+
+        # -> Plain text is opt-in: plugin clients parse the JSON body
+        accept = request.headers.get("accept", "")
+        if stream or ("text/plain" in accept and "application/json" not in accept):
+            headers["Content-Length"] = str(stat.st_size)
+            return StreamingResponse(
+                iter_file_bytes(str(file_path)), media_type="text/plain; charset=utf-8", headers=headers
+            )
+
+        if stat.st_size > STREAM_THRESHOLD:
+            return StreamingResponse(iter_json_content(str(file_path)), media_type="application/json", headers=headers)
+
         with file_path.open("r") as file:
             content = file.read()
-        return {"content": content}
+        return JSONResponse(content={"content": content}, headers=headers)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading file: {e}")
 
 
+@app.post("/files")
+async def get_files_content(
+    files: List[Union[str, FileRead]] = Body(..., embed=True),
+    session_id: str = Depends(get_session_id),
+):
+    """
+    Read many files in one call. Each item is a path, a glob (`src/**/*.py`)
+    or an object with a `path` and optional [start_line, end_line) range
+    (0-based); relative paths and globs are resolved in the selected project.
+    Files are read concurrently and returned in request order. A file with
+    the same content as an earlier one only carries `duplicate_of`, that
+    one's index. Files that can't be read carry an `error` and `status`
+    instead of failing the whole call.
+    """
+    project = get_current_project_info(session_id)
+    reads = [FileRead(path=item) if isinstance(item, str) else item for item in files]
+    async with route_limits["files"].slot():
+        targets = await run_in_threadpool(expand_file_reads, reads, project["root"] if project else None)
+        if sum("error" not in target for target in targets) > MAX_BATCH_FILES:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} files per call.")
+
+        slots = asyncio.Semaphore(BATCH_READ_CONCURRENCY)
+
+        async def read(target: Dict) -> Dict:
+            async with slots:
+                return await run_in_threadpool(read_file_target, target)
+
+        results = await asyncio.gather(*(read(target) for target in targets))
+    results = dedupe_file_results(results)
+    return {
+        "files": results,
+        "errors": sum("error" in result for result in results),
+        "duplicates": sum("duplicate_of" in result for result in results),
+    }
+
+
+@app.get("/file-symbol")
+def get_file_symbol(filepath: str, symbol: str, include_siblings: bool = False):
+    """
+    Retrieve the source of one class or function of a Python file, given its
+    dotted path inside the file (e.g. `Class.method`), instead of the whole file.
+    With include_siblings=true the signatures of the definitions next to it
+    (same parent) are returned too. Line numbers are 0-based, end exclusive.
+    """
+    file_path = validate_path(filepath)
+    try:
+        spans = symbol_spans(str(file_path))
+    except (SyntaxError, ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse file: {e}")
+
+    line_span = spans.get(symbol)
+    if line_span is None:
+        close = difflib.get_close_matches(symbol, list(spans), n=5)
+        hint = f" Did you mean: {', '.join(close)}?" if close else ""
+        raise HTTPException(status_code=404, detail=f"Symbol '{symbol}' not found in {filepath}.{hint}")
+
+    with file_path.open("r") as file:
+        lines = file.readlines()
+    result = {
+        "filepath": str(file_path),
+        "symbol": symbol,
+        "kind": line_span["kind"],
+        "start_line": line_span["start_line"],
+        "end_line": line_span["end_line"],
+        "content": "".join(lines[line_span["start_line"]:line_span["end_line"]]),
+    }
+    if include_siblings:
+        parent = symbol.rpartition(".")[0]
+        result["siblings"] = [
+            {
+                "symbol": qualname, "kind": other["kind"],
+                "start_line": other["start_line"], "end_line": other["end_line"],
+                "signature": "".join(lines[other["start_line"]:other["signature_end"]]),
+            }
+            for qualname, other in spans.items()
+            if qualname != symbol and qualname.rpartition(".")[0] == parent
+        ]
+    return result
+
+
 @app.get("/url")
-async def get_url_content(url: str):
+async def get_url_content(url: str, max_tokens: Optional[int] = None, offset: int = 0):
     """
     Retrieve the content of a specified URL.
-    The function takes the URL as input and returns the rendered HTML content of the page.
-    Optionally, the extracted article content can also be returned.
+    The function takes the URL as input and returns the extracted article content of the page.
+    Results are cached and revalidated with ETag/Last-Modified.
+    With `max_tokens` (or `offset`) a {"content", "offset", "next_offset", "truncated"}
+    page of the article is returned instead; pass `next_offset` back for the rest.
     """
-    session = AsyncHTMLSession()
-    response = await session.get(url)
+    # -> Static HTML first, a pooled headless browser only when that extracts too little
+    article = await run_coalesced("url", url, lambda: url_fetcher.get_article(url))
 
-    # Render the JavaScript on the page
-    await response.html.arender()
+    if max_tokens is not None or offset:
+        return JSONResponse(content=truncate_text(article or "", max_tokens, offset), status_code=200)
+    return JSONResponse(content=article, status_code=200)
 
-    html_content = response.html.html
 
-    # Extract the article using trafilatura (optional)
-    article = trafilatura.extract(html_content)
+@app.get("/search")
+def search_project(
+    query: str,
+    regex: bool = False,
+    case_sensitive: bool = False,
+    context: int = 2,
+    max_results: int = 100,
+    session_id: str = Depends(get_session_id),
+):
+    """
+    Search the selected project's files for a literal string or a regex.
+    Returns matching lines with surrounding context, grouped by file and
+    ranked by relevance. Line numbers are 0-based.
+    """
+    project_root = get_project_root(session_id)
+    try:
+        return get_search_index(project_root).search(
+            query, regex=regex, case_sensitive=case_sensitive, context=context, max_results=max_results
+        )
+    except re.error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid regex: {e}")
 
-    await session.close()
 
-    return JSONResponse(content=article, status_code=200)
+@app.get("/context")
+def get_context(
+    query: str,
+    max_tokens: int = 4000,
+    max_files: Optional[int] = None,
+    session_id: str = Depends(get_session_id),
+):
+    """
+    The parts of the selected project most relevant to a natural-language
+    query, packed to fit `max_tokens`: files ranked with BM25 over their
+    text, path and defined names, each with its best snippets in line
+    order. Line numbers are 0-based and end-exclusive, ready for `/file`.
+    Use it instead of reading files one by one to find where to start.
+    """
+    if max_tokens <= 0:
+        raise HTTPException(status_code=400, detail="max_tokens must be positive.")
+    project_root = get_project_root(session_id)
+    return get_relevance_index(project_root).context(query, max_tokens, max_files=max_files)
 
 
 # ===========================================
@@ -254,7 +705,9 @@ async def get_url_content(url: str):
 # -------------------------------------------
 
 @app.post("/create-file")
-async def create_file(filepath: str = Body(...), content: str = Body(...)):
+async def create_file(
+    filepath: str = Body(...), content: str = Body(...), journal: UndoJournal = Depends(get_edit_journal)
+):
     """
     Create a new file with the specified content.
     Returns a status message indicating success or failure.
@@ -266,10 +719,19 @@ async def create_file(filepath: str = Body(...), content: str = Body(...)):
                 status_code=400, detail="Only absolute file paths are allowed."
             )
 
-        # Create the file and write the content to it
-        with file_path.open("w") as file:
-            file.write(content)
-        return {"status": "success", "message": "File created successfully."}
+        async with file_locks.hold([filepath]):
+            before = None
+            if file_path.is_file():
+                with file_path.open("r") as file:
+                    before = file.read()
+
+            # Create the file and write the content to it
+            atomic_write_lines(file_path, [content])
+            edit = journal.record("create-file", [text_edit(str(file_path), before, content)])
+            note_edits([edit])
+            return {"status": "success", "message": "File created successfully.", "edit_id": edit["id"]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating file: {e}")
 
@@ -279,108 +741,26 @@ async def create_file(filepath: str = Body(...), content: str = Body(...)):
 # Git
 # ===========================================
 
-# TODO Extract to dedicated file
-
 # Utils
 # -------------------------------------------
 
-def generate_commit_message(diff: str) -> str:
-    system_instruction = "Generate a brief Git commit message based on the following diff. Do not include introductory text or explain what you have done. Only output the commit message you generate."
-    user_input = diff
-    message = llm(system_instruction=system_instruction, user_input=user_input)
-    return message.strip()
-
-
-def git_commit(commit_message: Optional[str] = None) -> None:
-    try:
-        subprocess.run(["git", "add", "-A"])
-        if not commit_message:
-            diff = subprocess.check_output(["git", "diff", "--staged"]).decode("utf-8")
-            commit_message = generate_commit_message(diff)
-
-        subprocess.run(["git", "commit", "-m", commit_message])
-        return {"status": "success", "message": "Git commit created successfully."}
-    except Exception as e:
-        return {"status": "error", "message": f"Error creating git commit: {e}"}
-
-
-def git_reset_to_previous(num_commits: int = 1):
-    try:
-        subprocess.run(["git", "reset", "--hard", f"HEAD~{num_commits}"])
-        return {"status": "success", "message": f"Reset to {num_commits} commit(s) before successfully."}
-    except Exception as e:
-        return {"status": "error", "message": f"Error resetting to previous commit: {e}"}
-
-
-def git_list_branches() -> Dict[str, List[str]]:
-    try:
-        output = subprocess.check_output(["git", "branch"]).decode("utf-8").strip()
-        branches = [b.strip() for b in output.split("\n")]
-        return {"status": "success", "branches": branches}
-    except Exception as e:
-        return {"status": "error", "message": f"Error getting the branch list: {e}"}
-
-
-def git_create_branch(branch_name: str) -> Dict[str, str]:
-    try:
-        subprocess.run(["git", "checkout", "-b", branch_name])
-        return {"status": "success", "message": f"Branch '{branch_name}' created and switched to."}
-    except Exception as e:
-        return {"status": "error", "message": f"Error creating branch '{branch_name}': {e}"}
-
-
-def git_delete_branch(branch_name: str) -> Dict[str, str]:
-    try:
-        subprocess.run(["git", "branch", "-D", branch_name])
-        return {"status": "success", "message": f"Branch '{branch_name}' deleted."}
-    except Exception as e:
-        return {"status": "error", "message": f"Error deleting branch '{branch_name}': {e}"}
-
-
-def git_switch_branch(branch_name: str) -> Dict[str, str]:
-    try:
-        subprocess.run(["git", "checkout", branch_name])
-        return {"status": "success", "message": f"Switched to branch '{branch_name}'."}
-    except Exception as e:
-        return {"status": "error", "message": f"Error switching to branch '{branch_name}': {e}"}
-
-def git_current_branch() -> Dict[str, str]:
-    try:
-        branch = subprocess.check_output(["git", "rev-parse", "--abbrev-ref", "HEAD"]).decode("utf-8").strip()
-        return {"status": "success", "branch": branch}
-    except Exception as e:
-        return {"status": "error", "message": f"Error getting the current branch: {e}"}
-
-
-def git_check_uncommitted_changes() -> Dict[str, str]:
-    try:
-        output = subprocess.check_output(["git", "status", "--porcelain"]).decode("utf-8").strip()
-        changes = output.split('\n') if output else []
-        return {"status": "success", "changes": changes}
-    except Exception as e:
-        return {"status": "error", "message": f"Error checking for uncommitted changes: {e}"}
+def get_git_root(session_id: str = Depends(get_session_id)) -> str:
+    # -> Git runs in the selected project's root, falling back to the server's cwd
+    project = get_current_project_info(session_id)
+    if project and project["root"]:
+        return project["root"]
+    return os.getcwd()
 
 
 # Routes
 # -------------------------------------------
 
 @app.post("/create-git-commit")
-async def create_git_commit(commit_message: str = Body(..., embed=True)):
+async def create_git_commit(commit_message: str = Body(..., embed=True), git_root: str = Depends(get_git_root)):
     """
     Create a git commit with the given commit message.
     """
-    result = git_commit(commit_message=commit_message)
-    if result["status"] == "success":
-        return result
-    else:
-        raise HTTPException(status_code=500, detail=result["message"])
-
-@app.post("/rollback-update")
-async def rollback_update(num_commits: int = 1):
-    """
-    Rollback a specified number of changes made by 'update_file'
-    """
-    result = git_reset_to_previous(num_commits=num_commits)
+    result = await git_commit(git_root, commit_message=commit_message)
     if result["status"] == "success":
         return result
     else:
@@ -388,11 +768,11 @@ async def rollback_update(num_commits: int = 1):
 
 
 @app.post("/create-git-branch")
-async def create_git_branch(branch_name: str = Body(..., embed=True)):
+async def create_git_branch(branch_name: str = Body(..., embed=True), git_root: str = Depends(get_git_root)):
     """
     Create a new git branch and switch to it.
     """
-    result = git_create_branch(branch_name=branch_name)
+    result = await git_create_branch(git_root, branch_name=branch_name)
     if result["status"] == "success":
         return result
     else:
@@ -400,11 +780,11 @@ async def create_git_branch(branch_name: str = Body(..., embed=True)):
 
 
 @app.delete("/delete-git-branch")
-async def delete_git_branch(branch_name: str = Body(..., embed=True)):
+async def delete_git_branch(branch_name: str = Body(..., embed=True), git_root: str = Depends(get_git_root)):
     """
     Delete the specified git branch.
     """
-    result = git_delete_branch(branch_name=branch_name)
+    result = await git_delete_branch(git_root, branch_name=branch_name)
     if result["status"] == "success":
         return result
     else:
@@ -412,22 +792,22 @@ async def delete_git_branch(branch_name: str = Body(..., embed=True)):
 
 
 @app.post("/switch-git-branch")
-async def switch_git_branch(branch_name: str = Body(..., embed=True)):
+async def switch_git_branch(branch_name: str = Body(..., embed=True), git_root: str = Depends(get_git_root)):
     """
     Switch to the specified git branch.
     """
-    result = git_switch_branch(branch_name=branch_name)
+    result = await git_switch_branch(git_root, branch_name=branch_name)
     if result["status"] == "success":
         return result
     else:
         raise HTTPException(status_code=500, detail=result["message"])
 
 @app.get("/list-git-branches")
-async def list_git_branches():
+async def list_git_branches(git_root: str = Depends(get_git_root)):
     """
     Get a list of all git branches.
     """
-    result = git_list_branches()
+    result = await git_list_branches(git_root)
     if result["status"] == "success":
         return result
     else:
@@ -435,11 +815,11 @@ async def list_git_branches():
 
 
 @app.get("/current-git-branch")
-async def current_git_branch():
+async def current_git_branch(git_root: str = Depends(get_git_root)):
     """
     Get the current git branch.
     """
-    result = git_current_branch()
+    result = await git_current_branch(git_root)
     if result["status"] == "success":
         return result
     else:
@@ -447,11 +827,11 @@ async def current_git_branch():
 
 
 @app.get("/uncommitted-git-changes")
-async def uncommitted_git_changes():
+async def uncommitted_git_changes(git_root: str = Depends(get_git_root)):
     """
     Check for uncommitted git changes.
     """
-    result = git_check_uncommitted_changes()
+    result = await git_check_uncommitted_changes(git_root)
     if result["status"] == "success":
         return result
     else:
@@ -471,13 +851,17 @@ class ActionType(Enum):
     DELETE = "delete"
 
 action_descriptions = {
-    ActionType.INSERT: "Add new content below the matched line.",
-    ActionType.MODIFY: "Update the content of the matched line.",
-    ActionType.DELETE: "Remove the matched line.",
+    ActionType.INSERT: "Add new content below the matched line or block.",
+    ActionType.MODIFY: "Replace the matched line or block with the new content.",
+    ActionType.DELETE: "Remove the matched line or block.",
 }
 
 class UpdateMatch(BaseModel):
-    content_to_match: str
+    content_to_match: str = Field(
+        ...,
+        description="A line, or a block of several lines (e.g. a whole function) matched as a unit; "
+        "indentation and blank lines are ignored when matching a block."
+    )
     new_content: str
     action: ActionType = Field(
         ...,
@@ -490,21 +874,161 @@ class UpdateLine(BaseModel):
     new_content: str
     action: ActionType
 
-def apply_updates(lines: List[str], updates: List[Tuple[int, ActionType, str]]) -> List[str]:
-    line_offset = 0
+class FileUpdate(BaseModel):
+    filepath: str
+    updates: List[UpdateMatch]
+    use_fuzzy_match: bool = True
+
+def apply_updates(lines: List[str], updates: List[Tuple[int, ActionType, str]]) -> PieceTable:
+    """
+    Apply updates addressed by the original line numbers. `lines` is left
+    untouched; the result streams the updated file in one linear pass.
+    """
+    table = PieceTable(lines)
     for line_number, action, new_content in updates:
-        adjusted_line_number = line_number + line_offset
-        if 0 <= adjusted_line_number < len(lines):
-            if action == ActionType.INSERT:
-                new_lines = new_content.splitlines()
-                lines[adjusted_line_number + 1:adjusted_line_number + 1] = [new_line + "\n" for new_line in new_lines]
-                line_offset += len(new_lines)
-            elif action == ActionType.MODIFY:
-                lines[adjusted_line_number] = new_content + "\n"
-            elif action == ActionType.DELETE:
-                del lines[adjusted_line_number]
-                line_offset -= 1
-    return lines
+        if action == ActionType.INSERT:
+            table.insert(line_number, new_content)
+        elif action == ActionType.MODIFY:
+            table.modify(line_number, new_content)
+        elif action == ActionType.DELETE:
+            table.delete(line_number)
+    return table
+
+def block_updates(start: int, stop: int, action: ActionType, new_content: str) -> List[Tuple[int, ActionType, str]]:
+    # A block is modified through its first line, the others being deleted
+    if action == ActionType.INSERT:
+        return [(stop - 1, action, new_content)]
+    if action == ActionType.MODIFY:
+        return [(start, action, new_content)] + [(i, ActionType.DELETE, "") for i in range(start + 1, stop)]
+    return [(i, action, "") for i in range(start, stop)]
+
+def resolve_updates(
+    lines: List[str], updates: List[UpdateMatch], use_fuzzy_match: bool
+) -> Tuple[List[Tuple[int, ActionType, str]], List[Dict]]:
+    """
+    Find the line(s) each update applies to. Returns the updates to pass to
+    `apply_updates` and, per match, its line number and score (plus the
+    end-exclusive `end_line` of a block).
+    A multi-line `content_to_match` is matched as a block: exactly first,
+    then (with fuzzy matching) the closest region of the file.
+    """
+    update_list = []
+    matches = []
+    fuzzy_index, block_index = None, None
+    for update in updates:
+        block = block_lines(update.content_to_match)
+        if len(block) > 1:
+            if block_index is None:
+                with span("block_index"):
+                    block_index = BlockIndex(lines)
+            with span("block_match"):
+                spans = [(start, stop, 100) for start, stop in block_index.find_exact(block)]
+                if use_fuzzy_match and spans:
+                    spans = spans[:1]
+                elif use_fuzzy_match:
+                    # -> No exact occurrence: the closest region, as for a single fuzzy-matched line
+                    best = block_index.best_match(block)
+                    if best is None:
+                        raise ValueError(f"No block matches '{block[0]}' ... '{block[-1]}'.")
+                    spans = [best]
+            for start, stop, score in spans:
+                matches.append({"line_number": start, "end_line": stop, "score": score})
+                update_list.extend(block_updates(start, stop, update.action, update.new_content))
+            continue
+
+        if use_fuzzy_match:
+            if fuzzy_index is None:
+                with span("fuzzy_index"):
+                    fuzzy_index = FuzzyLineIndex(lines)
+            # Use fuzzy matching to find the best matching line
+            with span("fuzzy_match"):
+                best_match_index, best_match_score = fuzzy_index.best_match(update.content_to_match)
+            if best_match_index is None:
+                raise ValueError(f"No line matches '{update.content_to_match}'.")
+            matched_line_numbers = [best_match_index]
+            matches.append({"line_number": best_match_index, "score": best_match_score})
+        else:
+            # Use exact match
+            matched_line_numbers = [i for i, line in enumerate(lines) if update.content_to_match in line]
+            matches.extend({"line_number": i, "score": 100} for i in matched_line_numbers)
+
+        for line_number in matched_line_numbers:
+            update_list.append((line_number, update.action, update.new_content))
+    return update_list, matches
+
+def update_file_content(
+    file_path: Path, updates: List[UpdateMatch], use_fuzzy_match: bool, journal: UndoJournal
+) -> Dict:
+    with file_path.open("r") as file:
+        lines = file.readlines()
+
+    update_list, matches = resolve_updates(lines, updates, use_fuzzy_match)
+
+    table = apply_updates(lines, update_list)
+    # -> Streamed from the piece table into the file, hashed for the journal on the way out
+    after = ContentHasher()
+    atomic_write_lines(file_path, after.passing(table))
+
+    # -> Journaled instead of committed, so /rollback-update can undo it without git
+    edit = journal.record("update-file", [FileEdit(str(file_path), lines, after.hexdigest(), table.hunks())])
+    note_edits([edit])
+    return {"status": "success", "message": "File updated successfully.", "matches": matches, "edit_id": edit["id"]}
+
+def update_files_content(files: List[FileUpdate], journal: UndoJournal) -> Dict:
+    results, staged, errors = [], [], {}
+    for file_update in files:
+        started = time.perf_counter()
+        try:
+            file_path = validate_path(file_update.filepath)
+            with file_path.open("r") as file:
+                lines = file.readlines()
+            update_list, matches = resolve_updates(lines, file_update.updates, file_update.use_fuzzy_match)
+            table = apply_updates(lines, update_list)
+            staged.append((file_path, lines, table, ContentHasher()))
+            results.append({
+                "filepath": file_update.filepath,
+                "matches": matches,
+                "resolve_ms": round((time.perf_counter() - started) * 1000, 3),
+            })
+        except HTTPException as e:
+            errors[file_update.filepath] = e.detail
+        except Exception as e:
+            errors[file_update.filepath] = str(e)
+    if errors:
+        raise HTTPException(status_code=400, detail={"message": "No files were updated.", "errors": errors})
+
+    # -> Stage every file next to its target first, then swap them all in
+    temp_paths = []
+    try:
+        for (file_path, _, table, after), result in zip(staged, results):
+            started = time.perf_counter()
+            temp_paths.append(write_temp_lines(file_path, after.passing(table)))
+            result["write_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    except Exception as e:
+        for temp_path in temp_paths:
+            temp_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=500, detail=f"Error updating files, nothing was changed: {e}")
+
+    replaced = []
+    try:
+        for (file_path, original_lines, _, _), temp_path in zip(staged, temp_paths):
+            os.replace(temp_path, write_target(file_path))
+            replaced.append((file_path, original_lines))
+    except Exception as e:
+        for temp_path in temp_paths[len(replaced):]:
+            temp_path.unlink(missing_ok=True)
+        for file_path, original_lines in replaced:
+            atomic_write_lines(file_path, original_lines)
+        raise HTTPException(status_code=500, detail=f"Error updating files, changes were rolled back: {e}")
+
+    edit = journal.record("update-files", [
+        FileEdit(str(file_path), lines, after.hexdigest(), table.hunks()) for file_path, lines, table, after in staged
+    ])
+    note_edits([edit])
+    return {
+        "status": "success", "message": f"{len(staged)} file(s) updated successfully.",
+        "files": results, "edit_id": edit["id"],
+    }
 
 # Routes
 # -------------------------------------------
@@ -512,54 +1036,57 @@ def apply_updates(lines: List[str], updates: List[Tuple[int, ActionType, str]])
 async def update_file(
     filepath: str = Body(...),
     updates: List[UpdateMatch] = Body(...),
-    use_fuzzy_match: bool = Body(True)
+    use_fuzzy_match: bool = Body(True),
+    journal: UndoJournal = Depends(get_edit_journal),
 ):
     """ 
     Update a file's content based on a specified pattern and action.
-    Fuzzy match or exact match.
-    Returns a status message indicating success or failure.
+    Fuzzy match or exact match; a multi-line pattern is matched as a block.
+    Returns a status message indicating success or failure, with the
+    matched lines (span and score) of each update.
     """
 
     try:
         file_path = validate_path(filepath)
+        key = (str(file_path), tuple((u.content_to_match, u.new_content, u.action) for u in updates), use_fuzzy_match)
 
-        with file_path.open("r") as file:
-            lines = file.readlines()
-
-        update_list = []
-        for update in updates:
-            if use_fuzzy_match:
-                # Use fuzzy matching to find the best matching line
-                best_match_score = 0
-                best_match_index = None
-                for i, line in enumerate(lines):
-                    score = fuzz.ratio(update.content_to_match, line)
-                    if score > best_match_score:
-                        best_match_score = score
-                        best_match_index = i
-                matched_line_numbers = [best_match_index]
-            else:
-                # Use exact match
-                matched_line_numbers = [i for i, line in enumerate(lines) if update.content_to_match in line]
-
-            matched_line_numbers.sort(reverse=True)
-            for line_number in matched_line_numbers:
-                update_list.append((line_number, update.action, update.new_content))
-
-        git_commit() # Make a git commit before modifying the file content
-
-        updated_lines = apply_updates(lines, update_list)
-
-        with file_path.open("w") as file:
-            file.writelines(updated_lines)
-
-        return {"status": "success", "message": "File updated successfully."}
+        async def update() -> Dict:
+            async with file_locks.hold([str(file_path)]):
+                # -> Matching a big file takes a while; keep it off the event loop
+                return await run_in_threadpool(update_file_content, file_path, updates, use_fuzzy_match, journal)
+
+        # -> A retried request shares the first one's edit instead of applying it twice
+        return await run_coalesced("update", key, update)
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating file: {e}")
 
 
+@app.post("/update-files")
+async def update_files(files: List[FileUpdate] = Body(..., embed=True), journal: UndoJournal = Depends(get_edit_journal)):
+    """
+    Update several files in one atomic batch, each like `/update-file`.
+    All matches are resolved before anything is written, and the batch is
+    journaled as a single edit. Either every file is updated or none is.
+    Returns per-file matches and timings.
+    """
+    filepaths = [f.filepath for f in files]
+    # -> Compare resolved paths so `a/../b` or a symlink can't name the same file twice
+    targets = [os.path.realpath(p) for p in filepaths]
+    duplicates = sorted({p for p, target in zip(filepaths, targets) if targets.count(target) > 1})
+    if duplicates:
+        raise HTTPException(status_code=400, detail=f"Files listed more than once: {', '.join(duplicates)}")
+
+    async with route_limits["update"].slot(), file_locks.hold(filepaths):
+        # -> Reading and matching a whole batch takes a while; keep it off the event loop
+        return await run_in_threadpool(update_files_content, files, journal)
+
+
 @app.post("/update-file-at-lines")
-async def update_file_at_lines(filepath: str = Body(...), updates: List[UpdateLine] = Body(...)):
+async def update_file_at_lines(
+    filepath: str = Body(...), updates: List[UpdateLine] = Body(...), journal: UndoJournal = Depends(get_edit_journal)
+):
     """
     Update a file's content at specified line numbers based on the provided updates.
     Each update specifies the line number, new content, and action (insert, modify, or delete).
@@ -567,22 +1094,79 @@ async def update_file_at_lines(filepath: str = Body(...), updates: List[UpdateLi
     due to file modifications.
     """
     try:
-        file_path = validate_path(filepath)
-
-        with file_path.open("r") as file:
-            lines = file.readlines()
+        async with file_locks.hold([filepath]):
+            file_path = validate_path(filepath)
 
-        sorted_updates = sorted([(u.line_number, u.action, u.new_content) for u in updates], key=lambda x: x[0])
-        updated_lines = apply_updates(lines, sorted_updates)
+            with file_path.open("r") as file:
+                lines = file.readlines()
 
-        with file_path.open("w") as file:
-            file.writelines(updated_lines)
+            table = apply_updates(lines, [(u.line_number, u.action, u.new_content) for u in updates])
+            after = ContentHasher()
+            atomic_write_lines(file_path, after.passing(table))
 
-        return {"status": "success", "message": "File updated successfully."}
+            edit = journal.record(
+                "update-file-at-lines", [FileEdit(str(file_path), lines, after.hexdigest(), table.hunks())]
+            )
+            note_edits([edit])
+            return {"status": "success", "message": "File updated successfully.", "edit_id": edit["id"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating file: {e}")
 
 
+@app.post("/rollback-update")
+async def rollback_update(
+    num_changes: int = 1,
+    filepath: Optional[str] = None,
+    num_commits: Optional[int] = None,
+    journal: UndoJournal = Depends(get_edit_journal),
+):
+    """
+    Undo the latest changes made by the update and create routes, newest
+    first, optionally only those touching `filepath`.
+    Files edited outside the server since are left alone (409).
+    `num_commits` is the old name of `num_changes`.
+    """
+    # -> Which files an undo touches is only known once it runs
+    async with file_locks.hold_all():
+        try:
+            undone = journal.undo(num_commits or num_changes, filepath)
+        except JournalConflict as e:
+            note_edits(e.done)
+            raise HTTPException(status_code=409, detail=f"{e} {len(e.done)} change(s) were applied before it.")
+        note_edits(undone)
+        if not undone:
+            raise HTTPException(status_code=404, detail="Nothing to roll back.")
+    return {"status": "success", "message": f"Rolled back {len(undone)} change(s).", "changes": undone}
+
+
+@app.post("/redo-update")
+async def redo_update(
+    num_changes: int = 1, filepath: Optional[str] = None, journal: UndoJournal = Depends(get_edit_journal)
+):
+    """
+    Re-apply the most recently rolled back changes.
+    """
+    async with file_locks.hold_all():
+        try:
+            redone = journal.redo(num_changes, filepath)
+        except JournalConflict as e:
+            note_edits(e.done)
+            raise HTTPException(status_code=409, detail=f"{e} {len(e.done)} change(s) were applied before it.")
+        note_edits(redone)
+        if not redone:
+            raise HTTPException(status_code=404, detail="Nothing to redo.")
+    return {"status": "success", "message": f"Re-applied {len(redone)} change(s).", "changes": redone}
+
+
+@app.get("/edit-history")
+def edit_history(limit: int = 20, filepath: Optional[str] = None, journal: UndoJournal = Depends(get_edit_journal)):
+    """
+    List the latest changes made through the server, newest first, and
+    whether each one was rolled back.
+    """
+    return {"changes": journal.history(limit, filepath)}
+
+
 ################################################
 # UTILS
 ################################################
@@ -626,20 +1210,79 @@ async def plugin_logo():
     return FileResponse("logo.png")
 
 
+# -> (document, host) -> (source version, body, etag); rendered once per host until the source file changes
+_host_documents: Dict[Tuple[str, str], Tuple[Optional[Tuple[int, int]], bytes, str]] = {}
+MAX_HOST_DOCUMENTS = 64
+
+
+def render_for_host(filename: str, host: str) -> Tuple[bytes, str]:
+    """
+    JSON body and ETag of a plugin document with PLUGIN_HOSTNAME pointing at `host`.
+    Without an openapi.json on disk the schema generated from the routes is used.
+    """
+    try:
+        stat = os.stat(filename)
+        version = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        version = None
+    cached = _host_documents.get((filename, host))
+    if cached and cached[0] == version:
+        return cached[1], cached[2]
+
+    if version is not None:
+        with open(filename) as f:
+            document = json.loads(f.read().replace("PLUGIN_HOSTNAME", f"https://{host}"))
+    elif filename == OPENAPI_FILE:
+        document = {**generate_openapi_spec(), "servers": [{"url": f"https://{host}"}]}
+    else:
+        raise HTTPException(status_code=404, detail=f"{filename} not found.")
+
+    body = json.dumps(document).encode("utf-8")
+    etag = f'"{content_hash(body)}"'
+    if len(_host_documents) >= MAX_HOST_DOCUMENTS:
+        _host_documents.clear()
+    _host_documents[(filename, host)] = (version, body, etag)
+    return body, etag
+
+
+def host_document_response(request: Request, filename: str) -> Response:
+    body, etag = render_for_host(filename, request.headers["host"])
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
 @app.get("/.well-known/ai-plugin.json")
 async def plugin_manifest(request: Request):
-    host = request.headers["host"]
-    with open("ai-plugin.json") as f:
-        text = f.read().replace("PLUGIN_HOSTNAME", f"https://{host}")
-    return JSONResponse(content=json.loads(text))
+    return host_document_response(request, MANIFEST_FILE)
 
 
-@app.get("/openapi.json")
+@app.get("/openapi.json", include_in_schema=False)
 async def openapi_spec(request: Request):
-    host = request.headers["host"]
-    with open("openapi.json") as f:
-        text = f.read().replace("PLUGIN_HOSTNAME", f"https://{host}")
-    return JSONResponse(content=text, media_type="text/json")
+    return host_document_response(request, OPENAPI_FILE)
+
+
+@app.get("/docs", include_in_schema=False)
+async def api_docs():
+    return get_swagger_ui_html(openapi_url="/openapi.json", title="Code Assistant")
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Prometheus metrics: request latencies per route, time spent in git and
+    the LLM, cache hits and misses, and time per inner step.
+    """
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/traces", include_in_schema=False)
+def traces(limit: int = 20):
+    """
+    Spans of the latest traced requests (sent with `X-Trace: 1`, or all of
+    them when CODE_ASSISTANT_TRACE is set), newest first.
+    """
+    return {"traces": [trace.to_dict() for trace in list(recent_traces)[::-1][:limit]]}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,250 @@
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from collections import deque
+from contextlib import contextmanager
+import contextvars
+import os
+import threading
+import time
+
+
+# -> Record spans for every request, not only those sent with an X-Trace header
+TRACE_ALL = os.getenv("CODE_ASSISTANT_TRACE", "").lower() in ("1", "true", "yes")
+TRACE_HISTORY = 100
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# ===========================================
+# Metrics
+# ===========================================
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values: Dict[Tuple[str, ...], list] = {}  # labels -> [count per bucket..., +Inf count, sum]
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, counts in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {counts[-1]:g}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+REGISTRY: List = []
+
+request_duration = Histogram(
+    "code_assistant_request_duration_seconds", "Time spent handling requests.", ("method", "route", "status")
+)
+subprocess_seconds = Counter(
+    "code_assistant_subprocess_seconds_total", "Time spent in subprocesses, by command.", ("command",)
+)
+subprocess_calls = Counter("code_assistant_subprocess_calls_total", "Subprocesses run, by command.", ("command",))
+llm_seconds = Counter("code_assistant_llm_seconds_total", "Time spent waiting on the LLM, by outcome.", ("outcome",))
+llm_calls = Counter("code_assistant_llm_calls_total", "LLM calls, by outcome.", ("outcome",))
+cache_hits = Counter("code_assistant_cache_hits_total", "Cache hits, by cache.", ("cache",))
+cache_misses = Counter("code_assistant_cache_misses_total", "Cache misses, by cache.", ("cache",))
+step_seconds = Counter("code_assistant_step_seconds_total", "Time spent in inner steps of requests.", ("step",))
+step_calls = Counter("code_assistant_step_calls_total", "Inner steps run.", ("step",))
+coalesced_requests = Counter(
+    "code_assistant_coalesced_requests_total", "Calls that shared an identical in-flight computation.", ("route",)
+)
+rejected_requests = Counter(
+    "code_assistant_rejected_requests_total", "Calls turned away with a 429 because the route was full.", ("route",)
+)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def record_cache(cache: str, hit: bool, count: int = 1) -> None:
+    if count:
+        (cache_hits if hit else cache_misses).inc(cache, amount=count)
+
+
+def record_subprocess(command: str, seconds: float) -> None:
+    subprocess_seconds.inc(command, amount=seconds)
+    subprocess_calls.inc(command)
+    _add_span(f"git_{command}", seconds)
+
+
+def record_llm(outcome: str, seconds: float) -> None:
+    llm_seconds.inc(outcome, amount=seconds)
+    llm_calls.inc(outcome)
+    _add_span("llm", seconds)
+
+
+# ===========================================
+# Tracing
+# ===========================================
+
+class Trace:
+    """
+    Spans recorded while handling one request, as (name, start, duration)
+    in seconds relative to the start of the request.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.method, self.path = method, path
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []
+        self.duration: Optional[float] = None
+        self.status: Optional[int] = None
+
+    def add(self, name: str, started: float, seconds: float) -> None:
+        # list.append is atomic, so spans from worker threads need no lock
+        self.spans.append((name, started - self.started, seconds))
+
+    def server_timing(self) -> str:
+        totals: Dict[str, List[float]] = {}
+        for name, _, seconds in self.spans:
+            total = totals.setdefault(name, [0, 0.0])
+            total[0] += 1
+            total[1] += seconds
+        parts = [f'{name};dur={seconds * 1000:.2f};desc="x{count}"' for name, (count, seconds) in totals.items()]
+        if self.duration is not None:
+            parts.append(f"total;dur={self.duration * 1000:.2f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "duration_ms": round((self.duration or 0) * 1000, 3),
+            "spans": [
+                {"name": name, "start_ms": round(start * 1000, 3), "duration_ms": round(seconds * 1000, 3)}
+                for name, start, seconds in self.spans
+            ],
+        }
+
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+recent_traces: "deque[Trace]" = deque(maxlen=TRACE_HISTORY)
+
+
+def _add_span(name: str, seconds: float) -> None:
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, time.perf_counter() - seconds, seconds)
+
+
+@contextmanager
+def span(step: str) -> Iterator[None]:
+    """
+    Time an inner step: always counted in the step metrics, and recorded as
+    a span when the request is being traced.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        step_seconds.inc(step, amount=seconds)
+        step_calls.inc(step)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(step, started, seconds)
+
+
+class MetricsMiddleware:
+    """
+    Observes the latency of every request by route template, and traces the
+    ones sent with `X-Trace: 1` (or all of them with CODE_ASSISTANT_TRACE),
+    reporting their spans in a Server-Timing header.
+    """
+
+    def __init__(self, app, trace_all: bool = TRACE_ALL):
+        self.app = app
+        self.trace_all = trace_all
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = None
+        if self.trace_all or (b"x-trace", b"1") in scope.get("headers", ()):
+            trace = Trace(scope["method"], scope["path"])
+        token = current_trace.set(trace)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace is not None:
+                    trace.duration = time.perf_counter() - started
+                    headers = list(message.get("headers", ()))
+                    headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            seconds = time.perf_counter() - started
+            route = scope.get("route")
+            # -> Unmatched paths share one label so scanners can't blow up the series count
+            request_duration.observe(seconds, scope["method"], getattr(route, "path", "unmatched"), str(status))
+            current_trace.reset(token)
+            if trace is not None:
+                trace.duration, trace.status = seconds, status
+                recent_traces.append(trace)
@@ -0,0 +1,545 @@
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+import ast
+import os
+import threading
+
+from metrics import record_cache, span
+from project_files import walk_project
+from storage import content_hash, load_json, project_cache_dir, save_json
+
+
+# ===========================================
+# Parsing
+# ===========================================
+
+def parse_source_code(file_path):
+    with open(file_path, "r") as file:
+        source_code = file.read()
+
+    return _outline_tree(ast.parse(source_code))
+
+
+def _outline_tree(tree) -> dict:
+    imports, classes, functions = [], [], []
+
+    for node in tree.body:
+        if isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
+            imports.append(ast.unparse(node))
+        elif isinstance(node, ast.ClassDef):
+            classes.append(node.name)
+            methods = []
+            for item in node.body:
+                if isinstance(item, ast.FunctionDef):
+                    methods.append(item.name)
+            functions.append({"class": node.name, "methods": methods})
+        else:
+            if isinstance(node, ast.FunctionDef):
+                functions.append({"function": node.name})
+
+    return {"imports": imports, "classes": classes, "functions": functions}
+
+
+# -> What parsing one file can raise; the file gets an error instead of failing the whole walk
+PARSE_ERRORS = (SyntaxError, ValueError, UnicodeDecodeError, RecursionError, OSError)
+
+
+def analyze_or_error(job: Tuple[str, str]) -> Tuple[dict, dict]:
+    """
+    Outline and symbols of one (file path, relative path), from a single
+    ast.parse. A file that can't be parsed gets the error inline in both.
+    """
+    file_path, relpath = job
+    try:
+        with open(file_path, "r") as file:
+            tree = ast.parse(file.read())
+        outline = _outline_tree(tree)
+    except PARSE_ERRORS as e:
+        error = {"error": f"{type(e).__name__}: {e}"}
+        return error, error
+    try:
+        return outline, _symbols_tree(tree, relpath)
+    except RecursionError as e:
+        return outline, {"error": f"{type(e).__name__}: {e}"}
+
+
+class SymbolVisitor(ast.NodeVisitor):
+    """
+    Collects definitions (with 0-based, end-exclusive line spans and dotted
+    qualnames, nested and async ones included), imports resolved to absolute
+    module names, and call/attribute references.
+    """
+
+    def __init__(self, module: str, is_package: bool = False):
+        self.module = module
+        self.package = module if is_package else module.rpartition(".")[0]
+        self.scope: List[str] = []
+        self.kinds: List[str] = []
+        self.definitions, self.imports, self.references = [], [], []
+
+    def _define(self, node, kind: str) -> None:
+        if self.kinds and self.kinds[-1] == "class" and kind != "class":
+            kind = kind.replace("function", "method")
+        decorators = node.decorator_list
+        start = min([node.lineno] + [decorator.lineno for decorator in decorators])
+        self.definitions.append({
+            "name": node.name, "qualname": ".".join(self.scope + [node.name]), "kind": kind,
+            "start_line": start - 1, "end_line": node.end_lineno,
+        })
+
+        # Decorators, bases and defaults are evaluated in the enclosing scope
+        for decorator in decorators:
+            self._visit_used(decorator)
+        if isinstance(node, ast.ClassDef):
+            for base in node.bases + [keyword.value for keyword in node.keywords]:
+                self._visit_used(base)
+        else:
+            self.visit(node.args)
+            if node.returns:
+                self.visit(node.returns)
+
+        self.scope.append(node.name)
+        self.kinds.append(kind)
+        for child in node.body:
+            self.visit(child)
+        self.scope.pop()
+        self.kinds.pop()
+
+    def _visit_used(self, node) -> None:
+        # A bare name or dotted path used as a decorator or base is one reference
+        self._reference(node, "name")
+        if isinstance(node, ast.Attribute):
+            self.visit(node.value)
+        elif not isinstance(node, ast.Name):
+            self.visit(node)
+
+    def visit_ClassDef(self, node):
+        self._define(node, "class")
+
+    def visit_FunctionDef(self, node):
+        self._define(node, "function")
+
+    def visit_AsyncFunctionDef(self, node):
+        self._define(node, "async_function")
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.imports.append({"module": alias.name, "name": None, "asname": alias.asname, "line": node.lineno - 1})
+
+    def visit_ImportFrom(self, node):
+        module = node.module or ""
+        if node.level:
+            base = self.package.split(".") if self.package else []
+            base = base[:len(base) - (node.level - 1)] if node.level > 1 else base
+            module = ".".join(part for part in base + [module] if part)
+        for alias in node.names:
+            self.imports.append({"module": module, "name": alias.name, "asname": alias.asname, "line": node.lineno - 1})
+
+    def visit_Call(self, node):
+        self._reference(node.func, "call")
+        # The callee itself is recorded as a call, not as an attribute access
+        self.visit(node.func.value if isinstance(node.func, ast.Attribute) else node.func)
+        for arg in node.args + node.keywords:
+            self.visit(arg)
+
+    def visit_Attribute(self, node):
+        self._reference(node, "attribute")
+        self.generic_visit(node)
+
+    def _reference(self, node, kind: str) -> None:
+        if isinstance(node, ast.Name):
+            name, target = node.id, node.id
+        elif isinstance(node, ast.Attribute):
+            name, target = node.attr, _dotted(node)
+        else:
+            return
+        self.references.append({
+            "name": name, "target": target, "kind": kind,
+            "scope": ".".join(self.scope), "line": node.lineno - 1,
+        })
+
+
+def _dotted(node) -> str:
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    parts.append(node.id if isinstance(node, ast.Name) else "?")
+    return ".".join(reversed(parts))
+
+
+def module_name(relpath: str) -> Tuple[str, bool]:
+    """
+    Dotted module name of a project-relative .py path, and whether it's a package.
+    """
+    parts = relpath[:-3].split("/")
+    if parts[-1] == "__init__":
+        return ".".join(parts[:-1]), True
+    return ".".join(parts), False
+
+
+def _symbols_tree(tree, relpath: str) -> dict:
+    module, is_package = module_name(relpath)
+    visitor = SymbolVisitor(module, is_package)
+    visitor.visit(tree)
+    return {"definitions": visitor.definitions, "imports": visitor.imports, "references": visitor.references}
+
+
+SPAN_CACHE_SIZE = 256
+
+_span_cache: "OrderedDict[str, Tuple[Tuple[int, int], Dict[str, dict]]]" = OrderedDict()
+_span_cache_lock = threading.Lock()
+
+
+def _header_end(lines: List[str], node) -> int:
+    body_line = node.body[0].lineno - 1
+    for i in range(node.lineno - 1, body_line):
+        if lines[i].split("#", 1)[0].rstrip().endswith(":"):
+            return i + 1
+    return max(body_line, node.lineno)
+
+
+def symbol_spans(file_path: str) -> Dict[str, dict]:
+    """
+    Line spans of every class and function in a file, keyed by dotted
+    qualname. Spans are 0-based and end-exclusive; [start_line, signature_end)
+    is the decorated signature, up to the line closing the def/class header.
+    Cached per file version (mtime, size), so repeat lookups skip ast.parse.
+    """
+    stat = os.stat(file_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _span_cache_lock:
+        cached = _span_cache.get(file_path)
+        if cached and cached[0] == version:
+            _span_cache.move_to_end(file_path)
+            record_cache("symbol_spans", hit=True)
+            return cached[1]
+
+    record_cache("symbol_spans", hit=False)
+    with open(file_path, "r") as file:
+        source = file.read()
+    with span("ast_parse"):
+        tree = ast.parse(source)
+    lines = source.splitlines()
+    spans: Dict[str, dict] = {}
+    stack = [("", node) for node in reversed(tree.body)]
+    while stack:
+        prefix, node = stack.pop()
+        if not isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        qualname = f"{prefix}{node.name}"
+        kind = {"ClassDef": "class", "FunctionDef": "function", "AsyncFunctionDef": "async_function"}[type(node).__name__]
+        if kind != "class" and spans.get(prefix[:-1], {}).get("kind") == "class":
+            kind = kind.replace("function", "method")
+        start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list]) - 1
+        spans[qualname] = {
+            "kind": kind,
+            "start_line": start,
+            "end_line": node.end_lineno,
+            "signature_end": _header_end(lines, node),
+        }
+        stack.extend((f"{qualname}.", child) for child in reversed(node.body))
+
+    with _span_cache_lock:
+        _span_cache[file_path] = (version, spans)
+        _span_cache.move_to_end(file_path)
+        while len(_span_cache) > SPAN_CACHE_SIZE:
+            _span_cache.popitem(last=False)
+    return spans
+
+
+# ===========================================
+# Index
+# ===========================================
+
+INDEX_VERSION = 2
+INDEX_FILE = "outline.json"
+
+# -> Below this many changed files a process pool costs more than it saves
+PARALLEL_THRESHOLD = 32
+
+# -> Called with (root, [(relpath, entry, symbols)]) for the files an outline index parsed,
+# so the symbol index takes its symbols from the same parse
+parse_listeners: List[Callable[[str, List[Tuple[str, dict, dict]]], None]] = []
+
+
+class OutlineIndex:
+    """
+    Outline results of a project's Python files, keyed by relative path and
+    validated against (mtime, size, content hash). Persisted between restarts;
+    only files whose content changed are parsed again, and the symbols of
+    that parse go to `parse_listeners`.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.path = project_cache_dir(root) / INDEX_FILE
+        self.lock = threading.Lock()
+        self.unsaved = False
+        data = load_json(self.path, {})
+        if data.get("version") == INDEX_VERSION:
+            self.entries: Dict[str, dict] = data["entries"]
+        else:
+            self.entries = {}
+
+    def outlines(
+        self,
+        relpaths: Iterable[str],
+        complete: bool = True,
+        executor: Optional[Executor] = None,
+        save: bool = True,
+    ) -> Dict[str, dict]:
+        """
+        Return the outline of every given file, parsing only stale ones.
+        With `complete`, entries for files no longer listed are dropped.
+        Parsing runs on `executor` when given; without `save` the index is
+        only written by a later call or `save()`.
+        """
+        relpaths = list(relpaths)
+        parsed_symbols = []
+        with self.lock:
+            to_parse = {}
+            for relpath in relpaths:
+                _, stale = self._validate(relpath)
+                if stale is not None:
+                    to_parse[relpath] = stale
+
+            record_cache("outline", hit=True, count=len(relpaths) - len(to_parse))
+            record_cache("outline", hit=False, count=len(to_parse))
+            if to_parse:
+                with span("outline_parse"):
+                    parsed = self._parse_all(list(to_parse), executor)
+                for (relpath, entry), (outline, symbols) in zip(to_parse.items(), parsed):
+                    self.entries[relpath] = {**entry, "outline": outline}
+                    parsed_symbols.append((relpath, entry, symbols))
+                self.unsaved = True
+
+            if complete:
+                listed = set(relpaths)
+                for relpath in [p for p in self.entries if p not in listed]:
+                    del self.entries[relpath]
+                    self.unsaved = True
+
+            if save:
+                self._save()
+
+            outlines = {p: self.entries[p]["outline"] for p in relpaths if p in self.entries}
+        self._emit(parsed_symbols)
+        return outlines
+
+    def analyze(self, relpaths: Iterable[str], executor: Optional[Executor] = None) -> List[Tuple[str, dict, dict]]:
+        """
+        Parse the given files whatever their cached state, for a caller that
+        needs their symbols: (relpath, entry, symbols) per readable file.
+        The outlines of that parse are kept, and written with the next save.
+        """
+        with self.lock:
+            entries = {}
+            for relpath in relpaths:
+                entry = self._read_entry(relpath)
+                if entry is not None:
+                    entries[relpath] = entry
+            if not entries:
+                return []
+            with span("outline_parse"):
+                parsed = self._parse_all(list(entries), executor)
+            for (relpath, entry), (outline, _) in zip(entries.items(), parsed):
+                self.entries[relpath] = {**entry, "outline": outline}
+            self.unsaved = True
+        return [(relpath, entry, symbols) for (relpath, entry), (_, symbols) in zip(entries.items(), parsed)]
+
+    def _validate(self, relpath: str) -> Tuple[bool, Optional[dict]]:
+        """
+        (True, None) when the cached outline of `relpath` is current, (False,
+        new entry without its outline) when it must be parsed again, and
+        (False, None) when the file can't be read.
+        """
+        file_path = os.path.join(self.root, relpath)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False, None
+        entry = self.entries.get(relpath)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return True, None
+
+        # Touched files only need a new parse when their content actually differs
+        stale = self._read_entry(relpath, stat)
+        if stale is None:
+            return False, None
+        if entry and entry["hash"] == stale["hash"]:
+            entry["mtime_ns"], entry["size"] = stat.st_mtime_ns, stat.st_size
+            self.unsaved = True
+            return True, None
+        return False, stale
+
+    def _read_entry(self, relpath: str, stat: Optional[os.stat_result] = None) -> Optional[dict]:
+        file_path = os.path.join(self.root, relpath)
+        try:
+            stat = stat or os.stat(file_path)
+            with open(file_path, "rb") as file:
+                digest = content_hash(file.read())
+        except OSError:
+            return None
+        return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "hash": digest}
+
+    def lookup(self, relpath: str) -> Tuple[Optional[dict], Optional[dict]]:
+        """
+        The current outline of one file, or None and the entry to `store()`
+        with its outline once parsed (None too when the file can't be read).
+        """
+        with self.lock:
+            current, stale = self._validate(relpath)
+            hit = self.entries[relpath]["outline"] if current else None
+        record_cache("outline", hit=current)
+        return hit, stale
+
+    def store(self, relpath: str, entry: dict, outline: dict, symbols: dict) -> None:
+        with self.lock:
+            self.entries[relpath] = {**entry, "outline": outline}
+            self.unsaved = True
+        self._emit([(relpath, entry, symbols)])
+
+    def save(self) -> None:
+        with self.lock:
+            self._save()
+
+    def _save(self) -> None:
+        if self.unsaved:
+            with span("outline_save"):
+                save_json(self.path, {"version": INDEX_VERSION, "entries": self.entries})
+            self.unsaved = False
+
+    def _emit(self, parsed: List[Tuple[str, dict, dict]]) -> None:
+        if parsed:
+            for listener in parse_listeners:
+                listener(self.root, parsed)
+
+    def _parse_all(self, relpaths: List[str], executor: Optional[Executor] = None) -> List[Tuple[dict, dict]]:
+        jobs = [(os.path.join(self.root, relpath), relpath) for relpath in relpaths]
+        if len(jobs) < PARALLEL_THRESHOLD:
+            return [analyze_or_error(job) for job in jobs]
+        if executor is not None:
+            return list(executor.map(analyze_or_error, jobs, chunksize=max(1, len(jobs) // 16)))
+
+        # Cold start: spread the parsing over every core
+        workers = os.cpu_count() or 1
+        chunksize = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(analyze_or_error, jobs, chunksize=chunksize))
+
+
+_indexes: Dict[str, OutlineIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_outline_index(root: str) -> OutlineIndex:
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = OutlineIndex(root)
+        return index
+
+
+# ===========================================
+# Streaming
+# ===========================================
+
+# -> Records that may wait on a parse before the walk pauses, bounding memory
+STREAM_WINDOW = 256
+STREAM_WORKERS = os.cpu_count() or 1
+
+
+def stream_outline(root: str, path: Optional[str] = None, max_depth: Optional[int] = None) -> Iterator[dict]:
+    """
+    Yield the outline of `root` (or of `path` inside it) one record per
+    directory and file, in walk order, as soon as each is known. Cached
+    outlines go out right away; stale files are parsed on a process pool
+    while the walk goes on, at most `STREAM_WINDOW` records ahead of the
+    oldest unfinished one. Ends with an `end` record holding the counts.
+    """
+    index: Optional[OutlineIndex] = None
+    base = os.path.join(root, path) if path else root
+    counts = {"dirs": 0, "files": 0, "outlined": 0, "errors": 0}
+    pending: deque = deque()  # (record, future or None), in walk order
+    executor: Optional[ProcessPoolExecutor] = None
+    parsed_inline = 0
+
+    def name_of(parts: Tuple[str, ...]) -> str:
+        return "/".join((path,) + parts if path else parts)
+
+    def outline_file(record: dict) -> Optional[Future]:
+        # Fills in a cached outline, or returns the parse to wait for
+        nonlocal executor, parsed_inline
+        outline, stale = index.lookup(record["name"])
+        if outline is None and stale is None:
+            outline = {"error": "OSError: file can't be read"}
+        if outline is not None:
+            record["outline"] = outline
+            return None
+        job = (os.path.join(root, record["name"]), record["name"])
+        if parsed_inline < PARALLEL_THRESHOLD:
+            # -> A handful of changed files isn't worth starting processes for
+            parsed_inline += 1
+            record["outline"], symbols = analyze_or_error(job)
+            index.store(record["name"], stale, record["outline"], symbols)
+            return None
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=STREAM_WORKERS)
+        future = executor.submit(analyze_or_error, job)
+
+        def store(future: Future) -> None:
+            # -> Kept even if the client left before this record went out
+            if not future.cancelled() and future.exception() is None:
+                index.store(record["name"], stale, *future.result())
+
+        future.add_done_callback(store)
+        return future
+
+    def finish(record: dict, future: Optional[Future]) -> dict:
+        if future is not None:
+            try:
+                record["outline"] = future.result()[0]
+            except Exception as e:
+                record["outline"] = {"error": f"{type(e).__name__}: {e}"}
+        if "outline" in record:
+            counts["outlined"] += 1
+            counts["errors"] += "error" in record["outline"]
+        return record
+
+    def add(record: dict) -> Iterator[dict]:
+        future = outline_file(record) if record["type"] == "file" and record["name"].endswith(".py") else None
+        pending.append((record, future))
+        while pending and (pending[0][1] is None or pending[0][1].done() or len(pending) > STREAM_WINDOW):
+            yield finish(*pending.popleft())
+
+    try:
+        if not os.path.isdir(base):
+            index = get_outline_index(root)
+            counts["files"] += 1
+            yield from add({"type": "file", "name": path or "."})
+        else:
+            counts["dirs"] += 1
+            yield {"type": "dir", "name": path or "."}
+            # -> Loaded after the first record, so even a big cached index doesn't delay it
+            index = get_outline_index(root)
+            for parts, _, is_dir in walk_project(base, max_depth=max_depth):
+                if is_dir:
+                    counts["dirs"] += 1
+                    record = {"type": "dir", "name": name_of(parts)}
+                    if max_depth is not None and len(parts) >= max_depth:
+                        record["truncated"] = True
+                else:
+                    counts["files"] += 1
+                    record = {"type": "file", "name": name_of(parts)}
+                yield from add(record)
+        while pending:
+            yield finish(*pending.popleft())
+        yield {"type": "end", **counts}
+    finally:
+        # -> Also runs when the client goes away mid-stream: queued parses are dropped
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if index is not None:
+            index.save()
@@ -0,0 +1,179 @@
+from typing import Dict, List, Optional
+from concurrent.futures import Executor, ProcessPoolExecutor
+import os
+import threading
+import time
+
+from file_index import get_project_files
+from metrics import span
+from outline import get_outline_index
+from relevance_index import get_relevance_index
+from search_index import get_search_index
+from symbol_index import get_symbol_index
+
+
+# -> Parser processes one warm-up may use, so requests keep the other cores
+PREWARM_WORKERS = int(os.getenv("PREWARM_WORKERS", max(1, (os.cpu_count() or 1) // 2)))
+# -> Files outlined between two checks for cancellation
+PREWARM_BATCH = 256
+
+STAGES = ("walk", "outline", "search", "relevance", "symbols")
+
+
+class PrewarmJob:
+    """
+    Background warm-up of one project's caches, stage by stage: walk the
+    tree, outline its Python files in batches, then refresh the search,
+    relevance and symbol indexes. Results land in the shared per-project
+    indexes, so requests made meanwhile reuse whatever is done already.
+    Cancelling stops it at the next batch or stage.
+    """
+
+    def __init__(self, root: str, workers: int = PREWARM_WORKERS):
+        self.root = root
+        self.workers = workers
+        self.state = "running"
+        self.stage: Optional[str] = None
+        self.completed: List[str] = []
+        self.entries = 0
+        self.relpaths: List[str] = []
+        self.outlined = 0
+        self.error: Optional[str] = None
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.cancelled = threading.Event()
+        self.stage_done = {stage: threading.Event() for stage in STAGES}
+        self.thread = threading.Thread(target=self._run, name=f"prewarm {root}", daemon=True)
+
+    @property
+    def running(self) -> bool:
+        return self.state == "running"
+
+    def start(self) -> "PrewarmJob":
+        self.thread.start()
+        return self
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+    def wait(self, stage: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """
+        Block until `stage` (the whole job by default) is over, whether it
+        finished or the job was cancelled or failed. False on timeout.
+        """
+        if stage is None:
+            self.thread.join(timeout)
+            return not self.thread.is_alive()
+        return self.stage_done[stage].wait(timeout)
+
+    def _run(self) -> None:
+        try:
+            # -> Processes are only forked once a batch is big enough to need them
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                for stage in STAGES:
+                    if self.cancelled.is_set():
+                        break
+                    self.stage = stage
+                    with span(f"prewarm_{stage}"):
+                        getattr(self, f"_{stage}")(executor)
+                    if not self.cancelled.is_set():
+                        self.completed.append(stage)
+                    self.stage_done[stage].set()
+            self.state = "cancelled" if self.cancelled.is_set() else "done"
+        except Exception as e:
+            self.state, self.error = "failed", f"{type(e).__name__}: {e}"
+        finally:
+            self.stage, self.finished = None, time.monotonic()
+            # Waiters are released however the job ended; they do the rest themselves
+            for event in self.stage_done.values():
+                event.set()
+
+    # Stages
+    # -------------------------------------------
+
+    def _walk(self, executor: Executor) -> None:
+        # -> The walk the indexes are fed from, which then goes on in the background
+        files = get_project_files(self.root)
+        files.ensure_current()
+        self.entries = len(files.stats)
+        self.relpaths = [relpath for relpath in files.stats if relpath.endswith(".py")]
+
+    def _outline(self, executor: Executor) -> None:
+        index = get_outline_index(self.root)
+        try:
+            for start in range(0, len(self.relpaths), PREWARM_BATCH):
+                if self.cancelled.is_set():
+                    return
+                batch = self.relpaths[start:start + PREWARM_BATCH]
+                # -> Saved once at the end instead of rewriting the whole index per batch
+                index.outlines(batch, complete=False, executor=executor, save=False)
+                self.outlined += len(batch)
+        finally:
+            index.save()
+
+    def _search(self, executor: Executor) -> None:
+        get_search_index(self.root).current()
+
+    def _relevance(self, executor: Executor) -> None:
+        get_relevance_index(self.root).current()
+
+    def _symbols(self, executor: Executor) -> None:
+        get_symbol_index(self.root).current()
+
+    # Status
+    # -------------------------------------------
+
+    def status(self) -> Dict:
+        progress = len(self.completed)
+        if self.stage == "outline" and self.relpaths:
+            progress += self.outlined / len(self.relpaths)
+        return {
+            "root": self.root,
+            "state": self.state,
+            "stage": self.stage,
+            "stages_done": list(self.completed),
+            "progress": round(progress / len(STAGES), 3),
+            "entries": self.entries,
+            "python_files": len(self.relpaths),
+            "outlined": self.outlined,
+            "workers": self.workers,
+            "elapsed_ms": round(((self.finished or time.monotonic()) - self.started) * 1000, 1),
+            "error": self.error,
+        }
+
+
+_jobs: Dict[str, PrewarmJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def start_prewarm(root: str) -> PrewarmJob:
+    """
+    Warm `root` up in the background, or return the job already doing it.
+    """
+    with _jobs_lock:
+        job = _jobs.get(root)
+        if job is None or not job.running:
+            job = _jobs[root] = PrewarmJob(root).start()
+        return job
+
+
+def get_prewarm(root: str) -> Optional[PrewarmJob]:
+    with _jobs_lock:
+        return _jobs.get(root)
+
+
+def wait_for_prewarm(root: str, stage: Optional[str] = None, timeout: Optional[float] = None) -> None:
+    # -> Requests wait for a running warm-up rather than redoing its work next to it
+    job = get_prewarm(root)
+    if job is not None and job.running:
+        job.wait(stage, timeout)
+
+
+def cancel_prewarm(root: Optional[str] = None) -> None:
+    """
+    Cancel the warm-up of `root`, or of every project.
+    """
+    with _jobs_lock:
+        jobs = list(_jobs.values()) if root is None else [_jobs[root]] if root in _jobs else []
+    for job in jobs:
+        job.cancel()
@@ -0,0 +1,241 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import json
+import os
+import re
+
+
+# ===========================================
+# Ignore rules
+# ===========================================
+
+# -> Next to this module, so the rules apply whatever directory the server was started from
+IGNORE_CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ignore_config.json")
+
+
+class IgnoreRule:
+    """
+    One gitignore-style pattern, scoped to the directory that declared it.
+    """
+
+    def __init__(self, pattern: str, base: Tuple[str, ...] = ()):
+        self.negate = pattern.startswith("!")
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        # A slash anywhere but the end anchors the pattern to its base directory
+        self.anchored = "/" in pattern
+        self.base = base
+        self.regex = re.compile(_translate(pattern.lstrip("/")))
+
+    def matches(self, parts: Tuple[str, ...], is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if parts[:len(self.base)] != self.base:
+            return False
+        if self.anchored:
+            return self.regex.fullmatch("/".join(parts[len(self.base):])) is not None
+        return self.regex.fullmatch(parts[-1]) is not None
+
+
+def _translate(pattern: str) -> str:
+    regex, i = "", 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[" and "]" in pattern[i + 1:]:
+            end = pattern.index("]", i + 1)
+            body = pattern[i + 1:end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            regex += f"[{body}]"
+            i = end
+        elif char == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(char)
+        i += 1
+    return regex
+
+
+def parse_ignore_lines(lines, base: Tuple[str, ...] = ()) -> List[IgnoreRule]:
+    rules = []
+    for line in lines:
+        line = line.rstrip("\n").rstrip()
+        if line and not line.startswith("#"):
+            rules.append(IgnoreRule(line, base))
+    return rules
+
+
+def load_ignore_config(config_file: str = IGNORE_CONFIG_FILE) -> List[IgnoreRule]:
+    try:
+        with open(config_file, "r") as file:
+            config = json.load(file)
+    except (OSError, ValueError):
+        return []
+    return parse_ignore_lines(pattern for patterns in config.values() for pattern in patterns)
+
+
+def is_ignored(rules: List[IgnoreRule], parts: Tuple[str, ...], is_dir: bool) -> bool:
+    # Like git, the last matching rule wins so negations can re-include paths
+    for rule in reversed(rules):
+        if rule.matches(parts, is_dir):
+            return not rule.negate
+    return False
+
+
+default_rules = load_ignore_config()
+
+
+# ===========================================
+# Walker
+# ===========================================
+
+def walk_project(
+    root: str,
+    max_depth: Optional[int] = None,
+    cursor: Optional[str] = None,
+    rules: Optional[List[IgnoreRule]] = None,
+) -> Iterator[Tuple[Tuple[str, ...], os.DirEntry, bool]]:
+    """
+    Yield (relative path parts, entry, is_dir) for every non-ignored path
+    under `root`, in sorted pre-order. Uses an explicit stack instead of
+    recursion and one scandir per directory. Entries up to and including
+    `cursor` are skipped without descending into finished subtrees.
+    """
+    after = tuple(cursor.strip("/").split("/")) if cursor else None
+    base_rules = default_rules if rules is None else rules
+    stack = [_list_dir(root, (), base_rules, after)]
+
+    while stack:
+        dir_rules, children = stack[-1]
+        item = next(children, None)
+        if item is None:
+            stack.pop()
+            continue
+
+        parts, entry, is_dir = item
+        # The cursor's own ancestors were returned already but still need descending into
+        if not (after and parts <= after):
+            yield parts, entry, is_dir
+        if is_dir and not entry.is_symlink() and (max_depth is None or len(parts) < max_depth):
+            stack.append(_list_dir(root, parts, dir_rules, after))
+
+
+def _list_dir(root: str, dir_parts: Tuple[str, ...], rules: List[IgnoreRule], after: Optional[Tuple[str, ...]]):
+    try:
+        with os.scandir(os.path.join(root, *dir_parts)) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return rules, iter(())
+
+    for entry in entries:
+        if entry.name == ".gitignore" and entry.is_file():
+            with open(entry.path, "r", errors="replace") as file:
+                rules = rules + parse_ignore_lines(file, dir_parts)
+            break
+
+    children = []
+    for entry in entries:
+        parts = dir_parts + (entry.name,)
+        if after and parts <= after and after[:len(parts)] != parts:
+            continue
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            continue
+        if not is_ignored(rules, parts, is_dir):
+            children.append((parts, entry, is_dir))
+    return rules, iter(children)
+
+
+def is_glob(path: str) -> bool:
+    return any(char in path for char in "*?[")
+
+
+def glob_files(pattern: str, limit: int) -> Tuple[List[str], bool]:
+    """
+    Files matching an absolute glob pattern (`**` spans directories), in
+    sorted order, found by walking only below its literal prefix with the
+    usual ignore rules. Also tells whether more than `limit` matched.
+    """
+    parts = pattern.split("/")
+    literal = next(i for i, part in enumerate(parts) if is_glob(part))
+    base = "/".join(parts[:literal]) or "/"
+    rest = "/".join(parts[literal:])
+    regex = re.compile(_translate(rest))
+    # -> Without `**` nothing deeper than the pattern itself can match
+    max_depth = None if "**" in rest else len(parts) - literal
+
+    matches = []
+    for rel_parts, entry, is_dir in walk_project(base, max_depth=max_depth):
+        if not is_dir and regex.fullmatch("/".join(rel_parts)):
+            if len(matches) == limit:
+                return matches, True
+            matches.append(entry.path)
+    return matches, False
+
+
+def get_file_structure(
+    filepath: str,
+    max_depth: Optional[int] = None,
+    max_entries: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> Dict:
+    """
+    Nested {"type", "name", "children"} tree of `filepath`. When
+    `max_entries` cuts the listing short, the root carries a `next_cursor`
+    to pass back for the following page.
+    """
+    if not os.path.isdir(filepath):
+        return {"type": "file", "name": "."}
+
+    tree = {"type": "dir", "name": ".", "children": []}
+    dirs = {(): tree}
+    count, last_parts = 0, None
+
+    for parts, entry, is_dir in walk_project(filepath, max_depth=max_depth, cursor=cursor):
+        if max_entries is not None and count >= max_entries:
+            tree["next_cursor"] = "/".join(last_parts) if last_parts else cursor
+            break
+
+        parent = dirs.get(parts[:-1])
+        if parent is None:
+            parent = _ensure_dir(dirs, parts[:-1])
+
+        name = "/".join(parts)
+        if is_dir:
+            node = {"type": "dir", "name": name, "children": []}
+            if max_depth is not None and len(parts) >= max_depth:
+                node["truncated"] = True
+            dirs[parts] = node
+        else:
+            node = {"type": "file", "name": name}
+        parent["children"].append(node)
+        last_parts = parts
+        count += 1
+
+    return tree
+
+
+def _ensure_dir(dirs: Dict, parts: Tuple[str, ...]) -> Dict:
+    # Ancestors of a resumed page were returned earlier; rebuild them as containers
+    if parts in dirs:
+        return dirs[parts]
+    parent = _ensure_dir(dirs, parts[:-1])
+    node = {"type": "dir", "name": "/".join(parts), "children": []}
+    parent["children"].append(node)
+    dirs[parts] = node
+    return node
@@ -0,0 +1,151 @@
+from typing import Dict, Optional, Tuple
+import json
+import os
+import sqlite3
+import threading
+
+
+PROJECTS_DB = os.getenv("CODE_ASSISTANT_PROJECTS_DB", "projects.db")
+
+# -> Requests without a session header share this one, which also tracks the latest selection
+DEFAULT_SESSION = "default"
+
+# -> PRAGMA user_version once projects.json has been imported
+LEGACY_IMPORTED = 1
+
+
+class ProjectStore:
+    """
+    Projects and per-session selections kept in SQLite (WAL mode), so
+    several server workers and clients share one consistent state.
+    Reads are served from memory and reloaded only when another
+    connection has committed a change.
+    """
+
+    def __init__(self, db_path: str = PROJECTS_DB, legacy_file: Optional[str] = None):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS projects (name TEXT PRIMARY KEY, root TEXT, cwd TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, project TEXT NOT NULL, cwd TEXT)")
+        self._data_version = None
+        self._projects: Dict[str, Dict] = {}
+        self._sessions: Dict[str, Tuple[str, Optional[str]]] = {}
+        if legacy_file:
+            self._import_legacy(legacy_file)
+
+    def _import_legacy(self, legacy_file: str) -> None:
+        # One-off migration of the projects.json the server used to rewrite on every change.
+        # user_version records that it ran, so projects removed since then stay removed.
+        if not os.path.exists(legacy_file):
+            return
+        try:
+            with open(legacy_file, "r") as file:
+                legacy = json.load(file)
+        except ValueError:
+            return
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                if self.db.execute("PRAGMA user_version").fetchone()[0] < LEGACY_IMPORTED:
+                    self.db.executemany(
+                        "INSERT OR IGNORE INTO projects (name, root, cwd) VALUES (?, ?, ?)",
+                        [(name, info.get("root"), info.get("cwd")) for name, info in legacy.items()],
+                    )
+                    self.db.execute(f"PRAGMA user_version = {LEGACY_IMPORTED}")
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def _refresh(self) -> None:
+        data_version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if self._data_version is not None and data_version == self._data_version:
+            return
+        self._projects = {
+            name: {"root": root, "cwd": cwd}
+            for name, root, cwd in self.db.execute("SELECT name, root, cwd FROM projects ORDER BY rowid")
+        }
+        self._sessions = {
+            session_id: (project, cwd)
+            for session_id, project, cwd in self.db.execute("SELECT id, project, cwd FROM sessions")
+        }
+        self._data_version = data_version
+
+    def _write(self, *statements: Tuple[str, tuple]) -> int:
+        # Our own commits don't bump data_version, so force the next read to reload
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            changed = 0
+            for sql, params in statements:
+                changed += self.db.execute(sql, params).rowcount
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self._data_version = None
+        return changed
+
+    # Projects
+    # -------------------------------------------
+
+    def all(self) -> Dict[str, Dict]:
+        with self.lock:
+            self._refresh()
+            return {name: dict(info) for name, info in self._projects.items()}
+
+    def add(self, name: str) -> bool:
+        with self.lock:
+            return self._write(("INSERT OR IGNORE INTO projects (name, root, cwd) VALUES (?, NULL, NULL)", (name,))) > 0
+
+    def remove(self, name: str) -> bool:
+        with self.lock:
+            return self._write(
+                ("DELETE FROM projects WHERE name = ?", (name,)),
+                ("DELETE FROM sessions WHERE project = ?", (name,)),
+            ) > 0
+
+    def set_root(self, name: str, root: str) -> bool:
+        with self.lock:
+            return self._write(("UPDATE projects SET root = ? WHERE name = ?", (root, name))) > 0
+
+    def set_cwd(self, name: str, cwd: str, session_id: str = DEFAULT_SESSION) -> bool:
+        with self.lock:
+            self._refresh()
+            if name not in self._projects:
+                return False
+            self._write(
+                ("UPDATE projects SET cwd = ? WHERE name = ?", (cwd, name)),
+                ("UPDATE sessions SET cwd = ? WHERE id IN (?, ?) AND project = ?", (cwd, session_id, DEFAULT_SESSION, name)),
+            )
+            return True
+
+    # Sessions
+    # -------------------------------------------
+
+    def select(self, session_id: str, name: str) -> bool:
+        with self.lock:
+            self._refresh()
+            if name not in self._projects:
+                return False
+            root = self._projects[name]["root"]
+            statements = [("UPDATE projects SET cwd = root WHERE name = ?", (name,))]
+            for sid in {session_id, DEFAULT_SESSION}:
+                statements.append(("INSERT OR REPLACE INTO sessions (id, project, cwd) VALUES (?, ?, ?)", (sid, name, root)))
+            self._write(*statements)
+            return True
+
+    def current(self, session_id: str) -> Optional[Tuple[str, Dict]]:
+        """
+        (name, {"root", "cwd"}) of the session's selected project, falling
+        back to the latest selection made by any session.
+        """
+        with self.lock:
+            self._refresh()
+            selection = self._sessions.get(session_id) or self._sessions.get(DEFAULT_SESSION)
+            if not selection or selection[0] not in self._projects:
+                return None
+            name, cwd = selection
+            project = self._projects[name]
+            return name, {"root": project["root"], "cwd": cwd or project["cwd"]}
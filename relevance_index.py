@@ -0,0 +1,317 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from array import array
+import math
+import os
+import re
+
+from file_index import LoggedFileIndex, Stat, per_project, read_text
+from file_reads import read_lines_within, split_lines
+from metrics import span
+from response_shaping import CHARS_PER_TOKEN
+
+# Files are ranked in snippets of about this many lines, cut at top-level lines where possible
+CHUNK_LINES = 40
+MIN_CHUNK_LINES = 20
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# -> Extra term frequency of names defined in a snippet (def/class lines)
+SYMBOL_BOOST = 3
+# -> Weight of the file's path and symbol names next to a snippet's own text
+NAME_WEIGHT = 0.5
+
+# Rough size in characters of the JSON around each file and snippet of a context pack
+FILE_OVERHEAD = 64
+SNIPPET_OVERHEAD = 48
+# -> Leftover budget below which a snippet isn't cut down to fit
+MIN_SNIPPET_CHARS = 200
+
+WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[0-9]+")
+WORD_PART = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+DEFINITION = re.compile(r"^[ \t]*(?:async[ \t]+)?(?:def|class)[ \t]+([A-Za-z_][A-Za-z0-9_]*)", re.MULTILINE)
+
+STOP_WORDS = frozenset(
+    "a an and are as at be by do does for from how i if in is it of on or that the this to what when where "
+    "which why with self none true false return".split()
+)
+
+
+def tokenize(text: str) -> Iterator[str]:
+    """
+    Lowercase terms of `text`: every identifier, plus the words of
+    snake_case and CamelCase ones, so `get_outline_index` and
+    `OutlineIndex` both match a query for "outline index".
+    """
+    for word in WORD.findall(text):
+        lower = word.lower()
+        if lower not in STOP_WORDS and len(lower) > 1:
+            yield lower
+        parts = WORD_PART.findall(word)
+        if len(parts) > 1:
+            for part in parts:
+                part = part.lower()
+                if part not in STOP_WORDS and len(part) > 1:
+                    yield part
+
+
+def _counts(terms: Iterator[str]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for term in terms:
+        counts[term] = counts.get(term, 0) + 1
+    return counts
+
+
+def split_chunks(lines: List[str]) -> List[Tuple[int, int]]:
+    """
+    [start, stop) line ranges of about `CHUNK_LINES` lines covering the
+    file, each ending before an unindented line that follows a blank one
+    (a new def, class or heading) when there's one in its second half.
+    """
+    chunks, start = [], 0
+    while start < len(lines):
+        stop = min(start + CHUNK_LINES, len(lines))
+        if stop < len(lines):
+            for i in range(stop, start + MIN_CHUNK_LINES, -1):
+                if not lines[i - 1].strip() and lines[i][:1].strip():
+                    stop = i
+                    break
+        chunks.append((start, stop))
+        start = stop
+    return chunks
+
+
+def _bm25(tf: int, length: int, average: float, idf: float) -> float:
+    return idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average))
+
+
+class RelevanceIndex(LoggedFileIndex):
+    """
+    BM25 index of a project's text files, split in snippets of a few dozen
+    lines, with a second small document per file made of its path and the
+    names it defines. Persisted between restarts and fed the files whose
+    (mtime, size) changed by ProjectFiles; removed snippets linger in the
+    postings until there are more of them than live ones.
+    """
+
+    INDEX_FILE = "relevance.pickle"
+    INDEX_VERSION = 3
+
+    def __init__(self, root: str):
+        self.files: Dict[int, Tuple[str, List[int], int]] = {}  # id -> (relpath, chunk ids, name length)
+        self.ids: Dict[str, int] = {}
+        self.chunks: Dict[int, Tuple[int, int, int, int, int]] = {}  # id -> (file id, start, stop, length, chars)
+        # -> term -> flat array of (id, term frequency) pairs
+        self.postings: Dict[str, array] = {}
+        self.name_postings: Dict[str, array] = {}
+        self.next_id = 0
+        self.chunk_length = 0
+        self.name_length = 0
+        self.dead = 0
+        super().__init__(root)
+
+    def _state(self) -> Dict:
+        return {
+            "files": self.files, "chunks": self.chunks, "postings": self.postings,
+            "name_postings": self.name_postings, "next_id": self.next_id, "dead": self.dead,
+        }
+
+    def _restore(self, state: Dict) -> None:
+        for key in ("files", "chunks", "postings", "name_postings", "next_id", "dead"):
+            setattr(self, key, state[key])
+        self.ids = {info[0]: file_id for file_id, info in self.files.items()}
+        self.chunk_length = sum(chunk[3] for chunk in self.chunks.values())
+        self.name_length = sum(info[2] for info in self.files.values())
+
+    # Updates
+    # -------------------------------------------
+
+    def read(self, relpath: str, stat: Stat) -> Tuple[List[Tuple[int, int, Dict[str, int], int]], Dict[str, int]]:
+        # -> Tokenized outside the lock: ([(start, stop, term counts, characters)], name term counts)
+        text = read_text(os.path.join(self.root, relpath), stat[1])
+        chunks: List[Tuple[int, int, Dict[str, int], int]] = []
+        names: List[str] = []
+        lines = split_lines(text) if text is not None else []
+        for start, stop in split_chunks(lines):
+            chunk_text = "".join(lines[start:stop])
+            counts = _counts(tokenize(chunk_text))
+            defined = DEFINITION.findall(chunk_text)
+            names.extend(defined)
+            for term in tokenize(" ".join(defined)):
+                counts[term] = counts.get(term, 0) + SYMBOL_BOOST
+            if counts:
+                chunks.append((start, stop, counts, len(chunk_text)))
+        name_counts = _counts(tokenize(" ".join([relpath.replace("/", " ").replace(".", " ")] + names)))
+        return chunks, name_counts
+
+    def _add(self, relpath: str, record) -> None:
+        chunks, name_counts = record
+        file_id = self.next_id
+        self.next_id += 1
+        chunk_ids: List[int] = []
+        for start, stop, counts, chars in chunks:
+            chunk_id = self.next_id
+            self.next_id += 1
+            length = sum(counts.values())
+            self.chunks[chunk_id] = (file_id, start, stop, length, chars)
+            self.chunk_length += length
+            chunk_ids.append(chunk_id)
+            self._post(self.postings, chunk_id, counts)
+
+        name_length = sum(name_counts.values())
+        self._post(self.name_postings, file_id, name_counts)
+        self.files[file_id] = (relpath, chunk_ids, name_length)
+        self.name_length += name_length
+        self.ids[relpath] = file_id
+
+    def _post(self, postings: Dict[str, array], doc_id: int, counts: Dict[str, int]) -> None:
+        for term, count in counts.items():
+            posting = postings.get(term)
+            if posting is None:
+                posting = postings[term] = array("I")
+            posting.append(doc_id)
+            posting.append(count)
+
+    def _drop(self, relpath: str) -> None:
+        file_id = self.ids.pop(relpath, None)
+        if file_id is None:
+            return
+        _, chunk_ids, name_length = self.files.pop(file_id)
+        for chunk_id in chunk_ids:
+            self.chunk_length -= self.chunks.pop(chunk_id)[3]
+        self.name_length -= name_length
+        self.dead += len(chunk_ids) + 1
+
+    def _compact(self) -> None:
+        if self.dead <= len(self.chunks) + len(self.files):
+            return
+        for postings, live in ((self.postings, self.chunks), (self.name_postings, self.files)):
+            for term in list(postings):
+                posting = postings[term]
+                kept = array("I")
+                for i in range(0, len(posting), 2):
+                    if posting[i] in live:
+                        kept.append(posting[i])
+                        kept.append(posting[i + 1])
+                if kept:
+                    postings[term] = kept
+                else:
+                    del postings[term]
+        self.dead = 0
+
+    # Queries
+    # -------------------------------------------
+
+    def _scores(self, postings: Dict[str, array], live: Dict, lengths, total: int, terms) -> Dict[int, float]:
+        # BM25 of every live document containing one of `terms`
+        scores: Dict[int, float] = {}
+        if not live:
+            return scores
+        average = total / len(live) or 1.0
+        for term in terms:
+            posting = postings.get(term)
+            if posting is None:
+                continue
+            hits = [(posting[i], posting[i + 1]) for i in range(0, len(posting), 2) if posting[i] in live]
+            idf = math.log(1 + (len(live) - len(hits) + 0.5) / (len(hits) + 0.5))
+            for doc_id, tf in hits:
+                scores[doc_id] = scores.get(doc_id, 0.0) + _bm25(tf, lengths(doc_id), average, idf)
+        return scores
+
+    def rank(self, query: str, limit: int = 200) -> List[Tuple[float, str, int, int, int]]:
+        """
+        The best `limit` snippets for `query`, as (score, relpath, start
+        line, stop line, characters), best first. A file whose path or
+        names match without any of its snippets doing so is represented
+        by its first snippet.
+        """
+        self.current()
+        terms = set(tokenize(query))
+        with self.lock:
+            chunk_scores = self._scores(
+                self.postings, self.chunks, lambda i: self.chunks[i][3], self.chunk_length, terms
+            )
+            name_scores = self._scores(
+                self.name_postings, self.files, lambda i: self.files[i][2], self.name_length, terms
+            )
+            for file_id in name_scores:
+                chunk_ids = self.files[file_id][1]
+                if chunk_ids and not any(chunk_id in chunk_scores for chunk_id in chunk_ids):
+                    chunk_scores[chunk_ids[0]] = 0.0
+
+            ranked = []
+            for chunk_id, score in chunk_scores.items():
+                file_id, start, stop, _, chars = self.chunks[chunk_id]
+                score += NAME_WEIGHT * name_scores.get(file_id, 0.0)
+                ranked.append((score, self.files[file_id][0], start, stop, chars))
+        ranked.sort(key=lambda item: (-item[0], item[1], item[2]))
+        return ranked[:limit]
+
+    def context(self, query: str, max_tokens: int, max_files: Optional[int] = None) -> Dict:
+        """
+        The snippets most relevant to `query` that fit in `max_tokens`,
+        grouped by file (best file first, snippets in line order, adjacent
+        ones merged). A snippet too big for what's left is cut at a line
+        break; line numbers are 0-based and end-exclusive.
+        """
+        ranked = self.rank(query)
+        budget = max_tokens * CHARS_PER_TOKEN
+        files: Dict[str, Dict] = {}
+        used = 0
+
+        with span("context_pack"):
+            for score, relpath, start, stop, chars in ranked:
+                new_file = relpath not in files
+                if new_file and max_files is not None and len(files) >= max_files:
+                    continue
+                overhead = SNIPPET_OVERHEAD + (FILE_OVERHEAD + len(relpath) if new_file else 0)
+                left = budget - used - overhead
+                if left < min(chars, MIN_SNIPPET_CHARS):
+                    continue
+                try:
+                    content, more = read_lines_within(os.path.join(self.root, relpath), start, stop, max_chars=left)
+                except (OSError, UnicodeDecodeError):
+                    continue
+                if not content or len(content) > left:
+                    continue
+
+                entry = files.get(relpath)
+                if entry is None:
+                    entry = files[relpath] = {
+                        "filepath": os.path.join(self.root, relpath), "score": round(score, 3), "snippets": [],
+                    }
+                stop = stop if more is None else more
+                entry["snippets"].append({
+                    "start_line": start, "end_line": stop, "score": round(score, 3),
+                    "content": content, "truncated": more is not None,
+                })
+                used += overhead + len(content)
+
+        results = list(files.values())
+        for entry in results:
+            entry["snippets"] = _merge_snippets(entry["snippets"])
+        ranked_files = len({relpath for _, relpath, _, _, _ in ranked})
+        return {
+            "query": query,
+            "files": results,
+            "used_tokens": math.ceil(used / CHARS_PER_TOKEN),
+            "max_tokens": max_tokens,
+            "omitted_files": ranked_files - len(results),
+        }
+
+
+def _merge_snippets(snippets: List[Dict]) -> List[Dict]:
+    merged: List[Dict] = []
+    for snippet in sorted(snippets, key=lambda s: s["start_line"]):
+        previous = merged[-1] if merged else None
+        if previous and not previous["truncated"] and previous["end_line"] == snippet["start_line"]:
+            previous["end_line"] = snippet["end_line"]
+            previous["content"] += snippet["content"]
+            previous["score"] = max(previous["score"], snippet["score"])
+            previous["truncated"] = snippet["truncated"]
+        else:
+            merged.append(snippet)
+    return merged
+
+
+get_relevance_index = per_project(RelevanceIndex)
@@ -0,0 +1,269 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+import os
+import time
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # -> Optional: without it responses are only gzipped
+    brotli = None
+
+
+# -> Rough size of a token, used for every token budget
+CHARS_PER_TOKEN = 4
+# -> Bodies smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+# -> Streamed NDJSON records are sent in chunks of about this size, or sooner when they come slowly
+NDJSON_CHUNK_SIZE = 64 * 1024
+NDJSON_FLUSH_SECONDS = 0.05
+
+
+# ===========================================
+# Token budgets
+# ===========================================
+
+def truncate_text(text: str, max_tokens: Optional[int], offset: int = 0) -> Dict:
+    """
+    The slice of `text` starting at `offset` that fits `max_tokens`, cut at a
+    line break when there's one in the second half of the window. When more
+    is left, `next_offset` is the `offset` to ask for next.
+    """
+    offset = max(0, min(offset, len(text)))
+    stop = len(text) if max_tokens is None else min(len(text), offset + max_tokens * CHARS_PER_TOKEN)
+    if stop < len(text):
+        newline = text.rfind("\n", offset, stop)
+        if newline >= offset + (stop - offset) // 2:
+            stop = newline + 1
+    return {
+        "content": text[offset:stop],
+        "offset": offset,
+        "next_offset": stop if stop < len(text) else None,
+        "truncated": stop < len(text),
+    }
+
+
+def prune_outline(tree: Dict, max_tokens: int) -> Dict:
+    """
+    Shrink a /project-outline tree in place until it fits `max_tokens`:
+    first the import lists of the deepest files, then their whole outlines,
+    then directories, deepest and fewest Python files first. Cut parts are
+    marked (`omitted_imports`, `truncated`, plus `omitted_entries` on
+    directories) and keep their `name`, to be passed back as `path`.
+    """
+    budget = max_tokens * CHARS_PER_TOKEN
+    size = len(json.dumps(tree))
+    if size <= budget:
+        return tree
+
+    files: List[Tuple[int, Dict]] = []
+    dirs: List[Tuple[int, int, Dict]] = []
+
+    def collect(node: Dict, depth: int) -> int:
+        # Post-order walk returning the number of outlined files below `node`
+        if node["type"] == "file":
+            if node.get("outline"):
+                files.append((depth, node))
+                return 1
+            return 0
+        count = sum(collect(child, depth + 1) for child in node["children"])
+        dirs.append((depth, count, node))
+        return count
+
+    collect(tree, 0)
+
+    files.sort(key=lambda item: -item[0])
+    for _, node in files:
+        if size <= budget:
+            break
+        outline = node["outline"]
+        if not outline.get("imports"):
+            continue
+        before = len(json.dumps(outline))
+        outline["omitted_imports"] = len(outline.pop("imports"))
+        size -= before - len(json.dumps(outline))
+
+    for _, node in files:
+        if size <= budget:
+            break
+        before = len(json.dumps(node))
+        del node["outline"]
+        node["truncated"] = True
+        size -= before - len(json.dumps(node))
+
+    dirs.sort(key=lambda item: (-item[0], item[1]))
+    for _, _, node in dirs:
+        if size <= budget:
+            break
+        if not node["children"]:
+            continue
+        before = len(json.dumps(node))
+        node["omitted_entries"] = _count_entries(node)
+        node["children"] = []
+        node["truncated"] = True
+        size -= before - len(json.dumps(node))
+
+    tree["pruned"] = True
+    return tree
+
+
+def _count_entries(node: Dict) -> int:
+    stack, count = list(node["children"]), 0
+    while stack:
+        child = stack.pop()
+        count += 1 + child.get("omitted_entries", 0)
+        stack.extend(child.get("children", ()))
+    return count
+
+
+# ===========================================
+# NDJSON
+# ===========================================
+
+def ndjson_chunks(records: Iterable[Dict]) -> Iterator[str]:
+    """
+    Records as NDJSON lines, batched so a fast producer doesn't cost one
+    response message per record. The first record goes out on its own, and
+    a batch is flushed once it has waited `NDJSON_FLUSH_SECONDS`.
+    """
+    lines: List[str] = []
+    size, flushed = 0, None
+    for record in records:
+        line = json.dumps(record) + "\n"
+        lines.append(line)
+        size += len(line)
+        now = time.monotonic()
+        if flushed is None or size >= NDJSON_CHUNK_SIZE or now - flushed >= NDJSON_FLUSH_SECONDS:
+            yield "".join(lines)
+            lines, size, flushed = [], 0, now
+    if lines:
+        yield "".join(lines)
+
+
+# ===========================================
+# Compression
+# ===========================================
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Preferred content coding the client accepts: br (when the brotli package
+    is installed), then gzip.
+    """
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        accepted[coding.strip().lower()] = quality
+    for coding in ("br", "gzip"):
+        if coding == "br" and brotli is None:
+            continue
+        if accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._zlib = None
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        """
+        Compressed `data`. With `flush`, everything fed so far is emitted
+        on a byte boundary so the client can decode it without waiting
+        for the next chunk.
+        """
+        if self._zlib:
+            chunk = self._zlib.compress(data)
+            return chunk + self._zlib.flush(zlib.Z_SYNC_FLUSH) if flush else chunk
+        chunk = self._brotli.process(data)
+        return chunk + self._brotli.flush() if flush else chunk
+
+    def finish(self) -> bytes:
+        if self._zlib:
+            return self._zlib.flush()
+        return self._brotli.finish()
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with brotli or gzip depending on Accept-Encoding,
+    streamed ones included. Partial (206), empty and already encoded
+    responses are passed through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = MIN_COMPRESS_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(message) -> None:
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                if (
+                    start_message["status"] in (204, 206, 304)
+                    or "content-encoding" in headers
+                    or "content-range" in headers
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                compressor = _Compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                # -> The encoded body differs byte-wise, so its ETag can only be weak
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"
+                del headers["Content-Length"]
+                if not more_body:
+                    body = compressor.compress(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(body))
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send(start_message)
+
+            # -> Flush each streamed chunk, otherwise the compressor holds it back until it fills a block
+            chunk = compressor.compress(body, flush=more_body)
+            if not more_body:
+                chunk += compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
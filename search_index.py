@@ -0,0 +1,189 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from array import array
+import os
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from file_index import LoggedFileIndex, Stat, per_project, read_text
+from file_reads import split_lines
+
+
+def _trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def required_trigrams(query: str, regex: bool) -> set:
+    """
+    Lowercase trigrams any match of `query` must contain. For a regex only
+    literal runs that every match goes through are used; an empty set means
+    the index can't narrow the search down.
+    """
+    if not regex:
+        return _trigrams(query.lower())
+
+    runs, current = [], []
+
+    def walk(items) -> None:
+        nonlocal current
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                current.append(chr(av))
+            elif op is sre_parse.SUBPATTERN:
+                walk(av[-1])
+            elif op is sre_parse.AT:
+                continue
+            else:
+                runs.append("".join(current))
+                current = []
+
+    try:
+        walk(sre_parse.parse(query))
+    except (re.error, TypeError, ValueError):
+        return set()
+    runs.append("".join(current))
+    return set().union(*(_trigrams(run.lower()) for run in runs))
+
+
+class SearchIndex(LoggedFileIndex):
+    """
+    Trigram index of a project's text files, persisted between restarts
+    and fed the files whose (mtime, size) changed by ProjectFiles.
+    """
+
+    INDEX_FILE = "search.pickle"
+    INDEX_VERSION = 2
+
+    def __init__(self, root: str):
+        self.files: Dict[int, Tuple[str, bool]] = {}  # id -> (relpath, searchable)
+        self.ids: Dict[str, int] = {}
+        self.postings: Dict[str, array] = {}
+        self.next_id = 0
+        self.dead = 0
+        super().__init__(root)
+
+    def _state(self) -> Dict:
+        return {"files": self.files, "postings": self.postings, "next_id": self.next_id}
+
+    def _restore(self, state: Dict) -> None:
+        self.files, self.postings, self.next_id = state["files"], state["postings"], state["next_id"]
+        self.ids = {info[0]: file_id for file_id, info in self.files.items()}
+
+    # Updates
+    # -------------------------------------------
+
+    def read(self, relpath: str, stat: Stat) -> Optional[List[str]]:
+        text = read_text(os.path.join(self.root, relpath), stat[1])
+        return None if text is None else list(_trigrams(text.lower()))
+
+    def _add(self, relpath: str, trigrams: Optional[List[str]]) -> None:
+        file_id = self.next_id
+        self.next_id += 1
+        self.files[file_id] = (relpath, trigrams is not None)
+        self.ids[relpath] = file_id
+        for gram in trigrams or ():
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array("I")
+            posting.append(file_id)
+
+    def _drop(self, relpath: str) -> None:
+        file_id = self.ids.pop(relpath, None)
+        if file_id is not None:
+            del self.files[file_id]
+            self.dead += 1
+
+    def _compact(self) -> None:
+        # Ids of changed and deleted files linger in postings until there are more of them than live ones
+        if self.dead <= len(self.files):
+            return
+        live = self.files
+        for gram in list(self.postings):
+            posting = array("I", (file_id for file_id in self.postings[gram] if file_id in live))
+            if posting:
+                self.postings[gram] = posting
+            else:
+                del self.postings[gram]
+        self.dead = 0
+
+    # Queries
+    # -------------------------------------------
+
+    def candidates(self, trigrams: Iterable[str]) -> List[Tuple[int, str, int, int]]:
+        """
+        Searchable files containing every given trigram, as (id, relpath, mtime_ns, size).
+        """
+        with self.lock:
+            if trigrams:
+                postings = sorted((self.postings.get(gram, ()) for gram in trigrams), key=len)
+                file_ids = set(postings[0])
+                for posting in postings[1:]:
+                    if not file_ids:
+                        break
+                    file_ids.intersection_update(posting)
+            else:
+                file_ids = self.files.keys()
+            return [
+                (file_id, self.files[file_id][0], *self.stats[self.files[file_id][0]])
+                for file_id in file_ids
+                if file_id in self.files and self.files[file_id][1]
+            ]
+
+    def search(
+        self,
+        query: str,
+        regex: bool = False,
+        case_sensitive: bool = False,
+        context: int = 2,
+        max_results: int = 100,
+    ) -> Dict:
+        """
+        Lines matching `query`, grouped by file and ranked by number of hits
+        (files whose path matches the query first). Line numbers are 0-based.
+        """
+        self.current()
+        flags = 0 if case_sensitive else re.IGNORECASE
+        pattern = re.compile(query if regex else re.escape(query), flags)
+        needle = query if case_sensitive else query.lower()
+
+        ranked = []
+        for file_id, relpath, mtime_ns, size in self.candidates(required_trigrams(query, regex)):
+            file_path = os.path.join(self.root, relpath)
+            try:
+                with open(file_path, "r", errors="replace", newline="") as file:
+                    text = file.read()
+            except OSError:
+                continue
+            if not pattern.search(text):
+                continue
+            # -> Same line breaks as /file, so hit line numbers point at the right lines there
+            lines = [line.rstrip("\r\n") for line in split_lines(text)]
+            hits = []
+            for i, line in enumerate(lines):
+                if pattern.search(line):
+                    hits.append({
+                        "line_number": i,
+                        "text": line,
+                        "context_before": lines[max(0, i - context):i],
+                        "context_after": lines[i + 1:i + 1 + context],
+                    })
+            if hits:
+                path_match = needle in (relpath if case_sensitive else relpath.lower())
+                ranked.append((not path_match, -len(hits), len(relpath), relpath, file_path, hits))
+
+        ranked.sort(key=lambda item: item[:4])
+        total_hits = sum(-item[1] for item in ranked)
+        results, total = [], 0
+        for _, _, _, _, file_path, hits in ranked:
+            if total >= max_results:
+                break
+            hits = hits[:max_results - total]
+            total += len(hits)
+            results.append({"filepath": file_path, "hits": hits})
+        return {"results": results, "total_hits": total_hits, "truncated": total < total_hits}
+
+
+get_search_index = per_project(SearchIndex)
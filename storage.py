@@ -0,0 +1,111 @@
+from typing import Iterable, Iterator, Sequence
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from metrics import span
+
+
+# -> On-disk caches live next to projects.json unless told otherwise
+CACHE_DIR = Path(os.getenv("CODE_ASSISTANT_CACHE_DIR", ".cache"))
+
+# -> os.umask can only be read by setting it, so do that once before any threads start
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def project_cache_dir(project_root: str) -> Path:
+    """
+    Directory holding the caches of one project, keyed by its absolute root.
+    """
+    key = hashlib.sha1(os.path.abspath(project_root).encode("utf-8")).hexdigest()[:16]
+    path = CACHE_DIR / key
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ContentHasher:
+    """
+    content_hash of text that goes by a piece at a time, e.g. while it's
+    being written, so it never has to be joined into one string.
+    """
+
+    def __init__(self):
+        self._hash = hashlib.blake2b(digest_size=16)
+
+    def update(self, piece: str) -> None:
+        self._hash.update(piece.encode("utf-8"))
+
+    def passing(self, pieces: Iterable[str]) -> Iterator[str]:
+        for piece in pieces:
+            self.update(piece)
+            yield piece
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+def lines_hash(lines: Sequence[str]) -> str:
+    hasher = ContentHasher()
+    # -> A few thousand lines per update keeps both the calls and the copies small
+    for start in range(0, len(lines), 4096):
+        hasher.update("".join(lines[start:start + 4096]))
+    return hasher.hexdigest()
+
+
+def load_json(path: Path, default):
+    try:
+        with path.open("r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(path: Path, data) -> None:
+    # Write to a sibling temp file first so a crash never leaves half a cache behind
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+def write_target(path) -> Path:
+    """
+    The file a write to `path` should land on: symlinks are followed so
+    renaming over it updates the link target instead of replacing the link.
+    """
+    return Path(os.path.realpath(path))
+
+
+def write_temp_lines(path: Path, lines) -> Path:
+    """
+    Write `lines` to an fsync'd temp file next to the target of `path` (same
+    permissions, or the umask default for new files) and return it, ready to
+    be renamed over `write_target(path)`.
+    """
+    target = write_target(path)
+    fd, tmp_name = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+    try:
+        with span("write"), os.fdopen(fd, "w") as file:
+            file.writelines(lines)
+            file.flush()
+            os.fsync(file.fileno())
+        if target.exists():
+            shutil.copymode(target, tmp_name)
+        else:
+            os.chmod(tmp_name, 0o666 & ~UMASK)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return Path(tmp_name)
+
+
+def atomic_write_lines(path: Path, lines) -> None:
+    os.replace(write_temp_lines(path, lines), write_target(path))
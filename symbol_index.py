@@ -0,0 +1,202 @@
+from typing import Dict, List, Tuple
+import os
+import sqlite3
+
+from file_index import FileIndex, Stat, per_project
+from metrics import span
+from outline import get_outline_index, module_name, parse_listeners
+from storage import content_hash, project_cache_dir
+
+
+INDEX_FILE = "symbols.db"
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, hash TEXT, module TEXT, error TEXT);
+CREATE TABLE definitions (path TEXT, name TEXT, qualname TEXT, kind TEXT, start_line INTEGER, end_line INTEGER);
+CREATE TABLE imports (path TEXT, module TEXT, name TEXT, asname TEXT, line INTEGER);
+CREATE TABLE refs (path TEXT, name TEXT, target TEXT, kind TEXT, scope TEXT, line INTEGER);
+CREATE INDEX definitions_name ON definitions (name);
+CREATE INDEX definitions_qualname ON definitions (qualname);
+CREATE INDEX definitions_path ON definitions (path);
+CREATE INDEX imports_name ON imports (name);
+CREATE INDEX imports_module ON imports (module);
+CREATE INDEX imports_path ON imports (path);
+CREATE INDEX refs_name ON refs (name);
+CREATE INDEX refs_path ON refs (path);
+"""
+
+
+class SymbolIndex(FileIndex):
+    """
+    Definitions, imports and references of a project's Python files, kept
+    in SQLite and updated per file when its content changes. The symbols
+    come from the outline index's parse of the file, whichever of the two
+    asks for it first.
+    """
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.db = sqlite3.connect(
+            str(project_cache_dir(root) / INDEX_FILE), timeout=10, check_same_thread=False, isolation_level=None
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            for table in ("files", "definitions", "imports", "refs"):
+                self.db.execute(f"DROP TABLE IF EXISTS {table}")
+            self.db.executescript(SCHEMA)
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.stats = {
+            path: (mtime_ns, size) for path, mtime_ns, size in self.db.execute("SELECT path, mtime_ns, size FROM files")
+        }
+        self.subscribe()
+
+    def wants(self, relpath: str) -> bool:
+        return relpath.endswith(".py")
+
+    def update(self, changed: Dict[str, Stat], removed: List[str]) -> None:
+        with span("symbol_index_update"):
+            with self.lock:
+                known = {
+                    path: digest for path, digest in self.db.execute("SELECT path, hash FROM files")
+                    if path in changed
+                }
+            touched, stale = [], []
+            for relpath, (mtime_ns, size) in changed.items():
+                if relpath in known:
+                    try:
+                        with open(os.path.join(self.root, relpath), "rb") as file:
+                            digest = content_hash(file.read())
+                    except OSError:
+                        continue
+                    if digest == known[relpath]:
+                        touched.append((mtime_ns, size, relpath))
+                        continue
+                stale.append(relpath)
+
+            parsed = get_outline_index(self.root).analyze(stale) if stale else []
+            with self.lock:
+                self._write(touched, parsed, removed)
+
+    def store(self, parsed: List[Tuple[str, dict, dict]]) -> None:
+        """
+        Take the symbols of files the outline index just parsed.
+        """
+        with self.lock:
+            self._write([], parsed, [])
+
+    def _write(self, touched, parsed, removed) -> None:
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.executemany("UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?", touched)
+            for relpath in [relpath for relpath, _, _ in parsed] + removed:
+                for table in ("files", "definitions", "imports", "refs"):
+                    self.db.execute(f"DELETE FROM {table} WHERE path = ?", (relpath,))
+            for relpath, entry, symbols in parsed:
+                self.db.execute(
+                    "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                    (relpath, entry["mtime_ns"], entry["size"], entry["hash"], module_name(relpath)[0], symbols.get("error")),
+                )
+                self.db.executemany(
+                    "INSERT INTO definitions VALUES (?, ?, ?, ?, ?, ?)",
+                    [(relpath, d["name"], d["qualname"], d["kind"], d["start_line"], d["end_line"])
+                     for d in symbols.get("definitions", [])],
+                )
+                self.db.executemany(
+                    "INSERT INTO imports VALUES (?, ?, ?, ?, ?)",
+                    [(relpath, i["module"], i["name"], i["asname"], i["line"]) for i in symbols.get("imports", [])],
+                )
+                self.db.executemany(
+                    "INSERT INTO refs VALUES (?, ?, ?, ?, ?, ?)",
+                    [(relpath, r["name"], r["target"], r["kind"], r["scope"], r["line"])
+                     for r in symbols.get("references", [])],
+                )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        for mtime_ns, size, relpath in touched:
+            self.stats[relpath] = (mtime_ns, size)
+        for relpath, entry, _ in parsed:
+            self.stats[relpath] = (entry["mtime_ns"], entry["size"])
+        for relpath in removed:
+            self.stats.pop(relpath, None)
+
+    # Queries
+    # -------------------------------------------
+
+    def find_definitions(self, symbol: str, limit: int = 50) -> List[Dict]:
+        """
+        Definitions whose qualname is `symbol` or ends with it (so both
+        `method` and `Class.method` work), exact matches first.
+        """
+        self.current()
+        name = symbol.rpartition(".")[2]
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT d.path, d.qualname, d.kind, d.start_line, d.end_line, f.module FROM definitions d "
+                "JOIN files f ON f.path = d.path WHERE d.name = ?",
+                (name,),
+            ).fetchall()
+        matches = []
+        for path, qualname, kind, start_line, end_line, module in rows:
+            full_name = f"{module}.{qualname}" if module else qualname
+            if symbol in (qualname, full_name) or full_name.endswith("." + symbol):
+                matches.append((symbol not in (qualname, full_name), path, start_line, {
+                    "filepath": os.path.join(self.root, path), "module": module, "qualname": qualname,
+                    "kind": kind, "start_line": start_line, "end_line": end_line,
+                }))
+        matches.sort(key=lambda match: match[:3])
+        return [match[3] for match in matches[:limit]]
+
+    def find_references(self, symbol: str, limit: int = 200) -> Dict[str, List[Dict]]:
+        """
+        Calls, attribute accesses and decorator/base uses of `symbol`'s last
+        component, plus the imports that bring it in. With a dotted symbol,
+        references whose dotted target ends the same way come first.
+        """
+        self.current()
+        name = symbol.rpartition(".")[2]
+        with self.lock:
+            refs = self.db.execute(
+                "SELECT path, target, kind, scope, line FROM refs WHERE name = ? ORDER BY path, line",
+                (name,),
+            ).fetchall()
+            imports = self.db.execute(
+                "SELECT path, module, name, asname, line FROM imports WHERE name = ? OR module = ? ORDER BY path, line",
+                (name, symbol),
+            ).fetchall()
+        references = [
+            {"filepath": os.path.join(self.root, path), "target": target, "kind": kind,
+             "scope": scope, "line_number": line}
+            for path, target, kind, scope, line in refs
+        ]
+        if "." in symbol:
+            references.sort(key=lambda ref: not ("." + ref["target"]).endswith("." + symbol))
+        return {
+            "references": references[:limit],
+            "imports": [
+                {"filepath": os.path.join(self.root, path), "module": module, "name": imported,
+                 "asname": asname, "line_number": line}
+                for path, module, imported, asname, line in imports[:limit]
+            ],
+            "truncated": len(references) > limit or len(imports) > limit,
+        }
+
+    def errors(self, limit: int = 50) -> List[Dict]:
+        """
+        Files left out of the index because they could not be parsed.
+        """
+        self.current()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT path, error FROM files WHERE error IS NOT NULL ORDER BY path LIMIT ?", (limit,)
+            ).fetchall()
+        return [{"filepath": os.path.join(self.root, path), "error": error} for path, error in rows]
+
+
+get_symbol_index = per_project(SymbolIndex)
+
+# -> Files outlined before any symbol query still get their symbols from that parse
+parse_listeners.append(lambda root, parsed: get_symbol_index(root).store(parsed))
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# -> Caches and the project store must point somewhere disposable before any module reads them
+_workdir = tempfile.mkdtemp(prefix="code-assistant-tests-")
+os.environ.setdefault("CODE_ASSISTANT_CACHE_DIR", os.path.join(_workdir, "cache"))
+os.environ.setdefault("CODE_ASSISTANT_PROJECTS_DB", os.path.join(_workdir, "projects.db"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,15 @@
+import time
+
+# Offline stand-in for chat_completion_utils.llm, selected with COMMIT_MESSAGE_LLM=llm_stub:llm
+calls = []
+delay = 0.0
+fail = False
+
+
+def llm(system_instruction: str, user_input: str) -> str:
+    calls.append(user_input)
+    if delay:
+        time.sleep(delay)
+    if fail:
+        raise RuntimeError("LLM unavailable")
+    return f"  Stub message for {user_input.count('diff --git')} file(s)\n"
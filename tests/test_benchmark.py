@@ -0,0 +1,28 @@
+import benchmark
+
+
+def result(p50_ms, peak_kb=100.0):
+    return {"p50_ms": p50_ms, "peak_kb": peak_kb}
+
+
+def test_compare_flags_growth_beyond_tolerance_and_slack():
+    baseline = {"fast": result(10.0), "slow": result(100.0), "big": result(10.0, 10_000.0)}
+    results = {
+        "fast": result(19.0),  # within 50% plus the 5 ms slack
+        "slow": result(160.0),
+        "big": result(10.0, 20_000.0),
+        "new": result(1000.0),  # no baseline yet
+    }
+    regressions = benchmark.compare(results, baseline, tolerance=0.5)
+    assert [regression.split(":")[0] for regression in regressions] == ["slow", "big"]
+
+
+def test_generated_project_walks_like_a_real_one(tmp_path):
+    from project_files import walk_project
+
+    project = benchmark.generate_project(str(tmp_path / "project"), files=20)
+    walked = {"/".join(parts) for parts, _, _ in walk_project(project["root"])}
+    # -> The ignore rules apply, so the benchmarks never time a walk through .git
+    assert not any(path.split("/")[0] == ".git" for path in walked)
+    assert {"big_module.py", "small_module.py"} <= walked
+    assert benchmark.marker_line(project["small_file"]) > 0
@@ -0,0 +1,70 @@
+import asyncio
+import subprocess
+
+import pytest
+
+import commit_message
+import llm_stub
+from git_utils import git_commit
+
+
+def make_diff(*files, lines=3):
+    sections = []
+    for name in files:
+        body = "".join(f"+line {i} of {name}\n" for i in range(lines))
+        sections.append(f"diff --git a/{name} b/{name}\n--- a/{name}\n+++ b/{name}\n@@ -0,0 +1,{lines} @@\n{body}")
+    return "".join(sections)
+
+
+@pytest.fixture(autouse=True)
+def stub(monkeypatch):
+    monkeypatch.setattr(commit_message, "LLM_BACKEND", "llm_stub:llm")
+    monkeypatch.setattr(commit_message, "llm_backend", None)
+    monkeypatch.setattr(commit_message, "_cache", commit_message.OrderedDict())
+    monkeypatch.setattr(llm_stub, "calls", [])
+    monkeypatch.setattr(llm_stub, "delay", 0.0)
+    monkeypatch.setattr(llm_stub, "fail", False)
+
+
+def test_messages_come_from_the_configured_backend_and_are_cached():
+    diff = make_diff("a.py", "b.py")
+    assert asyncio.run(commit_message.commit_message_for(diff)) == "Stub message for 2 file(s)"
+    assert asyncio.run(commit_message.commit_message_for(diff)) == "Stub message for 2 file(s)"
+    assert len(llm_stub.calls) == 1
+
+
+def test_slow_backend_falls_back_to_the_diffstat_and_caches_the_late_answer(monkeypatch):
+    monkeypatch.setattr(llm_stub, "delay", 0.3)
+    diff = make_diff("a.py")
+
+    async def run():
+        fallback = await commit_message.commit_message_for(diff, timeout=0.05)
+        await asyncio.sleep(0.5)
+        return fallback, await commit_message.commit_message_for(diff, timeout=0.05)
+
+    fallback, later = asyncio.run(run())
+    assert fallback == "Update a.py (+3 -0)"
+    assert later == "Stub message for 1 file(s)"
+
+
+def test_failing_backend_falls_back_to_the_diffstat(monkeypatch):
+    monkeypatch.setattr(llm_stub, "fail", True)
+    assert asyncio.run(commit_message.commit_message_for(make_diff("a.py", "b.py"))) == "Update a.py, b.py (+6 -0)"
+
+
+def test_budget_gives_every_file_a_share():
+    diff = make_diff("small.py", lines=2) + make_diff("big.py", "huge.py", lines=2000)
+    trimmed = commit_message.budget_diff(diff, budget_tokens=500)
+    assert len(trimmed) <= 500 * commit_message.CHARS_PER_TOKEN + 200
+    for name in ("small.py", "big.py", "huge.py"):
+        assert f"diff --git a/{name}" in trimmed
+    assert "+line 1 of small.py" in trimmed and "more lines trimmed" in trimmed
+
+
+def test_git_commit_uses_the_stub_offline(tmp_path):
+    for args in (["init", "-q", "-b", "main"], ["config", "user.name", "t"], ["config", "user.email", "t@example.com"]):
+        subprocess.run(["git", *args], cwd=tmp_path, check=True)
+    (tmp_path / "a.py").write_text("print('hi')\n")
+    assert asyncio.run(git_commit(str(tmp_path)))["status"] == "success"
+    log = subprocess.run(["git", "log", "-1", "--format=%s"], cwd=tmp_path, capture_output=True, text=True).stdout
+    assert log.strip() == "Stub message for 1 file(s)"
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from concurrency import ConcurrencyLimit, FileLocks, Overloaded, SingleFlight
+
+
+def test_identical_calls_in_flight_share_one_computation():
+    flight = SingleFlight("test")
+    runs = []
+
+    async def compute(value):
+        runs.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    async def main():
+        shared = await asyncio.gather(*(flight.do("a", lambda: compute(1)) for _ in range(5)), flight.do("b", lambda: compute(2)))
+        # -> Once done, nothing is kept: the next call computes again
+        again = await flight.do("a", lambda: compute(3))
+        return shared, again
+
+    assert asyncio.run(main()) == ([1, 1, 1, 1, 1, 2], 3)
+    assert runs == [1, 2, 3]
+
+
+def test_an_exception_reaches_every_caller_sharing_it():
+    flight = SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("broken")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("a", fail) for _ in range(3)), return_exceptions=True)
+
+    assert [str(result) for result in asyncio.run(main())] == ["broken"] * 3
+
+
+def test_calls_beyond_the_limit_and_queue_are_turned_away():
+    limit = ConcurrencyLimit("test", limit=2, queue=1)
+    running, most = 0, 0
+
+    async def work():
+        nonlocal running, most
+        running += 1
+        most = max(most, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return "done"
+
+    async def main():
+        return await asyncio.gather(*(limit.run(work) for _ in range(5)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert results[:3] == ["done"] * 3
+    assert all(isinstance(result, Overloaded) and result.retry_after >= 1 for result in results[3:])
+    assert most == 2
+
+
+def test_writers_of_one_file_take_turns_and_hold_all_waits_for_them(tmp_path):
+    locks = FileLocks()
+    a, b = str(tmp_path / "a"), str(tmp_path / "b")
+    events = []
+
+    async def write(name, paths):
+        async with locks.hold(paths):
+            events.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            events.append(f"{name} end")
+
+    async def everything():
+        await asyncio.sleep(0)
+        async with locks.hold_all():
+            events.append("all")
+
+    async def main():
+        # -> The two batches name their files in opposite orders without deadlocking
+        await asyncio.gather(write("one", [a, b]), write("two", [b, a]), everything())
+
+    asyncio.run(main())
+    assert events == ["one start", "one end", "two start", "two end", "all"]
+    assert locks.locks == {} and locks.users == {}
+
+
+@pytest.mark.parametrize("make", [lambda: SingleFlight("test"), lambda: FileLocks()])
+def test_a_new_event_loop_starts_over(make):
+    instance = make()
+
+    async def use():
+        if isinstance(instance, SingleFlight):
+            return await instance.do("a", lambda: asyncio.sleep(0, "ok"))
+        async with instance.hold(["/tmp/x"]):
+            return "ok"
+
+    assert asyncio.run(use()) == asyncio.run(use()) == "ok"
@@ -0,0 +1,56 @@
+import file_index
+from relevance_index import get_relevance_index
+from search_index import SearchIndex, get_search_index
+from symbol_index import get_symbol_index
+
+
+def test_the_indexes_of_a_project_share_one_walk(tmp_path, monkeypatch):
+    (tmp_path / "widgets.py").write_text("def make_widget():\n    return Widget()\n")
+    walks = []
+    walk = file_index.walk_project
+    monkeypatch.setattr(file_index, "walk_project", lambda root: walks.append(root) or walk(root))
+
+    root = str(tmp_path)
+    assert get_search_index(root).search("make_widget")["total_hits"] == 1
+    assert get_relevance_index(root).rank("widget")[0][1] == "widgets.py"
+    assert get_symbol_index(root).find_definitions("make_widget")[0]["qualname"] == "make_widget"
+    assert walks == [root]
+
+
+def test_the_log_is_folded_into_a_new_snapshot_once_it_outgrows_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_index, "COMPACT_MIN_BYTES", 0)
+    (tmp_path / "a.txt").write_text("alpha\n")
+    index = SearchIndex(str(tmp_path))
+    index.current()
+    generation = index.generation
+
+    (tmp_path / "a.txt").write_text(" ".join(f"beta{i}" for i in range(1000)) + "\n")
+    file_index.get_project_files(str(tmp_path)).refresh()
+    assert index.search("beta")["total_hits"] == 1
+    assert index.generation != generation
+    assert index.log_bytes == 0
+    assert SearchIndex(str(tmp_path)).search("beta")["total_hits"] == 1
+
+
+def test_a_log_cut_short_keeps_the_records_before_the_cut(tmp_path):
+    for name in ("a", "b"):
+        (tmp_path / f"{name}.txt").write_text(f"{name}_first\n")
+    index = SearchIndex(str(tmp_path))
+    index.current()
+    files = file_index.get_project_files(str(tmp_path))
+    (tmp_path / "a.txt").write_text("a_second\n")
+    files.refresh()
+    index.current()
+    (tmp_path / "b.txt").write_text("b_second\n")
+    files.refresh()
+    index.current()
+    log = index.log_path.read_bytes()
+    index.log_path.write_bytes(log[:-5])
+
+    reloaded = SearchIndex(str(tmp_path))
+    # -> The next update starts a new snapshot rather than appending after the cut
+    assert reloaded.generation == ""
+    assert "a.txt" in [relpath for relpath, _ in reloaded.files.values()]
+    assert reloaded.search("a_second")["total_hits"] == 1
+    # -> b.txt's record was lost with the cut: its stat no longer matches, so it's indexed again
+    assert reloaded.search("b_second")["total_hits"] == 1
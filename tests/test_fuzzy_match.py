@@ -0,0 +1,102 @@
+import difflib
+import random
+
+import pytest
+from fuzzywuzzy import fuzz
+
+from fuzzy_match import BlockIndex, FuzzyLineIndex, block_lines
+
+
+@pytest.fixture(autouse=True, params=["difflib", "levenshtein"])
+def backend(request, monkeypatch):
+    # -> fuzzywuzzy scores with python-Levenshtein when it is installed and difflib otherwise; cover both
+    if request.param == "difflib":
+        monkeypatch.setattr(fuzz, "SequenceMatcher", difflib.SequenceMatcher)
+    else:
+        StringMatcher = pytest.importorskip("fuzzywuzzy.StringMatcher").StringMatcher
+        monkeypatch.setattr(fuzz, "SequenceMatcher", StringMatcher)
+    return request.param
+
+
+def full_scan(lines, query):
+    # The matching /update-file did before the index: first line with the highest ratio
+    best_index, best_score = None, 0
+    for i, line in enumerate(lines):
+        score = fuzz.ratio(query, line)
+        if score > best_score:
+            best_index, best_score = i, score
+    return best_index, best_score
+
+
+def corpus(seed: int):
+    rng = random.Random(seed)
+    names = ["total", "value", "item", "result", "config", "handler", "index", "path", "data", "self.cache"]
+    lines = []
+    for i in range(200):
+        kind = rng.random()
+        if kind < 0.1:
+            lines.append("")
+        elif kind < 0.3:
+            lines.append(f"def {rng.choice(names)}_{i}({rng.choice(names)}, {rng.choice(names)}={rng.randint(0, 99)}):\n")
+        elif kind < 0.6:
+            lines.append(f"    {rng.choice(names)} = {rng.choice(names)} * {rng.randint(0, 9)}\n")
+        elif kind < 0.8:
+            lines.append(f"    return {rng.choice(names)}\n")
+        else:
+            lines.append(f"# {' '.join(rng.choice(names) for _ in range(rng.randint(1, 8)))}\n")
+    # -> Duplicates, so ties have to resolve to the first line like the scan does
+    lines += lines[:20]
+
+    queries = []
+    for _ in range(30):
+        line = rng.choice([line for line in lines if line])
+        queries.append(line.rstrip("\n"))
+        chars = list(line.strip())
+        for _ in range(rng.randint(1, 5)):
+            chars[rng.randrange(len(chars))] = rng.choice("abcxyz_ ")
+        queries.append("".join(chars))
+        queries.append(line.strip()[: rng.randint(1, len(line.strip()))])
+    queries += ["x", "zzzzzzzzzz", "return", "def", "    ", "BENCH_MARKER = 1"]
+    return lines, queries
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_index_finds_the_same_best_line_as_a_full_scan(seed):
+    lines, queries = corpus(seed)
+    index = FuzzyLineIndex(lines)
+    for query in queries:
+        assert index.best_match(query) == full_scan(lines, query), query
+
+
+def test_ties_resolve_to_the_first_line():
+    lines = ["total = value * 2\n", "other line\n", "total = value * 3\n", "total = value * 2\n"]
+    index = FuzzyLineIndex(lines)
+    assert index.best_match("total = value * 4") == full_scan(lines, "total = value * 4")
+    assert index.best_match("total = value * 2\n") == (0, 100)
+
+
+def test_empty_inputs():
+    assert FuzzyLineIndex([]).best_match("anything") == (None, 0)
+    assert FuzzyLineIndex(["a\n"]).best_match("") == (None, 0)
+
+
+def test_block_whose_late_line_matches_the_start_of_the_file():
+    # -> The 16th block line equals line 0 of the file, so it votes for a start 15 lines before the file
+    lines = ["import os\n"] + [f"value_{i} = compute({i})\n" for i in range(1, 40)]
+    block = [f"changed_{i} = other({i})" for i in range(15)] + ["import os"] + [f"more_{i} = 1" for i in range(4)]
+    index = BlockIndex(lines)
+    assert index.best_match(block_lines("\n".join(block)), min_score=0, min_shared=0) is not None
+    assert index.best_match(block_lines("\n".join(block))) is None
+
+
+def test_block_with_a_few_edited_lines_still_matches():
+    lines = [f"value_{i} = compute({i})\n" for i in range(40)]
+    lines[20:26] = [
+        "def handler(request):\n", "    user = request.user\n", "    if not user:\n",
+        "        return None\n", "    total = sum(item.price for item in user.cart)\n", "    return total\n",
+    ]
+    block = [
+        "def handler(request):", "user = request.user", "if user is None:",
+        "return None", "total = sum(item.cost for item in user.cart)", "return total",
+    ]
+    assert BlockIndex(lines).best_match(block)[:2] == (20, 26)
@@ -0,0 +1,53 @@
+import asyncio
+import subprocess
+
+import pytest
+
+from git_utils import get_repo, git_current_branch, git_delete_branch, git_switch_branch
+from metrics import subprocess_calls
+
+
+def git(cwd, *args):
+    subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True)
+
+
+@pytest.fixture
+def clone(tmp_path):
+    origin, work = tmp_path / "origin", tmp_path / "work"
+    origin.mkdir()
+    git(origin, "init", "-q", "-b", "main")
+    git(origin, "config", "user.name", "test")
+    git(origin, "config", "user.email", "test@example.com")
+    (origin / "a.txt").write_text("a\n")
+    git(origin, "add", "-A")
+    git(origin, "commit", "-q", "-m", "first")
+    git(origin, "branch", "feature")
+    git(origin, "tag", "v1")
+    git(tmp_path, "clone", "-q", str(origin), str(work))
+    return str(work)
+
+
+def test_switch_checks_out_a_remote_branch_by_name(clone):
+    assert asyncio.run(git_switch_branch(clone, "feature"))["status"] == "success"
+    assert asyncio.run(git_current_branch(clone))["branch"] == "feature"
+
+
+def test_switch_checks_out_tags_and_commits(clone):
+    assert asyncio.run(git_switch_branch(clone, "v1"))["status"] == "success"
+    assert asyncio.run(git_current_branch(clone))["branch"] == "HEAD"
+    assert asyncio.run(git_switch_branch(clone, "main"))["status"] == "success"
+    assert asyncio.run(git_switch_branch(clone, "HEAD~0"))["status"] == "success"
+
+
+def test_unknown_names_report_git_error(clone):
+    result = asyncio.run(git_switch_branch(clone, "nope"))
+    assert result["status"] == "error" and "nope" in result["message"]
+    result = asyncio.run(git_delete_branch(clone, "nope"))
+    assert result["status"] == "error" and "not found" in result["message"]
+
+
+def test_metrics_label_git_runs_by_subcommand(clone):
+    asyncio.run(get_repo(str(clone)).run("-c", "core.untrackedCache=true", "-C", str(clone), "status"))
+    labels = {labels[0] for labels in subprocess_calls.values}
+    assert "status" in labels
+    assert not labels & {"core.untrackedCache=true", str(clone)}
@@ -0,0 +1,22 @@
+from line_edits import PieceTable
+
+
+def test_edits_are_addressed_by_original_line_numbers_in_any_order():
+    lines = [f"{i}\n" for i in range(6)]
+    table = PieceTable(lines)
+    table.insert(4, "after four")
+    table.delete(1)
+    table.modify(1, "lost to the delete")
+    table.modify(3, "three")
+    table.insert(0, "after zero\nand again")
+    table.modify(99, "outside the file")
+
+    assert "".join(table) == "0\nafter zero\nand again\n2\nthree\n4\nafter four\n5\n"
+    assert lines == [f"{i}\n" for i in range(6)]
+    assert table.hunks() == [(0, 2, "0\nafter zero\nand again\n"), (3, 5, "three\n4\nafter four\n")]
+
+
+def test_lines_inserted_after_a_last_line_without_newline_start_on_their_own():
+    table = PieceTable(["a\n", "b"])
+    table.insert(1, "c")
+    assert "".join(table) == "a\nb\nc\n"
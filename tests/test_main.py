@@ -0,0 +1,272 @@
+import asyncio
+import json
+import os
+import stat
+import subprocess
+import sys
+import zlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from storage import UMASK
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_update_files_rejects_one_file_named_twice(client, tmp_path):
+    target = tmp_path / "a.py"
+    target.write_text("x = 1\n")
+    (tmp_path / "link.py").symlink_to(target)
+    update = {"content_to_match": "x = 1", "new_content": "x = 2", "action": "modify"}
+    files = [
+        {"filepath": str(target), "updates": [update]},
+        {"filepath": str(tmp_path / "sub" / ".." / "link.py"), "updates": [update]},
+    ]
+    response = client.post("/update-files", json={"files": files})
+    assert response.status_code == 400
+    assert "more than once" in response.json()["detail"]
+    assert target.read_text() == "x = 1\n"
+
+
+def test_create_file_and_undo_keep_modes_and_symlinks(client, tmp_path):
+    (tmp_path / "real").mkdir()
+    target = tmp_path / "real" / "run.sh"
+    target.write_text("echo old\n")
+    os.chmod(target, 0o755)
+    link = tmp_path / "run.sh"
+    link.symlink_to(target)
+
+    def check(text):
+        assert link.is_symlink() and os.readlink(link) == str(target)
+        assert target.read_text() == text
+        assert stat.S_IMODE(os.stat(target).st_mode) == 0o755
+
+    assert client.post("/create-file", json={"filepath": str(link), "content": "echo new\n"}).status_code == 200
+    check("echo new\n")
+    assert client.post("/rollback-update", params={"filepath": str(link)}).status_code == 200
+    check("echo old\n")
+    assert client.post("/redo-update", params={"filepath": str(link)}).status_code == 200
+    check("echo new\n")
+
+    new = tmp_path / "new.py"
+    assert client.post("/create-file", json={"filepath": str(new), "content": "x = 1\n"}).status_code == 200
+    assert stat.S_IMODE(os.stat(new).st_mode) == 0o666 & ~UMASK
+    assert client.post("/rollback-update", params={"filepath": str(new)}).status_code == 200
+    assert not new.exists()
+    assert client.post("/redo-update", params={"filepath": str(new)}).status_code == 200
+    assert stat.S_IMODE(os.stat(new).st_mode) == 0o666 & ~UMASK
+
+
+def test_streamed_outline_arrives_decodable_through_gzip(client, tmp_path):
+    for i in range(40):
+        (tmp_path / f"mod{i}.py").write_text(f"import os\n\nclass C{i}:\n    def run(self):\n        pass\n" + "x = 1\n" * 200)
+    headers = {"x-session-id": "stream-test"}
+    client.post("/add-project/stream-test", headers=headers)
+    client.post("/set-project-root/stream-test", params={"filepath": str(tmp_path)}, headers=headers)
+    assert client.post("/select-project/stream-test", headers=headers).status_code == 200
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/project-outline", "raw_path": b"/project-outline", "query_string": b"stream=true",
+        "root_path": "", "server": ("testserver", 80), "client": ("testclient", 50000),
+        "headers": [(b"host", b"testserver"), (b"accept-encoding", b"gzip"), (b"x-session-id", b"stream-test")],
+    }
+    sent, requested = [], []
+
+    async def receive():
+        # -> After the request body, block like a client that stays connected
+        if requested:
+            await asyncio.Event().wait()
+        requested.append(True)
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(main.app(scope, receive, send))
+    assert (b"content-encoding", b"gzip") in sent[0]["headers"]
+
+    # -> Every chunk must decode to whole records on arrival, the first one on its own
+    decompress = zlib.decompressobj(zlib.MAX_WBITS | 16).decompress
+    chunks = [decompress(message["body"]).decode() for message in sent[1:]]
+    records = [json.loads(line) for line in "".join(chunks).splitlines()]
+    assert chunks[0].count("\n") == 1
+    assert all(chunk.endswith("\n") for chunk in chunks if chunk)
+    assert records[-1]["type"] == "end" and records[-1]["files"] == 40
+
+
+def test_file_etag_returns_304_until_the_file_changes(client, tmp_path):
+    path = tmp_path / "a.py"
+    path.write_text("x = 1\n")
+    first = client.get("/file", params={"filepath": str(path)})
+    assert first.json() == {"content": "x = 1\n"}
+    etag = first.headers["etag"]
+
+    cached = client.get("/file", params={"filepath": str(path)}, headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+
+    path.write_text("x = 22\n")
+    changed = client.get("/file", params={"filepath": str(path)}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.json() == {"content": "x = 22\n"}
+
+
+def test_file_ranges_and_budgets(client, tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("".join(f"line {i}\n" for i in range(10)))
+    lines = client.get("/file", params={"filepath": str(path), "start_line": 2, "end_line": 4}).json()
+    assert lines == {"content": "line 2\nline 3\n", "start_line": 2, "end_line": 4}
+
+    budget = client.get("/file", params={"filepath": str(path), "start_line": 8, "max_tokens": 1}).json()
+    assert budget["content"] == "line 8\n" and budget["next_start_line"] == 9 and budget["truncated"]
+
+    partial = client.get("/file", params={"filepath": str(path)}, headers={"Range": "bytes=7-13"})
+    assert partial.status_code == 206 and partial.text == "line 1\n"
+    assert partial.headers["content-range"] == f"bytes 7-13/{path.stat().st_size}"
+
+
+def test_large_files_keep_the_json_shape_unless_text_is_asked_for(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "STREAM_THRESHOLD", 1024)
+    path = tmp_path / "big.txt"
+    text = "".join(f"line {i} é \"quoted\" \\ \t\n" for i in range(5000))
+    path.write_text(text)
+
+    default = client.get("/file", params={"filepath": str(path)})
+    assert default.headers["content-type"] == "application/json"
+    assert default.json() == {"content": text}
+
+    for kwargs in ({"params": {"stream": True}}, {"headers": {"Accept": "text/plain"}}):
+        streamed = client.get("/file", params={"filepath": str(path), **kwargs.get("params", {})}, headers=kwargs.get("headers"))
+        assert streamed.headers["content-type"].startswith("text/plain")
+        assert streamed.text == text
+
+
+def test_update_files_is_all_or_nothing(client, tmp_path):
+    a, b = tmp_path / "a.py", tmp_path / "b.py"
+    a.write_text("x = 1\n")
+    b.write_text("y = 1\n")
+
+    def update(path, match):
+        return {"filepath": str(path), "use_fuzzy_match": False,
+                "updates": [{"content_to_match": match, "new_content": match.replace("1", "2"), "action": "modify"}]}
+
+    missing = tmp_path / "missing.py"
+    failed = client.post("/update-files", json={"files": [update(a, "x = 1"), update(missing, "z = 1")]})
+    assert failed.status_code == 400 and list(failed.json()["detail"]["errors"]) == [str(missing)]
+    assert a.read_text() == "x = 1\n"
+
+    done = client.post("/update-files", json={"files": [update(a, "x = 1"), update(b, "y = 1")]})
+    assert done.status_code == 200
+    assert [f["matches"][0]["line_number"] for f in done.json()["files"]] == [0, 0]
+    assert (a.read_text(), b.read_text()) == ("x = 2\n", "y = 2\n")
+
+
+def test_traced_requests_report_their_spans_and_every_request_is_measured(client, tmp_path):
+    path = tmp_path / "a.py"
+    path.write_text("class A:\n    def run(self):\n        pass\n")
+    traced = client.get("/file-symbol", params={"filepath": str(path), "symbol": "A.run"}, headers={"X-Trace": "1"})
+    assert traced.status_code == 200
+    assert "ast_parse;dur=" in traced.headers["server-timing"]
+    assert "total;dur=" in traced.headers["server-timing"]
+    assert "server-timing" not in client.get("/file", params={"filepath": str(path)}).headers
+
+    trace = client.get("/traces", params={"limit": 1}).json()["traces"][0]
+    assert (trace["path"], trace["status"]) == ("/file-symbol", 200)
+    assert "ast_parse" in [s["name"] for s in trace["spans"]]
+
+    metrics = client.get("/metrics").text
+    assert 'code_assistant_request_duration_seconds_count{method="GET",route="/file",status="200"}' in metrics
+    assert client.get("/no-such-route").status_code == 404
+    assert 'route="unmatched",status="404"' in client.get("/metrics").text
+
+
+def test_plugin_documents_are_rendered_per_host_until_the_file_changes(client, tmp_path, monkeypatch):
+    manifest = tmp_path / "ai-plugin.json"
+    manifest.write_text('{"api": {"url": "PLUGIN_HOSTNAME/openapi.json"}}')
+    monkeypatch.setattr(main, "MANIFEST_FILE", str(manifest))
+
+    first = client.get("/.well-known/ai-plugin.json", headers={"host": "one.example"})
+    assert first.json() == {"api": {"url": "https://one.example/openapi.json"}}
+    other = client.get("/.well-known/ai-plugin.json", headers={"host": "two.example"})
+    assert other.json() == {"api": {"url": "https://two.example/openapi.json"}}
+    assert other.headers["etag"] != first.headers["etag"]
+
+    headers = {"host": "one.example", "If-None-Match": first.headers["etag"]}
+    assert client.get("/.well-known/ai-plugin.json", headers=headers).status_code == 304
+    manifest.write_text('{"api": {"url": "PLUGIN_HOSTNAME/v2/openapi.json"}}')
+    changed = client.get("/.well-known/ai-plugin.json", headers=headers)
+    assert changed.status_code == 200 and changed.json()["api"]["url"] == "https://one.example/v2/openapi.json"
+
+    spec = client.get("/openapi.json", headers={"host": "one.example"}).json()
+    assert spec["servers"] == [{"url": "https://one.example"}]
+    assert "/file" in spec["paths"]
+
+
+def test_importing_the_app_leaves_heavy_dependencies_unloaded():
+    code = "import sys, main; print(sorted({'trafilatura', 'requests_html', 'fuzzywuzzy', 'openai'} & set(sys.modules)))"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    loaded = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+    assert loaded.stdout.strip() == "[]"
+
+
+def test_line_updates_stream_to_disk_and_roll_back(client, tmp_path):
+    path = tmp_path / "big.py"
+    original = "".join(f"x{i} = {i}\n" for i in range(5000))
+    path.write_text(original)
+    updates = [
+        {"line_number": 4000, "new_content": "x4000 = 'changed'", "action": "modify"},
+        {"line_number": 10, "new_content": "", "action": "delete"},
+        {"line_number": 2, "new_content": "inserted = True", "action": "insert"},
+    ]
+    assert client.post("/update-file-at-lines", json={"filepath": str(path), "updates": updates}).status_code == 200
+    lines = path.read_text().splitlines()
+    assert lines[2:4] == ["x2 = 2", "inserted = True"]
+    assert "x10 = 10" not in lines and "x4000 = 'changed'" in lines and len(lines) == 5000
+
+    assert client.post("/rollback-update", params={"filepath": str(path)}).status_code == 200
+    assert path.read_text() == original
+    assert client.post("/redo-update", params={"filepath": str(path)}).status_code == 200
+    assert path.read_text().splitlines() == lines
+
+
+def test_selecting_a_project_warms_it_up_in_the_background(client, tmp_path):
+    (tmp_path / "app.py").write_text("def main():\n    pass\n")
+    headers = {"x-session-id": "prewarm-test"}
+    client.post("/add-project/prewarm-test", headers=headers)
+    client.post("/set-project-root/prewarm-test", params={"filepath": str(tmp_path)}, headers=headers)
+
+    assert client.post("/select-project/prewarm-test", headers=headers).status_code == 200
+    status = client.get("/project-status", params={"wait": 30}, headers=headers).json()
+    assert (status["root"], status["state"], status["python_files"]) == (str(tmp_path), "done", 1)
+
+
+def test_files_expands_globs_and_sends_repeated_content_once(client, tmp_path, monkeypatch):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.py").write_text("shared = 1\n")
+    (tmp_path / "b.py").write_text("shared = 1\n")
+    (tmp_path / "sub" / "c.py").write_text("first = 1\nsecond = 2\n")
+    (tmp_path / "notes.txt").write_text("not python\n")
+    headers = {"x-session-id": "files-test"}
+    client.post("/add-project/files-test", headers=headers)
+    client.post("/set-project-root/files-test", params={"filepath": str(tmp_path)}, headers=headers)
+    client.post("/select-project/files-test", headers=headers)
+
+    files = [f"{tmp_path}/**/*.py", {"path": "sub/c.py", "start_line": 1, "end_line": 2}, "missing*.py", "gone.py"]
+    body = client.post("/files", json={"files": files}, headers=headers).json()
+    results = body["files"]
+    assert [r["filepath"] for r in results[:3]] == [str(tmp_path / name) for name in ("a.py", "b.py", "sub/c.py")]
+    assert results[0]["content"] == "shared = 1\n"
+    assert "content" not in results[1] and results[1]["duplicate_of"] == 0
+    assert results[2]["content"] == "first = 1\nsecond = 2\n"
+    assert (results[3]["content"], results[3]["start_line"]) == ("second = 2\n", 1)
+    assert (results[4]["status"], results[5]["status"]) == (404, 404)
+    assert (body["errors"], body["duplicates"]) == (2, 1)
+
+    monkeypatch.setattr(main, "MAX_BATCH_FILES", 2)
+    capped = client.post("/files", json={"files": [f"{tmp_path}/**/*.py"]}, headers=headers).json()["files"]
+    assert [r.get("status") for r in capped] == [None, None, 413]
@@ -0,0 +1,47 @@
+import os
+
+import outline
+from outline import OutlineIndex, stream_outline
+
+
+def count_parses(monkeypatch):
+    parsed = []
+    analyze = outline.analyze_or_error
+    monkeypatch.setattr(outline, "analyze_or_error", lambda job: parsed.append(job[1]) or analyze(job))
+    return parsed
+
+
+def test_only_changed_files_are_parsed_again(tmp_path, monkeypatch):
+    (tmp_path / "a.py").write_text("import os\n\n\ndef run():\n    pass\n")
+    (tmp_path / "b.py").write_text("class B:\n    def go(self):\n        pass\n")
+    parsed = count_parses(monkeypatch)
+    root = str(tmp_path)
+
+    first = OutlineIndex(root).outlines(["a.py", "b.py"])
+    assert first["a.py"] == {"imports": ["import os"], "classes": [], "functions": [{"function": "run"}]}
+    assert first["b.py"]["functions"] == [{"class": "B", "methods": ["go"]}]
+    assert sorted(parsed) == ["a.py", "b.py"]
+
+    # -> A restarted server loads the saved index; a touched but unchanged file keeps its outline
+    os.utime(tmp_path / "a.py", ns=(0, 0))
+    (tmp_path / "b.py").write_text("class B:\n    def stop(self):\n        pass\n")
+    index = OutlineIndex(root)
+    second = index.outlines(["a.py", "b.py"])
+    assert second["a.py"] == first["a.py"]
+    assert second["b.py"]["functions"] == [{"class": "B", "methods": ["stop"]}]
+    assert sorted(parsed) == ["a.py", "b.py", "b.py"]
+
+    # -> A complete listing drops the files that went away
+    assert index.outlines(["a.py"]) == {"a.py": first["a.py"]}
+    assert list(OutlineIndex(root).entries) == ["a.py"]
+
+
+def test_unparsable_files_get_their_error_inline(tmp_path):
+    (tmp_path / "ok.py").write_text("def fine():\n    pass\n")
+    (tmp_path / "broken.py").write_text("def broken(:\n")
+
+    records = list(stream_outline(str(tmp_path)))
+    outlines = {r["name"]: r["outline"] for r in records if r["type"] == "file"}
+    assert outlines["ok.py"]["functions"] == [{"function": "fine"}]
+    assert outlines["broken.py"]["error"].startswith("SyntaxError")
+    assert records[-1] == {"type": "end", "dirs": 1, "files": 2, "outlined": 2, "errors": 1}
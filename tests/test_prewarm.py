@@ -0,0 +1,34 @@
+from outline import get_outline_index
+from prewarm import STAGES, PrewarmJob
+from search_index import get_search_index
+
+
+def make_project(root, files=3):
+    for i in range(files):
+        (root / f"mod{i}.py").write_text(f"def func{i}():\n    return {i}\n")
+    (root / "notes.txt").write_text("not python\n")
+
+
+def test_a_finished_warm_up_leaves_every_index_current(tmp_path):
+    make_project(tmp_path)
+    root = str(tmp_path)
+    job = PrewarmJob(root, workers=1).start()
+    assert job.wait(timeout=30)
+
+    status = job.status()
+    assert (status["state"], status["stages_done"], status["progress"]) == ("done", list(STAGES), 1.0)
+    assert (status["entries"], status["python_files"], status["outlined"]) == (4, 3, 3)
+    assert set(get_outline_index(root).entries) == {"mod0.py", "mod1.py", "mod2.py"}
+    search = get_search_index(root)
+    assert not search.queued and set(search.stats) == {"mod0.py", "mod1.py", "mod2.py", "notes.txt"}
+
+
+def test_a_cancelled_warm_up_stops_before_its_next_stage(tmp_path):
+    make_project(tmp_path)
+    job = PrewarmJob(str(tmp_path), workers=1)
+    job.cancel()
+    job.start()
+    assert job.wait(timeout=30)
+    assert (job.status()["state"], job.status()["stages_done"]) == ("cancelled", [])
+    # -> Anyone waiting on a stage is let go too
+    assert job.wait("symbols", timeout=0)
@@ -0,0 +1,44 @@
+import importlib
+
+import project_files
+from project_files import get_file_structure, glob_files, walk_project
+
+
+def make_tree(root):
+    for path in ["a.py", "pkg/b.py", "pkg/c.log", "keep.log", ".git/HEAD", "node_modules/x/index.js", "build/out.py"]:
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text("x\n")
+    (root / ".gitignore").write_text("*.log\n!keep.log\n")
+
+
+def walked(root, **kwargs):
+    return ["/".join(parts) for parts, _, _ in walk_project(str(root), **kwargs)]
+
+
+def test_default_rules_load_whatever_the_working_directory(tmp_path, monkeypatch):
+    make_tree(tmp_path)
+    monkeypatch.chdir(tmp_path / "pkg")
+    rules = importlib.reload(project_files).default_rules
+    assert rules
+    assert walked(tmp_path, rules=rules) == ["a.py", "keep.log", "pkg", "pkg/b.py"]
+
+
+def test_walk_honors_gitignore_negation_and_depth(tmp_path):
+    make_tree(tmp_path)
+    assert walked(tmp_path) == ["a.py", "keep.log", "pkg", "pkg/b.py"]
+    assert walked(tmp_path, max_depth=1) == ["a.py", "keep.log", "pkg"]
+
+
+def test_cursor_pages_through_the_tree(tmp_path):
+    make_tree(tmp_path)
+    first = get_file_structure(str(tmp_path), max_entries=2)
+    assert [child["name"] for child in first["children"]] == ["a.py", "keep.log"]
+    rest = get_file_structure(str(tmp_path), cursor=first["next_cursor"])
+    assert [child["name"] for child in rest["children"]] == ["pkg"]
+    assert [child["name"] for child in rest["children"][0]["children"]] == ["pkg/b.py"]
+
+
+def test_glob_files_walks_below_the_literal_prefix(tmp_path):
+    make_tree(tmp_path)
+    assert glob_files(f"{tmp_path}/**/*.py", limit=10) == ([f"{tmp_path}/a.py", f"{tmp_path}/pkg/b.py"], False)
+    assert glob_files(f"{tmp_path}/**/*.py", limit=1) == ([f"{tmp_path}/a.py"], True)
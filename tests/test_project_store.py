@@ -0,0 +1,16 @@
+import json
+
+from project_store import ProjectStore
+
+
+def test_legacy_projects_are_imported_once(tmp_path):
+    legacy = tmp_path / "projects.json"
+    legacy.write_text(json.dumps({"app": {"root": "/srv/app", "cwd": "/srv/app"}, "lib": {"root": None, "cwd": None}}))
+    db = str(tmp_path / "projects.db")
+
+    store = ProjectStore(db, legacy_file=str(legacy))
+    assert set(store.all()) == {"app", "lib"}
+    assert store.remove("app")
+
+    # -> A restart must not bring a removed project back
+    assert set(ProjectStore(db, legacy_file=str(legacy)).all()) == {"lib"}
@@ -0,0 +1,13 @@
+from relevance_index import RelevanceIndex
+
+
+def test_snippet_lines_match_the_file_when_it_has_other_line_breaks(tmp_path):
+    # -> \f, \r and \x1c end a line for str.splitlines but not for the file readers
+    lines = [f"value_{i} = {i}  # \f\x1c\r page {i}\n" for i in range(200)]
+    lines[150] = "def quokka_handler():\n"
+    (tmp_path / "pages.py").write_text("".join(lines))
+
+    context = RelevanceIndex(str(tmp_path)).context("quokka handler", max_tokens=2000)
+    snippet = context["files"][0]["snippets"][0]
+    assert snippet["start_line"] <= 150 < snippet["end_line"]
+    assert snippet["content"] == "".join(lines[snippet["start_line"]:snippet["end_line"]])
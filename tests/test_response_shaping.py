@@ -0,0 +1,45 @@
+import asyncio
+import zlib
+
+import pytest
+
+from response_shaping import CompressionMiddleware, brotli
+
+
+def decoder(encoding):
+    if encoding == "br":
+        return brotli.Decompressor().process
+    return zlib.decompressobj(zlib.MAX_WBITS | 16).decompress
+
+
+def run_streamed(app, encoding):
+    """
+    Body messages sent by `app` behind the middleware, each decoded on its own
+    as a client would when it arrives.
+    """
+    scope = {"type": "http", "headers": [(b"accept-encoding", encoding.encode())]}
+    sent = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(CompressionMiddleware(app)(scope, receive, send))
+    start, bodies = sent[0], sent[1:]
+    assert (b"content-encoding", encoding.encode()) in start["headers"]
+    decode = decoder(encoding)
+    return [decode(message["body"]) for message in bodies]
+
+
+@pytest.mark.parametrize("encoding", ["gzip", pytest.param("br", marks=pytest.mark.skipif(brotli is None, reason="brotli"))])
+def test_streamed_chunks_are_decodable_as_they_arrive(encoding):
+    chunks = [b"first line of a streamed body\n", b"x" * 5000 + b"\n", b"last\n"]
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+
+    assert run_streamed(app, encoding) == chunks
@@ -0,0 +1,55 @@
+import file_index
+from file_reads import read_lines
+from search_index import SearchIndex
+
+
+def test_hit_line_numbers_match_the_file_when_it_has_other_line_breaks(tmp_path):
+    # -> \f, \r and \x1c end a line for str.splitlines but not for the file readers
+    lines = [f"value_{i} = {i}  # \f\x1c\r page {i}\n" for i in range(50)]
+    lines[40] = "def quokka_handler():\r\n"
+    (tmp_path / "pages.py").write_text("".join(lines), newline="")
+
+    results = SearchIndex(str(tmp_path)).search("quokka_handler", context=1)["results"]
+    hit = results[0]["hits"][0]
+    assert hit["line_number"] == 40
+    assert hit["text"] == "def quokka_handler():"
+    assert read_lines(str(tmp_path / "pages.py"), 40, 41) == lines[40]
+    assert hit["context_before"] == [lines[39].rstrip("\r\n")]
+
+
+def test_a_changed_file_is_appended_to_the_log_and_reloaded(tmp_path):
+    for i in range(5):
+        (tmp_path / f"mod{i}.py").write_text(f"def handler_{i}():\n    pass\n")
+    index = SearchIndex(str(tmp_path))
+    assert index.search("handler_3")["total_hits"] == 1
+    snapshot = index.path.read_bytes()
+
+    (tmp_path / "mod3.py").write_text("def renamed_handler():\n    pass\n")
+    file_index.get_project_files(str(tmp_path)).refresh()
+    assert index.search("renamed_handler")["total_hits"] == 1
+    assert index.path.read_bytes() == snapshot
+    assert index.log_bytes > 0
+
+    def read(self, relpath, stat):
+        raise AssertionError(f"{relpath} indexed again")
+
+    reloaded = SearchIndex(str(tmp_path))
+    reloaded.read = read.__get__(reloaded)
+    assert reloaded.search("renamed_handler")["total_hits"] == 1
+    assert reloaded.search("handler_3")["total_hits"] == 0
+
+
+def test_queries_do_not_walk_the_tree_once_it_was_walked(tmp_path, monkeypatch):
+    (tmp_path / "app.py").write_text("first = 1\n")
+    index = SearchIndex(str(tmp_path))
+    assert index.search("first")["total_hits"] == 1
+
+    def walk(*args, **kwargs):
+        raise AssertionError("walked inside a query")
+
+    monkeypatch.setattr(file_index, "walk_project", walk)
+    (tmp_path / "app.py").write_text("second = 2\n")
+    # -> The server's own writes are seen at the next query, without a walk
+    file_index.files_written([str(tmp_path / "app.py")])
+    assert index.search("second")["total_hits"] == 1
+    assert index.search("first")["total_hits"] == 0
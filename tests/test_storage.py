@@ -0,0 +1,57 @@
+import os
+import stat
+
+import pytest
+
+from storage import UMASK, atomic_write_lines, write_temp_lines
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_new_files_follow_the_umask(tmp_path):
+    path = tmp_path / "new.txt"
+    atomic_write_lines(path, ["a\n", "b\n"])
+    assert path.read_text() == "a\nb\n"
+    assert mode(path) == 0o666 & ~UMASK
+
+
+def test_existing_files_keep_their_mode(tmp_path):
+    path = tmp_path / "script.sh"
+    path.write_text("old\n")
+    os.chmod(path, 0o750)
+    atomic_write_lines(path, ["new\n"])
+    assert path.read_text() == "new\n"
+    assert mode(path) == 0o750
+
+
+def test_symlinks_are_written_through(tmp_path):
+    (tmp_path / "real").mkdir()
+    target = tmp_path / "real" / "target.txt"
+    target.write_text("old\n")
+    link = tmp_path / "link.txt"
+    link.symlink_to(target)
+
+    atomic_write_lines(link, ["new\n"])
+    assert link.is_symlink() and os.readlink(link) == str(target)
+    assert target.read_text() == "new\n"
+
+    # -> The temp file is staged next to the target so the rename never crosses filesystems
+    temp = write_temp_lines(link, ["staged\n"])
+    assert temp.parent == target.parent
+    temp.unlink()
+
+
+def test_a_write_that_fails_midway_leaves_the_file_and_no_temp_behind(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("old\n")
+
+    def lines():
+        yield "new\n"
+        raise RuntimeError("source went away")
+
+    with pytest.raises(RuntimeError):
+        atomic_write_lines(path, lines())
+    assert path.read_text() == "old\n"
+    assert os.listdir(tmp_path) == ["a.txt"]
@@ -0,0 +1,39 @@
+import file_index
+import outline
+from outline import get_outline_index
+from symbol_index import SymbolIndex, get_symbol_index
+
+
+def test_unparsable_files_are_recorded_instead_of_failing_the_refresh(tmp_path):
+    (tmp_path / "good.py").write_text("def helper():\n    return 1\n")
+    (tmp_path / "broken.py").write_text("def broken(:\n")
+    # -> A long enough expression makes ast construction raise RecursionError
+    (tmp_path / "deep.py").write_text("x = " + " + ".join(["a"] * 200000) + "\n")
+
+    index = SymbolIndex(str(tmp_path))
+    assert [d["qualname"] for d in index.find_definitions("helper")] == ["helper"]
+    errors = {e["filepath"].rpartition("/")[2]: e["error"] for e in index.errors()}
+    assert set(errors) == {"broken.py", "deep.py"}
+    assert errors["broken.py"].startswith("SyntaxError")
+    assert errors["deep.py"].startswith("RecursionError")
+
+
+def test_outlined_files_are_not_parsed_again_for_their_symbols(tmp_path, monkeypatch):
+    (tmp_path / "app.py").write_text("class App:\n    def run(self):\n        helper()\n")
+    (tmp_path / "util.py").write_text("def helper():\n    return 1\n")
+    parses = []
+    parse = outline.ast.parse
+    monkeypatch.setattr(outline.ast, "parse", lambda source, *args, **kwargs: parses.append(source) or parse(source))
+
+    root = str(tmp_path)
+    get_outline_index(root).outlines(["app.py", "util.py"])
+    index = get_symbol_index(root)
+    assert [d["qualname"] for d in index.find_definitions("run")] == ["App.run"]
+    assert len(parses) == 2
+
+    # -> A changed file is parsed once, for both its outline and its symbols
+    (tmp_path / "util.py").write_text("def helper():\n    return 2\n\n\ndef other():\n    pass\n")
+    file_index.get_project_files(root).refresh()
+    assert [d["qualname"] for d in index.find_definitions("other")] == ["other"]
+    assert get_outline_index(root).outlines(["app.py", "util.py"])["util.py"]["functions"][-1] == {"function": "other"}
+    assert len(parses) == 3
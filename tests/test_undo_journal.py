@@ -0,0 +1,53 @@
+from file_reads import split_lines
+from line_edits import PieceTable
+from storage import ContentHasher, atomic_write_lines, content_hash
+from undo_journal import FileEdit, UndoJournal, text_edit
+
+
+def edit_file(journal, path, line_number, content):
+    lines = split_lines(path.read_text())
+    table = PieceTable(lines)
+    table.modify(line_number, content)
+    after = ContentHasher()
+    atomic_write_lines(path, after.passing(table))
+    return journal.record("test", [FileEdit(str(path), lines, after.hexdigest(), table.hunks())])
+
+
+def test_streamed_edits_undo_and_redo(tmp_path):
+    path = tmp_path / "app.py"
+    original = "".join(f"line {i}\n" for i in range(100)) + "last"
+    path.write_text(original)
+    journal = UndoJournal(str(tmp_path))
+
+    edit_file(journal, path, 10, "ten")
+    edit_file(journal, path, 99, "last but one")
+    edited = path.read_text()
+    assert journal.undo(count=2)[0]["files"] == [str(path)]
+    assert path.read_text() == original
+    journal.redo(count=2)
+    assert path.read_text() == edited
+
+
+def test_workers_sharing_a_journal_never_reuse_an_edit_id(tmp_path):
+    path = tmp_path / "app.py"
+    path.write_text("a\nb\n")
+    # -> Two instances of one project's journal, as two server workers would have
+    first, second = UndoJournal(str(tmp_path)), UndoJournal(str(tmp_path))
+
+    ids = [
+        edit_file(first, path, 0, "a1")["id"],
+        edit_file(second, path, 1, "b1")["id"],
+        edit_file(first, path, 0, "a2")["id"],
+    ]
+    assert ids == [1, 2, 3]
+    assert [edit["id"] for edit in second.history()] == [3, 2, 1]
+    # -> The other worker's latest edit is the one undone
+    assert second.undo()[0]["id"] == 3
+    assert path.read_text() == "a1\nb1\n"
+
+
+def test_text_edits_hash_like_the_streamed_ones(tmp_path):
+    edit = text_edit(str(tmp_path / "new.py"), None, "x = 1\ny = 2\n")
+    assert edit.before is None
+    assert edit.after == content_hash(b"x = 1\ny = 2\n")
+    assert edit.hunks == [(0, 0, "x = 1\ny = 2\n")]
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import url_fetch
+from url_fetch import PagePool, UrlFetcher
+
+PARAGRAPH = "The quick brown fox jumps over the lazy dog while the server answers every request. "
+PAGES = {
+    "/article": "<html><head><title>Notes</title></head><body><article><h1>Notes</h1>"
+    + "".join(f"<p>{PARAGRAPH * 3} Part {i}.</p>" for i in range(6)) + "</article></body></html>",
+    "/script": "<html><body><div id='app'></div><script>render()</script></body></html>",
+}
+
+
+@pytest.fixture
+def server():
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append((self.path, self.headers.get("If-None-Match")))
+            etag = f'"{self.path}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = PAGES[self.path.partition("?")[0]].encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}", requests
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(fetcher, *urls):
+    async def run():
+        try:
+            return [await fetcher.get_article(url) for url in urls]
+        finally:
+            await fetcher.close()
+    return asyncio.run(run())
+
+
+def test_static_html_skips_the_browser_and_is_cached(server, monkeypatch):
+    base, requests = server
+
+    async def no_browser(self, url):
+        raise AssertionError("rendered a page that extracts without JavaScript")
+
+    monkeypatch.setattr(PagePool, "render", no_browser)
+    first, second = fetch(UrlFetcher(), f"{base}/article", f"{base}/article")
+    assert "quick brown fox" in first and "Part 5" in first
+    assert second == first
+    assert requests == [("/article", None)]
+
+
+def test_stale_entries_revalidate_with_the_etag(server, monkeypatch):
+    base, requests = server
+    monkeypatch.setattr(url_fetch, "CACHE_TTL", -1)
+    first, second = fetch(UrlFetcher(), f"{base}/article", f"{base}/article")
+    assert second == first
+    assert requests == [("/article", None), ("/article", '"/article"')]
+
+
+def test_cache_keeps_at_most_cache_size_articles(server, monkeypatch):
+    base, requests = server
+    monkeypatch.setattr(url_fetch, "CACHE_SIZE", 2)
+    fetcher = UrlFetcher()
+    fetch(fetcher, *(f"{base}/article?page={i}" for i in range(3)), f"{base}/article?page=0")
+    assert list(fetcher.cache) == [f"{base}/article?page=2", f"{base}/article?page=0"]
+    assert len(requests) == 4
+
+
+def test_script_pages_fall_back_to_the_browser(server, monkeypatch):
+    base, _ = server
+    rendered = []
+
+    async def render(self, url):
+        rendered.append(url)
+        return PAGES["/article"]
+
+    monkeypatch.setattr(PagePool, "render", render)
+    [article] = fetch(UrlFetcher(), f"{base}/script")
+    assert rendered == [f"{base}/script"] and "Part 5" in article
+
+
+def test_page_pool_opens_at_most_size_pages():
+    class Page:
+        open = peak = 0
+
+        async def goto(self, url, options):
+            Page.open += 1
+            Page.peak = max(Page.peak, Page.open)
+            await asyncio.sleep(0.01)
+            Page.open -= 1
+
+        async def content(self):
+            return "<html></html>"
+
+        async def close(self):
+            pass
+
+    class Browser:
+        pages = []
+
+        async def newPage(self):
+            self.pages.append(Page())
+            return self.pages[-1]
+
+    class Session:
+        @property
+        async def browser(self):
+            return Browser()
+
+    async def run():
+        pool = PagePool(Session(), size=2)
+        await asyncio.gather(*(pool.render(f"http://example/{i}") for i in range(8)))
+        return pool
+
+    pool = asyncio.run(run())
+    assert Page.peak == 2 and len(Browser.pages) == 2 and len(pool.idle) == 2
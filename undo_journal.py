@@ -0,0 +1,302 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+import json
+import os
+import threading
+import time
+import zlib
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends from several workers aren't serialized
+    fcntl = None
+
+from file_reads import split_lines
+from storage import ContentHasher, atomic_write_lines, content_hash, lines_hash, project_cache_dir
+
+
+JOURNAL_DIR = "journal"
+LOG_FILE = "log.jsonl"
+
+
+class JournalConflict(Exception):
+    """
+    A file no longer matches the state an undo/redo expects, e.g. because
+    it was edited outside the server since. `done` lists the edits undone
+    or redone before it.
+    """
+
+    def __init__(self, message: str, done: Optional[List[Dict]] = None):
+        super().__init__(message)
+        self.done = done or []
+
+
+class FileEdit(NamedTuple):
+    path: str
+    before: Optional[Sequence[str]]  # lines, None when the file didn't exist
+    after: Optional[str]  # content hash of what was written, None when the file was removed
+    hunks: List[Tuple[int, int, str]]  # (start, stop, new text) replacements of `before` lines
+
+
+def text_edit(path: str, before: Optional[str], after: Optional[str]) -> FileEdit:
+    """
+    A FileEdit from whole texts, for edits that have them anyway.
+    """
+    before_lines = None if before is None else split_lines(before)
+    return FileEdit(path, before_lines, _text_hash(after), diff_hunk(before_lines or [], split_lines(after or "")))
+
+
+def _text_hash(text: Optional[str]) -> Optional[str]:
+    return None if text is None else content_hash(text.encode("utf-8"))
+
+
+def diff_hunk(before: List[str], after: List[str]) -> List[Tuple[int, int, str]]:
+    """
+    One hunk covering everything between the common prefix and suffix of
+    two versions, or none when they're equal.
+    """
+    prefix, limit = 0, min(len(before), len(after))
+    while prefix < limit and before[prefix] == after[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and before[-1 - suffix] == after[-1 - suffix]:
+        suffix += 1
+    if prefix == len(before) == len(after):
+        return []
+    return [(prefix, len(before) - suffix, "".join(after[prefix:len(after) - suffix]))]
+
+
+class UndoJournal:
+    """
+    Per-project edit history: an append-only log of edits, each recording
+    the changed line ranges of every file it touched as content-addressed,
+    compressed blobs. Undo and redo only read and write those ranges and
+    check the whole-file hashes, so they never rely on git.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.dir = project_cache_dir(root) / JOURNAL_DIR
+        self.blobs = self.dir / "blobs"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.log_path = self.dir / LOG_FILE
+        self.lock = threading.Lock()
+        self.edits: Dict[int, Dict] = {}
+        self.next_id = 1
+        self.undone: List[int] = []  # ids in the order they were undone, for redo
+        self.offset = 0  # -> How much of the log was read; other workers may append to it too
+        self._catch_up()
+
+    def _catch_up(self) -> None:
+        try:
+            with self.log_path.open("rb") as file:
+                self._read_new(file)
+        except OSError:
+            pass
+
+    def _read_new(self, file) -> None:
+        # Records appended since the last read, up to the last complete line
+        file.seek(self.offset)
+        data = file.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            self._ingest(record)
+        self.offset += end
+
+    def _ingest(self, record: Dict) -> None:
+        if record["op"] == "edit":
+            record["undone"] = False
+            self.edits[record["id"]] = record
+            self.next_id = max(self.next_id, record["id"] + 1)
+        elif record["edit"] in self.edits:
+            self._mark(self.edits[record["edit"]], record["op"] == "undo")
+
+    def _mark(self, edit: Dict, undone: bool) -> None:
+        edit["undone"] = undone
+        if undone:
+            self.undone.append(edit["id"])
+        elif edit["id"] in self.undone:
+            self.undone.remove(edit["id"])
+
+    def _append(self, record: Dict) -> Dict:
+        """
+        Append `record` to the log once whatever other workers appended is
+        read in, giving an edit the next id of the log rather than of this
+        process.
+        """
+        with self.log_path.open("a+b") as file:
+            if fcntl is not None:
+                # -> Released when the file is closed
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            self._read_new(file)
+            if record["op"] == "edit":
+                record["id"] = self.next_id
+            data = (json.dumps(record) + "\n").encode("utf-8")
+            file.write(data)
+            file.flush()
+            self.offset += len(data)
+        self._ingest(record)
+        return record
+
+    # Blobs
+    # -------------------------------------------
+
+    def _put(self, text: str) -> str:
+        data = text.encode("utf-8")
+        digest = content_hash(data)
+        path = self.blobs / digest[:2] / digest
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_name(f"{digest}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(zlib.compress(data))
+            os.replace(tmp_path, path)
+        return digest
+
+    def _get(self, digest: str) -> str:
+        return zlib.decompress((self.blobs / digest[:2] / digest).read_bytes()).decode("utf-8")
+
+    # Recording
+    # -------------------------------------------
+
+    def record(self, route: str, files: List[FileEdit]) -> Dict:
+        """
+        Log one edit spanning `files`, after they were written.
+        """
+        changes = []
+        for file_edit in files:
+            before_lines = file_edit.before or []
+            changes.append({
+                "path": file_edit.path,
+                "before": None if file_edit.before is None else lines_hash(file_edit.before),
+                "after": file_edit.after,
+                "hunks": [
+                    [start, stop, self._put("".join(before_lines[start:stop])), self._put(text)]
+                    for start, stop, text in file_edit.hunks
+                ],
+            })
+        with self.lock:
+            edit = self._append({"op": "edit", "id": None, "time": time.time(), "route": route, "files": changes})
+        return self._summary(edit)
+
+    # Undo / redo
+    # -------------------------------------------
+
+    def undo(self, count: int = 1, filepath: Optional[str] = None) -> List[Dict]:
+        """
+        Undo the latest `count` edits (touching `filepath`, if given), newest first.
+        """
+        with self.lock:
+            self._catch_up()
+            done = []
+            for _ in range(count):
+                edit = next(
+                    (e for e in reversed(self.edits.values()) if not e["undone"] and self._touches(e, filepath)),
+                    None,
+                )
+                if edit is None:
+                    break
+                self._apply(edit, undo=True, done=done)
+                done.append(self._summary(edit))
+            return done
+
+    def redo(self, count: int = 1, filepath: Optional[str] = None) -> List[Dict]:
+        """
+        Redo the most recently undone `count` edits (touching `filepath`, if given).
+        """
+        with self.lock:
+            self._catch_up()
+            done = []
+            for _ in range(count):
+                edit_id = next((i for i in reversed(self.undone) if self._touches(self.edits[i], filepath)), None)
+                if edit_id is None:
+                    break
+                self._apply(self.edits[edit_id], undo=False, done=done)
+                done.append(self._summary(self.edits[edit_id]))
+            return done
+
+    def _touches(self, edit: Dict, filepath: Optional[str]) -> bool:
+        return filepath is None or any(change["path"] == filepath for change in edit["files"])
+
+    def _apply(self, edit: Dict, undo: bool, done: List[Dict]) -> None:
+        # Check and compute every file first, so a conflict leaves all of them untouched
+        try:
+            targets = [(change["path"], self._target(change, undo)) for change in edit["files"]]
+        except JournalConflict as e:
+            raise JournalConflict(str(e), done) from None
+        for path, pieces in targets:
+            if pieces is None:
+                Path(path).unlink(missing_ok=True)
+            else:
+                atomic_write_lines(Path(path), pieces)
+        self._append({"op": "undo" if undo else "redo", "edit": edit["id"], "time": time.time()})
+
+    def _target(self, change: Dict, undo: bool) -> Optional[List[str]]:
+        # The pieces of the file to write back, checked against the recorded hash
+        path = change["path"]
+        source, target = (change["after"], change["before"]) if undo else (change["before"], change["after"])
+        try:
+            with open(path, "r") as file:
+                current = file.read()
+        except FileNotFoundError:
+            current = None
+        if _text_hash(current) != source:
+            raise JournalConflict(f"{path} changed since edit, can't {'undo' if undo else 'redo'} it.")
+        if target is None:
+            return None
+
+        lines = split_lines(current or "")
+        pieces, position, offset = [], 0, 0
+        for start, stop, old_blob, new_blob in change["hunks"]:
+            old_text, new_text = self._get(old_blob), self._get(new_blob)
+            if undo:
+                # Hunks are in `before` line numbers; shift them by what earlier hunks added
+                new_count = len(split_lines(new_text))
+                pieces.append("".join(lines[position:start + offset]))
+                pieces.append(old_text)
+                position = start + offset + new_count
+                offset += new_count - (stop - start)
+            else:
+                pieces.append("".join(lines[position:start]))
+                pieces.append(new_text)
+                position = stop
+        pieces.append("".join(lines[position:]))
+        hasher = ContentHasher()
+        for piece in pieces:
+            hasher.update(piece)
+        if hasher.hexdigest() != target:
+            raise JournalConflict(f"{path} could not be restored from the journal.")
+        return pieces
+
+    # History
+    # -------------------------------------------
+
+    def history(self, limit: int = 20, filepath: Optional[str] = None) -> List[Dict]:
+        with self.lock:
+            self._catch_up()
+            edits = [e for e in reversed(self.edits.values()) if self._touches(e, filepath)]
+            return [self._summary(edit) for edit in edits[:limit]]
+
+    def _summary(self, edit: Dict) -> Dict:
+        return {
+            "id": edit["id"],
+            "time": edit["time"],
+            "route": edit["route"],
+            "files": [change["path"] for change in edit["files"]],
+            "undone": edit["undone"],
+        }
+
+
+_journals: Dict[str, UndoJournal] = {}
+_journals_lock = threading.Lock()
+
+
+def get_undo_journal(root: str) -> UndoJournal:
+    with _journals_lock:
+        journal = _journals.get(root)
+        if journal is None:
+            journal = _journals[root] = UndoJournal(root)
+        return journal
@@ -0,0 +1,144 @@
+from typing import TYPE_CHECKING, Optional
+from collections import OrderedDict
+import asyncio
+import os
+import time
+
+from concurrency import SingleFlight
+from metrics import record_cache, span
+
+
+CACHE_SIZE = int(os.getenv("URL_CACHE_SIZE", 128))
+CACHE_TTL = float(os.getenv("URL_CACHE_TTL", 300))
+PAGE_POOL_SIZE = int(os.getenv("URL_PAGE_POOL_SIZE", 4))
+RENDER_TIMEOUT = 8.0
+
+# -> Static HTML that already yields this much article text skips the browser
+MIN_STATIC_ARTICLE_CHARS = 500
+
+if TYPE_CHECKING:
+    from requests_html import AsyncHTMLSession
+
+
+def extract_article(html: str) -> Optional[str]:
+    # trafilatura and requests_html (pyppeteer) are slow to import, so they load on the first fetch
+    import trafilatura
+    return trafilatura.extract(html)
+
+
+class CachedArticle:
+    def __init__(self, article: Optional[str], etag: Optional[str], last_modified: Optional[str]):
+        self.article = article
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = time.monotonic() + CACHE_TTL
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires
+
+
+class PagePool:
+    """
+    At most `size` browser pages, opened on one shared headless browser
+    the first time JS rendering is needed and reused between requests.
+    """
+
+    def __init__(self, session: "AsyncHTMLSession", size: int = PAGE_POOL_SIZE):
+        self.session = session
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+
+    async def render(self, url: str) -> str:
+        async with self.slots:
+            page = self.idle.pop() if self.idle else await (await self.session.browser).newPage()
+            try:
+                await page.goto(url, options={"timeout": int(RENDER_TIMEOUT * 1000)})
+                content = await page.content()
+            except Exception:
+                # A page that failed mid-navigation isn't trusted for the next request
+                await page.close()
+                raise
+            self.idle.append(page)
+            return content
+
+
+class UrlFetcher:
+    """
+    Fetches and extracts articles with an LRU+TTL cache that revalidates
+    with ETag/Last-Modified, and coalesces concurrent fetches of one URL.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.cache: "OrderedDict[str, CachedArticle]" = OrderedDict()
+        self.fetches = SingleFlight("url_fetch")
+
+    def _bind_loop(self) -> None:
+        # The session and its browser belong to one event loop; start over if a new loop shows up
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            from requests_html import AsyncHTMLSession
+            self._loop = loop
+            self.session = AsyncHTMLSession(loop=loop)
+            self.pages = PagePool(self.session)
+
+    async def get_article(self, url: str) -> Optional[str]:
+        self._bind_loop()
+        entry = self.cache.get(url)
+        if entry and entry.fresh:
+            self.cache.move_to_end(url)
+            record_cache("url", hit=True)
+            return entry.article
+        record_cache("url", hit=False)
+
+        return await self.fetches.do(url, lambda: self._fetch(url, entry))
+
+    async def _fetch(self, url: str, stale: Optional[CachedArticle]) -> Optional[str]:
+        headers = {}
+        if stale and stale.etag:
+            headers["If-None-Match"] = stale.etag
+        if stale and stale.last_modified:
+            headers["If-Modified-Since"] = stale.last_modified
+
+        with span("url_get"):
+            response = await self.session.get(url, headers=headers)
+        if response.status_code == 304 and stale:
+            self._store(url, CachedArticle(stale.article, stale.etag, stale.last_modified))
+            return stale.article
+
+        with span("url_extract"):
+            article = await asyncio.to_thread(extract_article, response.text)
+        if not article or len(article) < MIN_STATIC_ARTICLE_CHARS:
+            # Render the JavaScript on the page
+            try:
+                with span("url_render"):
+                    html_content = await self.pages.render(url)
+            except Exception:
+                if not article:
+                    raise
+            else:
+                with span("url_extract"):
+                    article = await asyncio.to_thread(extract_article, html_content) or article
+
+        self._store(url, CachedArticle(article, response.headers.get("ETag"), response.headers.get("Last-Modified")))
+        return article
+
+    async def close(self) -> None:
+        """
+        Close the headless browser, if one was started, and the HTTP session.
+        """
+        if self._loop is None:
+            return
+        session, self._loop = self.session, None
+        await session.close()
+        session.thread_pool.shutdown(wait=False)
+
+    def _store(self, url: str, entry: CachedArticle) -> None:
+        self.cache[url] = entry
+        self.cache.move_to_end(url)
+        while len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+
+url_fetcher = UrlFetcher()